@@ -0,0 +1,308 @@
+"""
+Admission control for timer and event creation.
+
+Every chat gets its own token bucket for the creation rate and a cap
+on the number of jobs it can have pending at once. On top of that
+a global cap on pending jobs sheds load when the whole bot is full.
+All checks are O(1): a dict lookup and a few arithmetic operations.
+
+The limits are read at start from a JSON file, e.g. ADMISSION.json:
+
+    {"rate": 0.5, "burst": 5, "max_pending_per_chat": 100}
+
+limits missing from the file keep their defaults, unknown ones are
+logged and ignored.
+"""
+
+import json
+import logging
+import threading
+
+from bot_organizer.clock import get_clock
+from bot_organizer.metrics import get_metrics
+
+# Default limits, can be changed with AdmissionController.configure
+# or read_admission_settings
+RATE = 1.0                  # new jobs per second per chat
+BURST = 10                  # max tokens stored in a chat bucket
+MAX_PENDING_PER_CHAT = 200  # jobs a single chat can have scheduled
+MAX_PENDING_TOTAL = 100000  # jobs the whole bot can have scheduled
+LIMITS = ('rate', 'burst', 'max_pending_per_chat', 'max_pending_total')
+PRUNE_SLICE = 500           # buckets looked at by one prune_buckets call
+
+RATE_LIMITED = 'rate_limited'
+CHAT_QUOTA = 'chat_quota'
+OVERLOADED = 'overloaded'
+
+REJECT_REPLIES = {
+    RATE_LIMITED: 'Whoa, that\'s a lot of reminders at once! '
+                  'Please, wait a few seconds and try again.',
+    CHAT_QUOTA: 'Sorry, you already have too many active timers and events. '
+                'Please, /unset some of them first.',
+    OVERLOADED: 'Sorry, I\'m very busy right now and can\'t take new '
+                'reminders. Please, try again in a few minutes.',
+}
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Classic token bucket, refilled lazily on every consume call.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def consume(self, now, amount=1):
+        """
+        Try to take `amount` tokens from the bucket.
+
+        :param now: current monotonic time in seconds.
+        :param amount: number of tokens needed.
+
+        :return: True if tokens were taken, False otherwise.
+        """
+        elapsed = now - self.stamp
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.stamp = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def is_full(self, now):
+        """
+        :param now: current monotonic time in seconds.
+
+        :return: True if bucket would be full at `now`, so it can be dropped.
+        """
+        return self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+
+class AdmissionController:
+    """
+    Decides whether a chat may schedule one more job.
+
+    :param rate: refill rate of the per chat bucket, tokens per second.
+    :param burst: capacity of the per chat bucket.
+    :param max_pending_per_chat: cap of pending jobs for one chat.
+    :param max_pending_total: cap of pending jobs for the whole bot.
+    :param timer: function returning monotonic time in seconds.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST,
+                 max_pending_per_chat=MAX_PENDING_PER_CHAT,
+                 max_pending_total=MAX_PENDING_TOTAL,
+                 timer=None):
+        self._lock = threading.Lock()
+        self._buckets = dict()
+        self._pending = dict()
+        self._pending_total = 0
+        self._prune_pass = []
+        self._prune_position = 0
+        self._timer = timer or (lambda: get_clock().monotonic())
+        self.rate = rate
+        self.burst = burst
+        self.max_pending_per_chat = max_pending_per_chat
+        self.max_pending_total = max_pending_total
+
+    def configure(self, **limits):
+        """
+        Change limits at runtime, e.g. ``configure(rate=0.5, burst=5)``.
+        Existing buckets keep their tokens but get the new rate and capacity.
+
+        :param limits: any of rate, burst, max_pending_per_chat,
+                       max_pending_total.
+        """
+        with self._lock:
+            for name, value in limits.items():
+                if name not in LIMITS:
+                    raise TypeError(f'Unknown admission limit: {name}')
+                setattr(self, name, value)
+            for bucket in self._buckets.values():
+                bucket.rate = self.rate
+                bucket.capacity = self.burst
+
+    def admit(self, chat_id, replacing=False):
+        """
+        Check all limits for a new job of `chat_id` and take a token.
+
+        :param chat_id: id of the chat which wants to create a job.
+        :param replacing: True if the job replaces an existing one,
+                          so pending caps are not checked.
+
+        :return: None if admitted, otherwise one of RATE_LIMITED,
+                 CHAT_QUOTA or OVERLOADED.
+        """
+        metrics = get_metrics()
+        with self._lock:
+            if not replacing:
+                if self._pending_total >= self.max_pending_total:
+                    reason = OVERLOADED
+                elif self._pending.get(chat_id, 0) >= self.max_pending_per_chat:
+                    reason = CHAT_QUOTA
+                else:
+                    reason = None
+                if reason is not None:
+                    metrics.inc(f'admission.rejected.{reason}')
+                    return reason
+            now = self._timer()
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self.rate,
+                                                              self.burst, now)
+            if not bucket.consume(now):
+                metrics.inc(f'admission.rejected.{RATE_LIMITED}')
+                return RATE_LIMITED
+        metrics.inc('admission.admitted')
+        return None
+
+    def admit_many(self, chat_id, count):
+        """
+        Check limits for `count` new jobs created by one bulk message.
+        The message takes one token from the bucket, like a single job,
+        pending caps are applied to every job.
+
+        :param chat_id: id of the chat which wants to create jobs.
+        :param count: number of new jobs.
+
+        :return: tuple (number of admitted jobs, reason for the rest or None).
+        """
+        metrics = get_metrics()
+        with self._lock:
+            room_total = self.max_pending_total - self._pending_total
+            room_chat = (self.max_pending_per_chat
+                         - self._pending.get(chat_id, 0))
+            now = self._timer()
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self.rate,
+                                                              self.burst, now)
+            if not bucket.consume(now):
+                metrics.inc(f'admission.rejected.{RATE_LIMITED}')
+                return 0, RATE_LIMITED
+        admitted = max(0, min(count, room_total, room_chat))
+        reason = None
+        if admitted < count:
+            reason = OVERLOADED if room_total < room_chat else CHAT_QUOTA
+            metrics.inc(f'admission.rejected.{reason}', count - admitted)
+        metrics.inc('admission.admitted', admitted)
+        return admitted, reason
+
+    def job_added(self, chat_id):
+        """
+        Register new pending job of `chat_id`.
+
+        :param chat_id: id of the chat owning the job.
+        """
+        with self._lock:
+            self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+            self._pending_total += 1
+            get_metrics().set('jobs.pending', self._pending_total)
+
+    def job_done(self, chat_id):
+        """
+        Register that a pending job of `chat_id` fired or was removed.
+
+        :param chat_id: id of the chat owning the job.
+        """
+        with self._lock:
+            count = self._pending.get(chat_id, 0)
+            if count <= 0:
+                return
+            if count == 1:
+                del self._pending[chat_id]
+            else:
+                self._pending[chat_id] = count - 1
+            self._pending_total -= 1
+            get_metrics().set('jobs.pending', self._pending_total)
+
+    def pending(self, chat_id=None):
+        """
+        :param chat_id: chat to count jobs for, or None for the whole bot.
+
+        :return: number of pending jobs.
+        """
+        with self._lock:
+            if chat_id is None:
+                return self._pending_total
+            return self._pending.get(chat_id, 0)
+
+    def prune_buckets(self, limit=PRUNE_SLICE):
+        """
+        Drop buckets which are full again, they carry no information.
+        Only the next `limit` buckets of a pass over all chats are looked
+        at, so admit() never waits for a walk over every bucket.
+
+        :param limit: number of buckets looked at.
+
+        :return: number of removed buckets.
+        """
+        with self._lock:
+            if self._prune_position >= len(self._prune_pass):
+                # only the list of keys is copied, a new pass starts
+                self._prune_pass = list(self._buckets)
+                self._prune_position = 0
+            end = self._prune_position + limit
+            chat_ids = self._prune_pass[self._prune_position:end]
+            self._prune_position = end
+            now = self._timer()
+            removed = 0
+            for chat_id in chat_ids:
+                bucket = self._buckets.get(chat_id)
+                if bucket is not None and bucket.is_full(now):
+                    del self._buckets[chat_id]
+                    removed += 1
+            return removed
+
+
+controller = AdmissionController()
+
+
+def get_admission():
+    """
+    Function to get the shared admission controller.
+    """
+    return controller
+
+
+def read_admission_settings(filename):
+    """
+    Function to read admission limits from a JSON file, see
+    AdmissionController.configure for their names. Unknown names and
+    values which are not non-negative numbers are logged and ignored.
+
+    :return: dict of limits or None if the file does not exist.
+    """
+    try:
+        with open(filename, 'r') as file:
+            settings = json.load(file)
+    except FileNotFoundError:
+        return None
+    if not isinstance(settings, dict):
+        get_logger().warning(f'Ignoring {filename}, it is not a JSON object.')
+        return dict()
+    limits = dict()
+    for name, value in settings.items():
+        if name not in LIMITS:
+            get_logger().warning(f'Ignoring unknown admission limit {name!r} '
+                                 f'in {filename}.')
+        elif (isinstance(value, bool) or not isinstance(value, (int, float))
+              or value < 0):
+            get_logger().warning(f'Ignoring admission limit {name!r} in '
+                                 f'{filename}, {value!r} is not a '
+                                 f'non-negative number.')
+        else:
+            limits[name] = value
+    return limits
@@ -0,0 +1,147 @@
+"""
+Per chat interval index of active events and timers for /agenda.
+
+Every chat keeps its reminders as intervals [start, end) in a list sorted
+by start, with the longest duration seen in the chat. Events last
+EVENT_DURATION, timers are points (end == start). A query for [start, end)
+bisects the starts to (start - longest duration, end), so it costs
+O(log n + k) and never walks all reminders of the chat:
+
+* between() lists everything due in a range, for /agenda today|week,
+* overlapping() lists events overlapping a new event, timers never
+  overlap anything.
+
+Like the search index it is updated when a job is set, fired or unset.
+"""
+
+import bisect
+import threading
+
+EVENT_DURATION = 60 * 60  # seconds an event is assumed to last
+
+
+class ChatAgenda:
+    """
+    Reminders of one chat sorted by start.
+    """
+    __slots__ = ('starts', 'entries', 'names', 'longest')
+
+    def __init__(self):
+        self.starts = []
+        # (start, name, end), sorted the same way as starts
+        self.entries = []
+        self.names = dict()
+        self.longest = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, name, start, end):
+        """
+        Add reminder `name`, replacing an older one of the same name.
+        """
+        self.remove(name)
+        entry = (start, name, end)
+        index = bisect.bisect_right(self.entries, entry)
+        self.starts.insert(index, start)
+        self.entries.insert(index, entry)
+        self.names[name] = entry
+        # never shrinks, so a query may look at a few more entries
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, name):
+        entry = self.names.pop(name, None)
+        if entry is None:
+            return
+        index = bisect.bisect_left(self.entries, entry)
+        del self.starts[index]
+        del self.entries[index]
+
+    def between(self, start, end):
+        """
+        :return: list of (start, name, end) intersecting [start, end),
+                 in order of start.
+        """
+        first = bisect.bisect_left(self.starts, start - self.longest)
+        last = bisect.bisect_left(self.starts, end)
+        return [entry for entry in self.entries[first:last]
+                if entry[2] > start or entry[0] >= start]
+
+    def overlapping(self, start, end, exclude=None):
+        """
+        :return: list of (start, name, end) of events, not points,
+                 overlapping [start, end), except `exclude`.
+        """
+        first = bisect.bisect_left(self.starts, start - self.longest)
+        last = bisect.bisect_left(self.starts, end)
+        return [entry for entry in self.entries[first:last]
+                if entry[2] > entry[0] and entry[2] > start
+                and entry[1] != exclude]
+
+
+class AgendaIndex:
+    """
+    Thread safe registry of ChatAgenda objects, one per chat.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chats = dict()
+
+    def add(self, chat_id, name, start, duration=0):
+        """
+        :param chat_id: chat owning the reminder.
+        :param name: name of the reminder.
+        :param start: timestamp it is due at.
+        :param duration: seconds it lasts, 0 for timers.
+        """
+        with self._lock:
+            agenda = self._chats.get(chat_id)
+            if agenda is None:
+                agenda = self._chats[chat_id] = ChatAgenda()
+            agenda.add(name, start, start + duration)
+
+    def remove(self, chat_id, name):
+        with self._lock:
+            agenda = self._chats.get(chat_id)
+            if agenda is None:
+                return
+            agenda.remove(name)
+            if not agenda:
+                del self._chats[chat_id]
+
+    def between(self, chat_id, start, end):
+        """
+        :return: list of (start, name, end) of `chat_id` in [start, end).
+        """
+        with self._lock:
+            agenda = self._chats.get(chat_id)
+            return [] if agenda is None else agenda.between(start, end)
+
+    def overlapping(self, chat_id, start, end, exclude=None):
+        """
+        :return: list of (start, name, end) of events of `chat_id`
+                 overlapping [start, end), except `exclude`.
+        """
+        with self._lock:
+            agenda = self._chats.get(chat_id)
+            if agenda is None:
+                return []
+            return agenda.overlapping(start, end, exclude)
+
+    def clear(self):
+        """
+        Forget all chats. Used mostly by tests.
+        """
+        with self._lock:
+            self._chats.clear()
+
+
+index = AgendaIndex()
+
+
+def get_agenda():
+    """
+    Function to get the shared agenda index.
+    """
+    return index
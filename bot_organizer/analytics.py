@@ -0,0 +1,422 @@
+"""
+Columnar view of the schedule for bulk validation and nightly analytics.
+
+ScheduleColumns keeps pending alarms as three NumPy arrays (due time,
+chat id and kind, the index of the delivery priority class in KINDS),
+so questions like "how many alarms fire per minute tomorrow" or "which
+chats have clustered reminders" are answered by a few array operations
+instead of a Python loop over Job objects.
+
+NumPy is only needed by this module, the bot itself runs without it.
+
+Offline use:
+
+    python -m bot_organizer.analytics histogram snapshot.json --day 2030-01-02
+    python -m bot_organizer.analytics hotspots snapshot.json --window 600 --count 5
+    python -m bot_organizer.analytics check events.txt
+"""
+
+import argparse
+import json
+import logging
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bot_organizer.clock import get_clock
+from bot_organizer.phrases import parse_duration, parse_when, split_phrase
+from bot_organizer.timezones import get_zone, LOCAL
+from bot_organizer.delivery import IMMINENT, SHORT_TIMER, BULK, DIGEST
+
+KINDS = (IMMINENT, SHORT_TIMER, BULK, DIGEST)
+UNKNOWN_KIND = -1
+ALARM_CALLBACK = 'alarm'
+
+# reasons of validate_dates and validate_dues, 0 means valid
+VALID = 0
+BAD_FORMAT = 1
+PAST = 2
+REASONS = {BAD_FORMAT: 'wrong format', PAST: 'date is in the past'}
+
+# 'YYYY-MM-DD HH:MM:SS', the DATE_TIME_FORMAT of the bot
+DATE_TIME_WIDTH = 19
+DIGITS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])
+SEPARATORS = {4: '-', 7: '-', 10: ' ', 13: ':', 16: ':'}
+SECONDS_PER_DAY = 24 * 60 * 60
+MAX_DUE_DIGITS = 18  # longer dues do not fit into int64
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def kind_of(priority):
+    """
+    :return: index of the priority class in KINDS,
+             UNKNOWN_KIND if it is not there.
+    """
+    try:
+        return KINDS.index(priority)
+    except ValueError:
+        return UNKNOWN_KIND
+
+
+class ScheduleColumns:
+    """
+    Pending alarms as parallel arrays, sorted by due time.
+
+    :param due: timestamps of the alarms.
+    :param chat: chat ids owning the alarms.
+    :param kind: indexes of the priority classes in KINDS.
+    """
+
+    def __init__(self, due, chat, kind):
+        due = np.asarray(due, dtype=np.float64)
+        order = np.argsort(due, kind='stable')
+        self.due = due[order]
+        self.chat = np.asarray(chat, dtype=np.int64)[order]
+        self.kind = np.asarray(kind, dtype=np.int8)[order]
+
+    def __len__(self):
+        return len(self.due)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        :param rows: iterable of (due, chat_id, priority), e.g. the rows
+                     of a JobStore query.
+        """
+        rows = list(rows)
+        count = len(rows)
+        return cls(np.fromiter((row[0] for row in rows), np.float64, count),
+                   np.fromiter((row[1] for row in rows), np.int64, count),
+                   np.fromiter((kind_of(row[2]) for row in rows), np.int8,
+                               count))
+
+    @classmethod
+    def from_jobs(cls, jobs):
+        """
+        :param jobs: jobs of the job queue, only pending alarms are taken.
+        """
+        return cls.from_rows(
+            (job.next_t.timestamp(), job.context[0], job.context[4])
+            for job in jobs
+            if not job.removed and job.next_t is not None
+            and getattr(job.callback, '__name__', None) == ALARM_CALLBACK)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        :param snapshot: dict built by make_snapshot.
+        """
+        return cls.from_rows(
+            (due, chat_id, priority[0] if priority else IMMINENT)
+            for chat_id, _name, _message, due, *priority in snapshot['jobs'])
+
+    def between(self, start, end):
+        """
+        :return: slice of the arrays with alarms due in [start, end).
+        """
+        return slice(np.searchsorted(self.due, start, 'left'),
+                     np.searchsorted(self.due, end, 'left'))
+
+    def kind_counts(self):
+        """
+        :return: dict {priority class: number of alarms}.
+        """
+        counts = np.bincount(self.kind[self.kind >= 0], minlength=len(KINDS))
+        return dict(zip(KINDS, counts.tolist()))
+
+
+def firing_histogram(columns, start, end, bin_seconds=60):
+    """
+    Number of alarms firing in every bin of [start, end).
+
+    :param columns: ScheduleColumns of the schedule.
+    :param start: timestamp of the first bin.
+    :param end: timestamp the last bin ends at.
+    :param bin_seconds: width of one bin, a minute by default.
+
+    :return: array of counts, one per bin.
+    """
+    bins = int(np.ceil((end - start) / bin_seconds))
+    due = columns.due[columns.between(start, end)]
+    index = ((due - start) // bin_seconds).astype(np.int64)
+    return np.bincount(index, minlength=bins)[:bins]
+
+
+def busiest_bins(histogram, top=10):
+    """
+    :return: list of (bin index, count) of the `top` fullest bins,
+             fullest first.
+    """
+    top = min(top, len(histogram))
+    if not top:
+        return []
+    index = np.argpartition(histogram, -top)[-top:]
+    index = index[np.argsort(-histogram[index], kind='stable')]
+    return [(int(bin_), int(histogram[bin_])) for bin_ in index
+            if histogram[bin_]]
+
+
+def hot_spots(columns, window=10 * 60, count=5):
+    """
+    Chats with `count` or more alarms due within `window` seconds.
+
+    :param columns: ScheduleColumns of the schedule.
+    :param window: seconds the alarms are clustered in.
+    :param count: alarms which make a cluster.
+
+    :return: dict {chat id: number of clusters starting at its alarms}.
+    """
+    if count < 2 or len(columns) < count:
+        return dict()
+    order = np.lexsort((columns.due, columns.chat))
+    chat = columns.chat[order]
+    due = columns.due[order]
+    # alarm i and alarm i+count-1 of the same chat close enough
+    last = count - 1
+    clustered = ((chat[last:] == chat[:-last])
+                 & (due[last:] - due[:-last] <= window))
+    chats, clusters = np.unique(chat[:-last][clustered], return_counts=True)
+    return dict(zip(chats.tolist(), clusters.tolist()))
+
+
+def zone_timestamps(wall, zone):
+    """
+    Convert wall clock seconds of `zone` (as if the zone was UTC) to
+    timestamps, the vectorized ZoneTable.to_epoch: skipped times land
+    after the change, repeated times mean the earlier one.
+
+    :param wall: array of wall clock seconds since 1970-01-01 00:00.
+    :param zone: ZoneTable the wall clock times are in.
+
+    :return: float array of timestamps.
+    """
+    starts = np.asarray(zone.starts, dtype=np.float64)
+    offsets = np.asarray(zone.offsets, dtype=np.float64)
+    local_starts = np.asarray(zone.local_starts, dtype=np.float64)
+    index = np.maximum(np.searchsorted(local_starts, wall, side='right') - 1,
+                       0)
+    earlier = np.maximum(index - 1, 0)
+    repeated = (index > 0) & (wall - offsets[earlier] < starts[index])
+    return wall - offsets[np.where(repeated, earlier, index)]
+
+
+def parse_dates(texts, zone=None):
+    """
+    Parse many 'YYYY-MM-DD HH:MM:SS' wall clock strings at once.
+
+    :param texts: sequence of strings.
+    :param zone: ZoneTable the dates are in, zone of the server by default.
+
+    :return: float array of timestamps and bool array of strings which
+             are valid dates, timestamps of invalid ones are NaN.
+    """
+    zone = zone or get_zone(LOCAL)
+    texts = np.asarray(texts, dtype=str).reshape(-1)
+    due = np.full(len(texts), np.nan)
+    if not len(texts):
+        return due, np.zeros(0, dtype=bool)
+    # code points of every character, one row per string
+    codes = (texts.astype(f'U{DATE_TIME_WIDTH}').view(np.uint32)
+             .reshape(len(texts), DATE_TIME_WIDTH).astype(np.int64))
+    valid = np.char.str_len(texts) == DATE_TIME_WIDTH
+    digits = codes[:, DIGITS] - ord('0')
+    valid &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+    for position, separator in SEPARATORS.items():
+        valid &= codes[:, position] == ord(separator)
+    digits = np.where(valid[:, None], digits, 0)
+    year = (digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10
+            + digits[:, 3])
+    month, day, hour, minute, second = (
+        digits[:, column] * 10 + digits[:, column + 1]
+        for column in range(4, 14, 2))
+    valid &= ((year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+              & (hour <= 23) & (minute <= 59) & (second <= 59))
+    first_day = ((np.where(valid, year, 1970) - 1970) * 12
+                 + np.where(valid, month, 1) - 1).astype('datetime64[M]')
+    month_days = ((first_day + 1).astype('datetime64[D]')
+                  - first_day.astype('datetime64[D]')).astype(np.int64)
+    valid &= day <= month_days
+    days = (first_day.astype('datetime64[D]').astype(np.int64) + day - 1)
+    wall = days * SECONDS_PER_DAY + hour * 3600 + minute * 60 + second
+    due[valid] = zone_timestamps(wall[valid].astype(np.float64), zone)
+    return due, valid
+
+
+def validate_dates(texts, now=None, zone=None):
+    """
+    Vectorized form of the date checks of event_date and parse_event_args.
+    Exact 'YYYY-MM-DD HH:MM:SS' dates are read as arrays, the others,
+    e.g. 'tomorrow 9:00', one by one by phrases.parse_when, like the bot
+    reads them.
+
+    :param texts: sequence of date strings or time phrases.
+    :param now: timestamp dates must not be before, now by default.
+    :param zone: ZoneTable of the chat, zone of the server by default.
+
+    :return: float array of timestamps and int array of reasons,
+             VALID for good dates.
+    """
+    if now is None:
+        now = get_clock().time()
+    zone = zone or get_zone(LOCAL)
+    texts = np.asarray(texts, dtype=str).reshape(-1)
+    due, valid = parse_dates(texts, zone)
+    for index in np.flatnonzero(~valid).tolist():
+        try:
+            due[index] = parse_when(texts[index], now, zone)
+        except ValueError:
+            continue
+        valid[index] = True
+    reasons = np.where(valid, VALID, BAD_FORMAT)
+    reasons[valid & (due < now)] = PAST
+    return due, reasons
+
+
+def validate_dues(texts, now=None, zone=None):
+    """
+    Vectorized form of the due checks of timer_due and parse_timer_args.
+    Whole seconds are read as arrays, the others, e.g. '00:10:00' or
+    'in 15m', one by one by phrases.parse_duration.
+
+    :param texts: sequence of due strings.
+    :param now: timestamp phrases are read at, now by default.
+    :param zone: ZoneTable of the chat, zone of the server by default.
+
+    :return: int array of seconds and int array of reasons,
+             VALID for good dues.
+    """
+    texts = np.char.strip(np.asarray(texts, dtype=str).reshape(-1))
+    negative = np.char.startswith(texts, '-')
+    magnitude = np.where(negative, np.char.lstrip(texts, '-'), texts)
+    # only ASCII digits, not too many for int64
+    lengths = np.char.str_len(magnitude)
+    digits = ((lengths > 0) & (lengths <= MAX_DUE_DIGITS)
+              & (np.char.str_len(np.char.strip(magnitude, '0123456789')) == 0))
+    seconds = np.zeros(len(texts), dtype=np.int64)
+    seconds[digits] = magnitude[digits].astype(np.int64)
+    seconds[negative] *= -1
+    others = np.flatnonzero(~digits & (lengths > 0)).tolist()
+    if others:
+        if now is None:
+            now = get_clock().time()
+        zone = zone or get_zone(LOCAL)
+    for index in others:
+        text = str(texts[index])
+        if text.lstrip('-').isdigit():
+            # too long for int64, or not ASCII digits
+            continue
+        try:
+            seconds[index] = parse_duration(text, now, zone)
+        except ValueError:
+            continue
+        digits[index] = True
+    reasons = np.where(digits, VALID, BAD_FORMAT)
+    reasons[digits & (seconds < 0)] = PAST
+    return seconds, reasons
+
+
+def check_lines(lines, now=None, zone=None):
+    """
+    Validate dates of event lines in the /new_events format. A date is
+    the longest phrase a line starts with, like in parse_event_args.
+
+    :param lines: lines starting with date and time.
+    :param now: timestamp dates must not be before, now by default.
+    :param zone: ZoneTable of the chat, zone of the server by default.
+
+    :return: list of (line number, line, reason) of rejected lines.
+    """
+    if now is None:
+        now = get_clock().time()
+    zone = zone or get_zone(LOCAL)
+    lines = [(number, line.strip()) for number, line in enumerate(lines, 1)
+             if line.strip() and not line.strip().startswith('#')]
+    # most lines start with an exact date, checked at once
+    dates = [' '.join(line.split()[:2]) for _, line in lines]
+    _, reasons = validate_dates(dates, now, zone)
+    rejected = []
+    for (number, line), reason in zip(lines, reasons.tolist()):
+        if reason == BAD_FORMAT:
+            try:
+                timestamp, rest = split_phrase(
+                    line.split(), lambda text: parse_when(text, now, zone))
+                reason = PAST if timestamp < now else VALID
+            except ValueError:
+                reason = BAD_FORMAT
+        if reason != VALID:
+            rejected.append((number, line, REASONS[reason]))
+    return rejected
+
+
+def read_columns(filename):
+    """
+    :return: ScheduleColumns of the jobs of a snapshot file.
+    """
+    with open(filename, encoding='utf-8') as file:
+        return ScheduleColumns.from_snapshot(json.load(file))
+
+
+def parse_day(text):
+    """
+    :return: timestamp of local midnight of YYYY-MM-DD `text`.
+    """
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+def main(argv=None):
+    """
+    Offline analytics of a snapshot and checks of import files.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.analytics',
+        description='Analyse scheduled alarms and check import files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    histogram = commands.add_parser('histogram',
+                                    help='alarms firing per minute of a day')
+    histogram.add_argument('snapshot')
+    histogram.add_argument('--day', type=parse_day, help='YYYY-MM-DD')
+    histogram.add_argument('--top', type=int, default=10)
+    spots = commands.add_parser('hotspots',
+                                help='chats with clustered reminders')
+    spots.add_argument('snapshot')
+    spots.add_argument('--window', type=float, default=10 * 60)
+    spots.add_argument('--count', type=int, default=5)
+    check = commands.add_parser('check', help='dates of an events file')
+    check.add_argument('file')
+    check.add_argument('--zone', type=get_zone, default=LOCAL,
+                       help='Area/City the dates are in, e.g. Europe/Warsaw')
+    args = parser.parse_args(argv)
+    if args.command == 'check':
+        with open(args.file, encoding='utf-8') as file:
+            rejected = check_lines(file, zone=args.zone)
+        for number, line, reason in rejected:
+            print(number, reason, line, sep='\t')
+        return 1 if rejected else 0
+    columns = read_columns(args.snapshot)
+    if args.command == 'histogram':
+        start = args.day
+        if start is None:
+            start = parse_day((get_clock().now() + timedelta(days=1))
+                              .strftime('%Y-%m-%d'))
+        counts = firing_histogram(columns, start, start + SECONDS_PER_DAY)
+        for minute, count in busiest_bins(counts, args.top):
+            time = datetime.fromtimestamp(start + minute * 60)
+            print(time.strftime('%H:%M'), count, sep='\t')
+        print('total', int(counts.sum()), sep='\t')
+    else:
+        for chat_id, clusters in sorted(
+                hot_spots(columns, args.window, args.count).items(),
+                key=lambda item: -item[1]):
+            print(chat_id, clusters, sep='\t')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
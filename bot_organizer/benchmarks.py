@@ -0,0 +1,390 @@
+"""
+Microbenchmarks of the hot paths of the bot, with a history of results.
+
+Every benchmark is a setup function registered with @benchmark. It is
+called with the number of calls of one round, prepares fresh state (a
+VirtualClock, a Scheduler, chat_data, a stub update and bot) and returns
+step(i), the code being measured. Setup is not timed, so e.g. `unset`
+and `alarm` measure removing and firing jobs scheduled beforehand.
+
+`run` times every benchmark and appends one JSON line to the history:
+
+    {"time": ..., "label": "...", "commit": "...", "python": "3.11.4",
+     "baseline": false, "results": {"set_timer": {"min": 21.3,
+     "median": 22.0, "number": 2000}, ...}}
+
+with microseconds per call, the minimum and median of the rounds.
+`compare` compares the last record against a baseline and exits with 1
+if any benchmark got slower by more than its threshold:
+
+    python -m bot_organizer.benchmarks run --baseline --label master
+    python -m bot_organizer.benchmarks run --label my-change
+    python -m bot_organizer.benchmarks compare
+
+The minimum of the rounds is compared, it is the least noisy estimate.
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from bot_organizer import admission, agenda, search
+from bot_organizer import bot_organizer as bo
+from bot_organizer.clock import VirtualClock, get_clock, set_clock
+from bot_organizer.replay import StubBot
+from bot_organizer.scheduler import Scheduler
+from bot_organizer.timezones import get_zone
+
+HISTORY_FILENAME = 'benchmarks.jsonl'
+NUMBER = 2000        # calls of a benchmark in one round
+ROUNDS = 5
+THRESHOLD = 0.25     # allowed slowdown relative to the baseline
+# benchmarks of a few microseconds, too short to be measured as precisely
+THRESHOLDS = {'event_notif_str': 0.5, 'timer_notif_str': 0.5,
+              'event_date': 0.5, 'event_date_phrase': 0.5, 'timer_due': 0.5}
+START = 1893456000   # 2030-01-01 00:00:00 UTC, virtual time of every round
+BENCHMARKS = dict()
+chat_ids = itertools.count(1)
+
+
+def benchmark(name):
+    """
+    Register the decorated setup function as benchmark `name`.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class StubUser:
+    id = 1
+    first_name = 'Bench'
+
+
+class StubMessage:
+    """
+    Message of a StubUpdate, replies are dropped.
+    """
+
+    def __init__(self, chat_id, text=''):
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = StubUser()
+
+    def reply_text(self, *_args, **_kwargs):
+        pass
+
+
+class StubUpdate:
+
+    def __init__(self, chat_id, text=''):
+        self.message = StubMessage(chat_id, text)
+
+
+def prepare():
+    """
+    Fresh shared state for a round: virtual clock, admission controller
+    without limits, empty search and agenda indexes. run_all puts the
+    previous ones back.
+
+    :return: id of a chat not used by any other round.
+    """
+    set_clock(VirtualClock(START))
+    admission.controller = admission.AdmissionController(
+        rate=10 ** 9, burst=10 ** 9, max_pending_per_chat=10 ** 9,
+        max_pending_total=10 ** 9)
+    search.index = search.SearchIndex()
+    agenda.index = agenda.AgendaIndex()
+    return next(chat_ids)
+
+
+def event_entry(name, date):
+    return {bo.NAME: name, bo.DATE: date, bo.LOC: 'Main street 5',
+            bo.MSG: 'Bring the documents'}
+
+
+def timer_entry(name):
+    return {bo.NAME: name, bo.DUE: 600, bo.MSG: 'Tea is ready'}
+
+
+def scheduled_timers(number):
+    """
+    :return: (stub update, scheduler, chat_data) with `number` timers
+             named t0, t1, ... set.
+    """
+    update = StubUpdate(prepare())
+    scheduler = Scheduler(bot=StubBot())
+    chat_data = dict()
+    for i in range(number):
+        chat_data[bo.LTE] = timer_entry(f't{i}')
+        bo.set_timer(update, scheduler, chat_data)
+    return update, scheduler, chat_data
+
+
+@benchmark('event_notif_str')
+def bench_event_notif_str(_number):
+    prepare()
+    entry = event_entry('dentist', START + 3600)
+    zone = get_zone()
+    return lambda _i: bo.event_notif_str(entry, zone)
+
+
+@benchmark('timer_notif_str')
+def bench_timer_notif_str(_number):
+    prepare()
+    entry = timer_entry('tea')
+    return lambda _i: bo.timer_notif_str(entry)
+
+
+@benchmark('event_date')
+def bench_event_date(_number):
+    update = StubUpdate(prepare(), '2030-01-02 12:00:00')
+    chat_data = {bo.LEE: {bo.NAME: 'dentist'}}
+    return lambda _i: bo.event_date(None, update, chat_data)
+
+
+@benchmark('event_date_phrase')
+def bench_event_date_phrase(_number):
+    update = StubUpdate(prepare(), 'next monday 14:30')
+    chat_data = {bo.LEE: {bo.NAME: 'dentist'}}
+    return lambda _i: bo.event_date(None, update, chat_data)
+
+
+@benchmark('new_event_args')
+def bench_new_event_args(_number):
+    prepare()
+    args = ['2030-01-02', '12:00:00', 'dentist', 'centre', 'bring', 'card']
+    zone = get_zone()
+    return lambda _i: bo.parse_event_args(args, zone)
+
+
+@benchmark('timer_due')
+def bench_timer_due(_number):
+    update = StubUpdate(prepare(), '00:10:00')
+    chat_data = {bo.LTE: {bo.NAME: 'tea'}}
+    return lambda _i: bo.timer_due(None, update, chat_data)
+
+
+@benchmark('set_event')
+def bench_set_event(_number):
+    update = StubUpdate(prepare())
+    scheduler = Scheduler(bot=StubBot())
+    chat_data = dict()
+
+    def step(i):
+        chat_data[bo.LEE] = event_entry(f'event {i}', START + 3600 + 7200 * i)
+        bo.set_event(update, scheduler, chat_data)
+    return step
+
+
+@benchmark('set_timer')
+def bench_set_timer(_number):
+    update = StubUpdate(prepare())
+    scheduler = Scheduler(bot=StubBot())
+    chat_data = dict()
+
+    def step(i):
+        chat_data[bo.LTE] = timer_entry(f'timer {i}')
+        bo.set_timer(update, scheduler, chat_data)
+    return step
+
+
+@benchmark('unset')
+def bench_unset(number):
+    update, _, chat_data = scheduled_timers(number)
+    names = [[f't{i}'] for i in range(number)]
+    return lambda i: bo.unset(None, update, names[i], chat_data)
+
+
+@benchmark('alarm')
+def bench_alarm(number):
+    _, scheduler, _ = scheduled_timers(number)
+    bot = StubBot()
+    jobs = list(scheduler.jobs())
+    return lambda i: bo.alarm(bot, jobs[i])
+
+
+def measure(setup, number=NUMBER, rounds=ROUNDS):
+    """
+    Time `rounds` rounds after one warm-up round, like timeit with the
+    garbage collector off.
+
+    :return: microseconds per call of every round.
+    """
+    timings = []
+    for _ in range(rounds + 1):
+        step = setup(number)
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            for i in range(number):
+                step(i)
+            elapsed = time.perf_counter() - started
+        finally:
+            if enabled:
+                gc.enable()
+        timings.append(1e6 * elapsed / number)
+    return timings[1:]
+
+
+def run_all(names=None, number=NUMBER, rounds=ROUNDS):
+    """
+    Run benchmarks with logging off, the shared state replaced by
+    prepare() is restored after.
+
+    :param names: names of the benchmarks, all if None.
+
+    :return: dict of benchmark name to its min, median and number.
+    """
+    results = dict()
+    clock = get_clock()
+    shared = admission.controller, search.index, agenda.index
+    logging.disable(logging.CRITICAL)
+    try:
+        for name in names or BENCHMARKS:
+            timings = measure(BENCHMARKS[name], number, rounds)
+            results[name] = {'min': round(min(timings), 3),
+                             'median': round(statistics.median(timings), 3),
+                             'number': number}
+    finally:
+        logging.disable(logging.NOTSET)
+        set_clock(clock)
+        admission.controller, search.index, agenda.index = shared
+    return results
+
+
+def git_commit():
+    """
+    :return: short hash of the checked out commit, None outside of git.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def append_record(filename, record):
+    with open(filename, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+
+
+def read_history(filename):
+    """
+    :return: list of records of the history file, oldest first.
+    """
+    if not os.path.exists(filename):
+        return []
+    with open(filename, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def pick_baseline(records, label=None):
+    """
+    :param records: history records, oldest first, without the current one.
+    :param label: label of the wanted baseline.
+
+    :return: the last record with `label`, or without a label the last
+             record run with --baseline, or the first record; None if
+             there is no such record.
+    """
+    if label is not None:
+        matching = [record for record in records if record['label'] == label]
+    else:
+        matching = [record for record in records if record['baseline']]
+        if not matching:
+            matching = records[:1]
+    return matching[-1] if matching else None
+
+
+def compare(baseline, current, threshold=None):
+    """
+    :param baseline: results of the baseline record.
+    :param current: results of the compared record.
+    :param threshold: allowed slowdown of every benchmark, THRESHOLD
+                      and THRESHOLDS if None.
+
+    :return: list of (name, baseline us, current us, change, regressed)
+             of benchmarks in both results.
+    """
+    rows = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        limit = threshold if threshold is not None else THRESHOLDS.get(
+            name, THRESHOLD)
+        before, after = baseline[name]['min'], result['min']
+        change = after / before - 1 if before > 0 else 0.0
+        rows.append((name, before, after, change, change > limit))
+    return rows
+
+
+def main(argv=None):
+    """
+    Run the benchmarks or compare results against a baseline.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.benchmarks',
+        description='Benchmark hot paths and detect regressions.')
+    parser.add_argument('--history', default=HISTORY_FILENAME)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='append results to the history')
+    run.add_argument('names', nargs='*', metavar='name',
+                     help=f'benchmarks to run, all by default: '
+                          f'{", ".join(BENCHMARKS)}')
+    run.add_argument('--label', default='')
+    run.add_argument('--baseline', action='store_true',
+                     help='mark the record as the baseline of compare')
+    run.add_argument('--number', type=int, default=NUMBER)
+    run.add_argument('--rounds', type=int, default=ROUNDS)
+    check = commands.add_parser('compare',
+                                help='compare the last record to a baseline')
+    check.add_argument('--baseline', metavar='LABEL',
+                       help='label of the baseline record')
+    check.add_argument('--threshold', type=float,
+                       help=f'allowed slowdown, default {THRESHOLD}')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        unknown = set(args.names) - set(BENCHMARKS)
+        if unknown:
+            parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+        results = run_all(args.names, args.number, args.rounds)
+        append_record(args.history, {
+            'time': int(time.time()), 'label': args.label,
+            'commit': git_commit(), 'python': platform.python_version(),
+            'baseline': args.baseline, 'results': results})
+        for name, result in results.items():
+            print(f'{name:<20}{result["min"]:>10.2f} us'
+                  f'{result["median"]:>10.2f} us')
+        return 0
+    records = read_history(args.history)
+    if not records:
+        print(f'No results in {args.history}.')
+        return 1
+    current = records[-1]
+    baseline = pick_baseline(records[:-1], args.baseline)
+    if baseline is None:
+        print('No baseline to compare with.')
+        return 1
+    regressed = False
+    for name, before, after, change, slower in compare(
+            baseline['results'], current['results'], args.threshold):
+        regressed = regressed or slower
+        print(f'{name:<20}{before:>10.2f} us{after:>10.2f} us'
+              f'{change:>+9.1%}{"  REGRESSION" if slower else ""}')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,17 +12,51 @@ write tests in pytest, use travis and generate docs with sphinx.
 Writen by Artemii Hrynevych and Mateusz Tarasek.
 """
 
+import argparse
+import contextlib
+import functools
+import json
 import logging
-from datetime import datetime
+import os
 from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove)
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters, 
                           RegexHandler, ConversationHandler)
+from bot_organizer.admission import (get_admission, read_admission_settings,
+                                    REJECT_REPLIES, RATE_LIMITED)
+from bot_organizer.sweeper import ChatDataSweeper, STARTED
+from bot_organizer.stats import (get_stats, format_stats, job_created,
+                                 job_finished, start_http_server)
+from bot_organizer.lifecycle import (read_snapshot, register_drain,
+                                     run_until_stopped)
+from bot_organizer.clock import get_clock
+from bot_organizer.scheduler import Scheduler, epoch_seconds
+from bot_organizer.mailer import (get_mailer, configure_mailer,
+                                  read_smtp_settings)
+from bot_organizer.delivery import (get_delivery, configure_delivery,
+                                    SHORT_TIMER, IMMINENT, DIGEST, BULK)
+from bot_organizer.history import (get_history, configure_history, record_job,
+                                   HISTORY_DIRNAME)
+from bot_organizer.search import get_search
+from bot_organizer.agenda import get_agenda, EVENT_DURATION
+from bot_organizer.digest import (get_digest, slot_start, HOURLY, DAILY,
+                                  DAILY_TIME)
+from bot_organizer.timezones import get_zone, LOCAL
+from bot_organizer.phrases import parse_when, parse_duration, split_phrase
+from bot_organizer.replies import StaticReply
+from bot_organizer.profiler import (get_profiler, write_profile,
+                                    PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+from bot_organizer.tiered import TieredScheduler, JobStore, JOBS_FILENAME
+from bot_organizer import offsets, polling, failover, dispatch, replay
+from bot_organizer.failover import record_added, record_removed
 
 #------------------------------------------------------------------------------
 # Global variables + general functions.
 #------------------------------------------------------------------------------
 
 TOKEN_FILENAME = 'TOKEN.txt' # replace with the path to the file with token to your bot
+ADMINS_FILENAME = 'ADMINS.txt' # file with telegram user ids allowed to use /stats, one per line
+ADMIN_IDS = set()
+SNAPSHOT_FILENAME = 'snapshot.json' # jobs and chat settings saved on shutdown
 EVENT_NAME, EVENT_DATE, EVENT_LOC, EVENT_MSG = range(4)
 TIMER_NAME, TIMER_DUE, TIMER_MSG = range(4, 7)
 
@@ -39,10 +73,81 @@ DATE_FORMAT = '%Y-%m-%d'
 TIME_FORMAT = '%H:%M:%S'
 DATE_TIME_FORMAT = ' '.join((DATE_FORMAT, TIME_FORMAT))
 JOB_STR_END = '_job'
+DATE_EXAMPLES = (f'"{DATE_TIME_FORMAT}", "tomorrow 9:00" or '
+                 '"next monday 14:30"')
+DUE_EXAMPLES = '"HH:MI:SS", seconds, "in 15m" or "tomorrow 9:00"'
+PAST_DATE = 'date is in the past'
+EMAIL_ADDRESS = 'email' # chat_data key of the address for email reminders
+TIMEZONE = 'timezone' # chat_data key of the time zone dates of the chat are in
+DIGEST_MODE = 'digest' # chat_data key of the digest mode of the chat, hourly or daily
+DIGEST_MODES = (HOURLY, DAILY)
+DIGEST_TIME_FORMAT = '%H:%M' # time shown before every reminder of a digest
+MAX_MESSAGE_LENGTH = 4096 # longest telegram message, longer digests are split
+CHANNELS = 'channels' # chat_data key of {name: channel} for not telegram reminders
+TELEGRAM, EMAIL_CHANNEL, BOTH_CHANNELS = 'telegram', 'email', 'both'
+DELIVERY_CHANNELS = (TELEGRAM, EMAIL_CHANNEL, BOTH_CHANNELS)
+SMTP_FILENAME = 'SMTP.json' # Mailer settings, email reminders are off without it
+ADMISSION_FILENAME = 'ADMISSION.json' # admission limits, the defaults without it
+SHORT_TIMER_MAX = 10 * 60 # timers up to this many seconds get the highest priority
+# (seconds until due up to, seconds an alarm may fire late by), every slack
+# divides the next one, so buckets of different slacks share wakeups too
+SLACK_TIERS = ((SHORT_TIMER_MAX, 1), (3600, 5), (24 * 3600, 30))
+MAX_SLACK = 60 # slack of alarms due in more than a day
+MAX_BULK_LINES = 500 # entries in one /new_events or /new_timers message or file
+MAX_BULK_BYTES = 64 * 1024 # size of a file with bulk entries
+BULK_USAGE = ('Usage: one event or timer per line, same as for one message set:\n'
+              '/new_timers\n<due> [timer_name] [timer_message]\n...\n'
+              '/new_events\n<date_time> <event_name> [event_loc] [event_msg]\n...\n'
+              'You can also send a text file with /new_timers or /new_events'
+              ' as its caption.')
+AGENDA_LIMIT = 50 # reminders listed by /agenda at most
+AGENDA_RANGES = {'today', 'week'}
+EVENT_PREFIX = 'Event: ' # first line of every event notification
+HISTORY_LIMIT = 10 # records shown by /history by default
+MAX_HISTORY_LIMIT = 50 # records shown by /history at most
+CONVERSATION_TIMEOUT = 15 * 60 # seconds of silence before /event or /timer entry is dropped
+SWEEP_INTERVAL = 60 # seconds between two slices of the chat_data sweeper
 
 start_reply_keyboard = [['/event','/timer'], ['/cancel','/help']]
 start_markup = ReplyKeyboardMarkup(start_reply_keyboard, one_time_keyboard=False)
 
+# replies which never change, their request bodies are serialized once
+START_REPLY = StaticReply('Hi! I\'m organizer helper bot!\n'
+                          'Write /help to see all available commands.',
+                          reply_markup=start_markup)
+HELP_REPLY = StaticReply('Currently you can use only:\n'
+                         '/new_timer <due> [timer_name] [timer_message]'
+                         f' - to set timer, due like {DUE_EXAMPLES}.\n'
+                         '/new_event <date_time> <event_name> [event_loc]'
+                         f' [event_msg] - to create an new event, date_time'
+                         f' like {DATE_EXAMPLES}.\n'
+                         '/event to create new event using conversation'
+                         ' handler.\n'
+                         '/timer to create new timer using conversation'
+                         ' handler.\n'
+                         '/new_timers and /new_events - to set many timers'
+                         ' or events at once, one per line.\n'
+                         '/email <address> and /via <name> <telegram|email|both>'
+                         ' - to get a reminder by email.\n'
+                         '/find <text> - to look for a timer or event.\n'
+                         '/history [count] - to see your last reminders.\n'
+                         '/agenda [today|week] - to see what is coming.\n'
+                         '/timezone <Area/City> - to enter dates in your'
+                         ' time zone.\n'
+                         '/digest <hourly|daily|off> - to get the reminders'
+                         ' of the next hour or day together, ahead of'
+                         ' time.\n'
+                         '/unset <name> to unset timer/event.')
+UNKNOWN_REPLY = StaticReply('Sorry, I didn\'t understand that command.')
+PAST_DATE_REPLY = StaticReply('Sorry we can not go back to future!')
+NEW_EVENT_USAGE = StaticReply('Usage: /new_event <date_time> <event_name> '
+                              '[event_loc] [event_msg]\n'
+                              f'date_time like {DATE_EXAMPLES}.\n'
+                              'All data must be in the correct order!')
+NEW_TIMER_USAGE = StaticReply(
+    'Usage: /new_timer <due> [timer_name] [timer_message]\n'
+    f'due like {DUE_EXAMPLES}.')
+
 
 def get_logger():
     """ 
@@ -61,11 +166,34 @@ def read_token(filename):
         token = file.readline().strip()
         return token
 
+
+def read_admins(filename):
+    """
+    Function to get set of admin user ids from a file, one id per line.
+    Missing file means there are no admins.
+    """
+    try:
+        with open(filename, 'r') as file:
+            return {int(line) for line in file if line.strip()}
+    except FileNotFoundError:
+        get_logger().warning(f'No {filename} file, /stats is disabled.')
+        return set()
+
 #------------------------------------------------------------------------------
 # Code block for the event conversation handler.
 #------------------------------------------------------------------------------
 
 
+def touch_entry(entry):
+    """
+    Function to stamp a conversation entry with the time of the last
+    reply, the sweeper drops entries not touched for max_age.
+
+    :param entry: LEE or LTE dict of chat_data.
+    """
+    entry[STARTED] = get_clock().monotonic()
+
+
 def event(_bot, update, chat_data):
     """
     New event entry start function
@@ -77,7 +205,8 @@ def event(_bot, update, chat_data):
     :return: EVENT_NAME token for conversation handler to move on.
     """
     chat_data[LEE] = {NAME: None, DATE: None,
-                      LOC: None, MSG: None}
+                      LOC: None, MSG: None,
+                      STARTED: get_clock().monotonic()}
     user = update.message.from_user
     get_logger().info(f'{user.first_name} started new event entry.')
     update.message.reply_text('Ok.Let\'s create new event!\n'
@@ -98,12 +227,13 @@ def event_name(_bot, update, chat_data):
 
     :return: EVENT_DATE token for conversation handler to move on.
     """
+    touch_entry(chat_data[LEE])
     user = update.message.from_user
     chat_data[LEE][NAME] = update.message.text
     get_logger().info(f'{user.first_name}\'s event name: {update.message.text}')
     update.message.reply_text(f'Ok. Now, please, enter the date and time of the:'
-                              f'{update.message.text}\nPlease, enter date in the'
-                              f'"{DATE_TIME_FORMAT}" format!')
+                              f'{update.message.text}\nPlease, enter date like'
+                              f' {DATE_EXAMPLES}!')
     return EVENT_DATE
 
 
@@ -118,37 +248,40 @@ def event_date(_bot, update, chat_data):
     :return: EVENT_DATE token if data was not correct.
     :return: EVENT_LOC token for conversation handler to move on.
     """
+    touch_entry(chat_data[LEE])
     user = update.message.from_user
 
     try:
-        event_date = datetime.strptime(update.message.text.strip(),
-                                       DATE_TIME_FORMAT)
-        if event_date < datetime.now():
-            update.message.reply_text('Sorry we can not go back to future!')
+        event_date = parse_when(update.message.text, get_clock().time(),
+                                chat_zone(chat_data))
+        if event_date < get_clock().time():
+            PAST_DATE_REPLY.send(update.message)
             raise ValueError
     except ValueError:
         get_logger().error(f'{user.first_name}\'s {chat_data[LEE][NAME]} '
                      f'entered wrong date: {update.message.text}')
-        update.message.reply_text(f'Please, enter date in the '
-                                  f'"{DATE_TIME_FORMAT}" format!')
+        update.message.reply_text(f'Please, enter date like {DATE_EXAMPLES}!')
         return EVENT_DATE
 
     chat_data[LEE][DATE] = event_date
-    get_logger().info(f'{user.first_name}\'s {chat_data[LEE][NAME]} date: {event_date}')
+    get_logger().info(f'{user.first_name}\'s {chat_data[LEE][NAME]} '
+                      f'date: {update.message.text.strip()}')
     update.message.reply_text('Done! Now send me the location of the event'
                               ' or /skip:\n')
     return EVENT_LOC
 
 
-def skip_event_loc(_bot, update):
+def skip_event_loc(_bot, update, chat_data):
     """
     Function to handle event location skip
 
     :param _bot: Not used, required only by telegram-bot api.
     :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param chat_data: Dict that contains chat specific data.
 
     :return: EVENT_MSG token for conversation handler to move on.
     """
+    touch_entry(chat_data[LEE])
     user = update.message.from_user
     get_logger().info(f'{user.first_name} did not send a location of the event.')
     update.message.reply_text('Ok! Now send me the message you want me to send '
@@ -165,6 +298,7 @@ def event_loc(_bot, update, chat_data):
 
     :return: EVENT_MSG token for conversation handler to move on.
     """
+    touch_entry(chat_data[LEE])
     user = update.message.from_user
     get_logger().info(f'{user.first_name}\'s location of the {chat_data[LEE][NAME]}:'
                 f' {update.message.text}')
@@ -247,7 +381,7 @@ def timer(_bot, update, chat_data):
     :return: TIMER_NAME token for conversation handler to move on.
     """
     chat_data[LTE] = {NAME: None, DUE: None,
-                      MSG: None}
+                      MSG: None, STARTED: get_clock().monotonic()}
 
     user = update.message.from_user
     get_logger().info(f'{user.first_name} started new event entry.')
@@ -268,11 +402,12 @@ def timer_name(_bot, update, chat_data):
 
     :return: TIMER_DUE token for conversation handler to move on.
     """
+    touch_entry(chat_data[LTE])
     user = update.message.from_user
     chat_data[LTE][NAME] = update.message.text
     get_logger().info(f'{user.first_name}\'s timer name: {update.message.text}')
     update.message.reply_text(f'Ok. Now, please, enter the due of the timer:'
-                              ' "HH:MI:SS" format!')
+                              f' {DUE_EXAMPLES}!')
     return TIMER_DUE
 
 
@@ -287,21 +422,19 @@ def timer_due(_bot, update, chat_data):
     :return: TIMER_DUE token if due was not correct to get timer due again.
     :return: TIMER_MSG token if due was ok for conversation handler to move on.
     """
-
+    touch_entry(chat_data[LTE])
     user = update.message.from_user
 
     try:
-
-        _due = update.message.text.strip().split(":")
-        if len(_due) != 3:
+        _due = parse_duration(update.message.text, get_clock().time(),
+                              chat_zone(chat_data))
+        if _due < 0:
+            PAST_DATE_REPLY.send(update.message)
             raise ValueError
-        _due = int(_due[0]) * 3600 + int(_due[1]) * 60 + int(_due[2])
-
     except ValueError:
         get_logger().error(f'{user.first_name}\'s {chat_data[LTE][NAME]} '
                     f'entered wrong due: {update.message.text}')
-        update.message.reply_text('Please, enter due in the '
-                                  '"HH:MI:SS" format!')
+        update.message.reply_text(f'Please, enter due like {DUE_EXAMPLES}!')
         return TIMER_DUE
 
     chat_data[LTE][DUE] = _due
@@ -369,6 +502,24 @@ def cancel_timer(_bot, update):
     update.message.reply_text('Ok, I canceled the new timer entry!')
     return ConversationHandler.END
 
+
+def conversation_timeout(_bot, update, chat_data):
+    """
+    Function to drop unfinished event or timer entry
+    when the user stopped answering.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Last update of the conversation which timed out.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    chat_data.pop(LEE, None)
+    chat_data.pop(LTE, None)
+    get_logger().info(f'Conversation in chat {update.effective_chat.id} '
+                      'timed out.')
+    if update.effective_message is not None:
+        update.effective_message.reply_text('You were silent for too long, '
+                                            'so I canceled the entry.')
+
 #--------------------------------------------------------------------------------
 # End of the code block for the timer conversation handler.
 #--------------------------------------------------------------------------------
@@ -378,6 +529,43 @@ def cancel_timer(_bot, update):
 #--------------------------------------------------------------------------------
 
 
+def admit_job(update, replacing):
+    """
+    Function to run admission control before a new job is scheduled.
+    All of new_event, new_timer and both conversations end up in set_event
+    or set_timer, so checking here covers every way to create a job.
+
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param replacing: True if the job replaces an existing one with same name.
+
+    :return: True if the job can be scheduled, False if it was rejected
+             and the user was told about it.
+    """
+    reason = get_admission().admit(update.message.chat_id, replacing)
+    if reason is None:
+        return True
+    get_logger().warning(f'{update.message.from_user.first_name}\'s new job '
+                         f'was rejected: {reason}')
+    update.message.reply_text(REJECT_REPLIES[reason])
+    return False
+
+
+def warn_overlaps(update, chat_id, event_name, start):
+    """
+    Function to tell the user about events overlapping a new event.
+
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param chat_id: chat owning the event.
+    :param event_name: name of the new event.
+    :param start: timestamp of the new event.
+    """
+    overlaps = get_agenda().overlapping(chat_id, start, start + EVENT_DURATION,
+                                        exclude=event_name)
+    if overlaps:
+        names = ', '.join(f'\'{name}\'' for _, name, _ in overlaps)
+        update.message.reply_text(f'Note: it overlaps with {names}.')
+
+
 def set_event(update, job_queue, chat_data):
     """
     Function to set up event notification job.
@@ -389,41 +577,62 @@ def set_event(update, job_queue, chat_data):
     event_name = chat_data[LEE][NAME]
     event_job_name = event_name+JOB_STR_END
     user = update.message.from_user
-    
-    if event_job_name in chat_data:
-        update.message.reply_text(f'Updating \'{event_name}\' entry')
-        event_job = chat_data[event_job_name]
-        event_job.schedule_removal()
+    chat_id = update.message.chat_id
 
-    if chat_data[LEE][DATE] > datetime.now():
-        event_job = job_queue.run_once(alarm, when=chat_data[LEE][DATE],
-                                       context=[
-                                           update.message.chat_id,
-                                           event_name, 
-                                           event_notif_str(chat_data[LEE])
-                                       ]
-                                      )
-        chat_data[event_job_name] = event_job
-        get_logger().info(f'{user.first_name} set up new event {chat_data[LEE][NAME]}!')
-        update.message.reply_text(f'Event {chat_data[LEE][NAME]} successfully set!')    
-    else:
+    # a date in the past must not take a token or replace the old event
+    if chat_data[LEE][DATE] <= get_clock().time():
         get_logger().error(f'{user.first_name} for event: '
                            f'{chat_data[LEE][NAME]} entered uncorrect date!')
-        update.message.reply_text('Sorry we can not go back to future!')
+        PAST_DATE_REPLY.send(update.message)
+        del chat_data[LEE]
+        return
+
+    if not admit_job(update, event_job_name in chat_data):
+        del chat_data[LEE]
+        return
+
+    if event_job_name in chat_data:
+        update.message.reply_text(f'Updating \'{event_name}\' entry')
+        event_job = chat_data.pop(event_job_name)
+        event_job.schedule_removal()
+        get_admission().job_done(chat_id)
+        job_finished(event_job_name, event_job.context, cancelled=True)
+        record_job(event_job, cancelled=True)
+        record_removed(chat_id, event_name)
+        get_search().remove(chat_id, event_name)
+        get_agenda().remove(chat_id, event_name)
+
+    context = [chat_id, event_name,
+               event_notif_str(chat_data[LEE], chat_zone(chat_data)),
+               chat_data, IMMINENT]
+    event_job = schedule_alarm(job_queue, chat_data[LEE][DATE], context)
+    chat_data[event_job_name] = event_job
+    get_admission().job_added(chat_id)
+    job_created(event_job_name, context)
+    record_added(event_job)
+    get_search().add(chat_id, event_name, chat_data[LEE].get(LOC),
+                     chat_data[LEE].get(MSG))
+    start = chat_data[LEE][DATE]
+    get_agenda().add(chat_id, event_name, start, EVENT_DURATION)
+    get_logger().info(f'{user.first_name} set up new event {chat_data[LEE][NAME]}!')
+    update.message.reply_text(f'Event {chat_data[LEE][NAME]} successfully set!')
+    warn_overlaps(update, chat_id, event_name, start)
 
     del chat_data[LEE]
             
-def event_notif_str(event_dict):
+def event_notif_str(event_dict, zone=None):
     """
     Function to build event notification string.
     
     :param event_dict: dict that contains name, date, loc and msg for event.
+    :param zone: ZoneTable the date is shown in, zone of the server by default.
 
     :return: notification string.
     """
-    notif = ''.join(('Event: ', event_dict[NAME]))
+    zone = zone or get_zone(LOCAL)
+    notif = ''.join((EVENT_PREFIX, event_dict[NAME]))
     notif = ''.join((notif, '\nDate: ',
-                     event_dict[DATE].strftime(DATE_TIME_FORMAT)))
+                     zone.format(event_dict[DATE], DATE_TIME_FORMAT)))
     if event_dict[LOC] is not None:
         notif = ''.join((notif, '\nLocation: ', event_dict[LOC]))
     if event_dict[MSG] is not None:
@@ -435,6 +644,38 @@ def event_notif_str(event_dict):
 #------------------------------------------------------------------------------
 
 
+def parse_event_args(args, zone=None):
+    """
+    Function to validate arguments of one message event set.
+
+    :param args: Arguments for new event (date, time, name, loc, msg)
+    :param zone: ZoneTable the date is read in, zone of the server by default.
+
+    :return: event dict with name, date (epoch seconds), loc and msg.
+    :raises ValueError: with the reason if arguments are not valid.
+    """
+    zone = zone or get_zone(LOCAL)
+    now = get_clock().time()
+    try:
+        # the date is the longest phrase the arguments start with
+        event_date, args = split_phrase(
+            args, lambda text: parse_when(text, now, zone))
+    except ValueError:
+        raise ValueError(f'date must be like {DATE_EXAMPLES}')
+    if event_date < now:
+        raise ValueError(PAST_DATE)
+    if not args:
+        raise ValueError('event name is missing')
+    # adding optional arguments
+    event_loc = None
+    if args[1:]:
+        event_loc = args[1]
+    event_msg = None
+    if args[2:]:
+        event_msg = ' '.join(args[2:])
+    return {NAME: args[0], DATE: event_date, LOC: event_loc, MSG: event_msg}
+
+
 def new_event(_bot, update, args, job_queue, chat_data):
     """
     Handler for one message event set.
@@ -448,36 +689,18 @@ def new_event(_bot, update, args, job_queue, chat_data):
     # check mandatory arguments: event_date and event_name
     user = update.message.from_user
     try:
-        date = args[0]
-        time = args[1]
-        event_date = datetime.strptime(
-            ' '.join((date, time)), DATE_TIME_FORMAT)
-        if event_date < datetime.now():
-            update.message.reply_text('Sorry we can not go back to future!')
-            raise ValueError
-        event_name = args[2]
+        entry = parse_event_args(args, chat_zone(chat_data))
     # if mandatory arguments are absent or not valid
-    except (IndexError, ValueError):
+    except ValueError as exc:
+        if str(exc) == PAST_DATE:
+            PAST_DATE_REPLY.send(update.message)
         get_logger().error(f'{user.first_name} entered wrong args'
                            f' for one message event setting: {args}')
-        update.message.reply_text(f'Usage:/new_event <date_time "{DATE_TIME_FORMAT}">'
-                                   '<event_name> [event_loc] [event_msg]\n'
-                                   'All data must be in the correct order!')
+        NEW_EVENT_USAGE.send(update.message)
         # not valid command - exit the function
         return
-    # adding optional arguments
-    event_loc = None
-    if args[3:]:
-        event_loc = args[3]
-    event_msg = None
-    if args[4:]:
-        event_msg = ' '.join(args[4:])
     # adding info aboud event to chat data dict as 'last_event_entry'
-    chat_data[LEE] = dict()
-    chat_data[LEE][NAME] = event_name
-    chat_data[LEE][DATE] = event_date
-    chat_data[LEE][LOC] = event_loc
-    chat_data[LEE][MSG] = event_msg
+    chat_data[LEE] = entry
     # set up the job_queue notification for the event
     set_event(update, job_queue, chat_data)
 
@@ -497,26 +720,156 @@ def set_timer(update, job_queue, chat_data):
     timer_name = chat_data[LTE][NAME]
     timer_job_name = timer_name+JOB_STR_END
     user = update.message.from_user
-    
+    chat_id = update.message.chat_id
+
+    if not admit_job(update, timer_job_name in chat_data):
+        del chat_data[LTE]
+        return
+
     if timer_job_name in chat_data:
         update.message.reply_text(f'Updating \'{timer_name}\' entry')
-        timer_job = chat_data[timer_job_name]
+        timer_job = chat_data.pop(timer_job_name)
         timer_job.schedule_removal()
-    
-    timer_job = job_queue.run_once(alarm, chat_data[LTE][DUE], 
-                               context=[
-                                   update.message.chat_id,
-                                   timer_name,
-                                   timer_notif_str(chat_data[LTE])
-                               ]
-                              )
+        get_admission().job_done(chat_id)
+        job_finished(timer_job_name, timer_job.context, cancelled=True)
+        record_job(timer_job, cancelled=True)
+        record_removed(chat_id, timer_name)
+        get_search().remove(chat_id, timer_name)
+        get_agenda().remove(chat_id, timer_name)
+
+    context = [chat_id, timer_name, timer_notif_str(chat_data[LTE]), chat_data,
+               timer_priority(chat_data[LTE][DUE])]
+    due = epoch_seconds(get_clock().time() + chat_data[LTE][DUE])
+    start = digest_slot(chat_data, due, context[4])
+    if start is None:
+        timer_job = job_queue.run_once(alarm, chat_data[LTE][DUE],
+                                       context=context)
+    else:
+        timer_job = buffer_alarm(job_queue, due, context, start)
     chat_data[timer_job_name] = timer_job
+    get_admission().job_added(chat_id)
+    job_created(timer_job_name, context)
+    record_added(timer_job)
+    get_search().add(chat_id, timer_name, chat_data[LTE].get(MSG))
+    get_agenda().add(chat_id, timer_name,
+                     get_clock().time() + chat_data[LTE][DUE])
     get_logger().info(f'User {user.first_name} set up new timer {timer_name} '
                 f'for {chat_data[LTE][DUE]} seconds.')
     update.message.reply_text(f'Timer {chat_data[LTE][NAME]} successfully set!')    
     del chat_data[LTE]
 
 
+def timer_priority(due):
+    """
+    Function to choose delivery priority class of a timer.
+
+    :param due: seconds until the timer fires.
+
+    :return: SHORT_TIMER for short timers, IMMINENT for the others.
+    """
+    return SHORT_TIMER if due <= SHORT_TIMER_MAX else IMMINENT
+
+
+def digest_slot(chat_data, due, priority):
+    """
+    Function to choose the digest an alarm goes to.
+
+    :param chat_data: Dict that contains chat specific data.
+    :param due: timestamp of the alarm.
+    :param priority: delivery priority class of the alarm.
+
+    :return: start of the digest slot, None if the alarm is sent alone:
+             the chat is not in digest mode, it is a short timer or
+             the digest of its slot is already being sent.
+    """
+    mode = chat_data.get(DIGEST_MODE)
+    if mode is None or priority == SHORT_TIMER:
+        return None
+    start = slot_start(due, mode, chat_zone(chat_data))
+    return start if start > get_clock().time() else None
+
+
+def buffer_alarm(job_queue, due, context, start):
+    """
+    Function to put an alarm into the digest of its chat. The alarm
+    keeps its own priority in the context, the digest message is sent
+    in the DIGEST class.
+
+    :return: DigestJob handle of the alarm.
+    """
+    return get_digest().add(job_queue, send_digest, due, context, start)
+
+
+def schedule_alarm(job_queue, due, context):
+    """
+    Function to schedule an alarm, or to buffer it for a digest
+    if it is digest-eligible.
+
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param due: timestamp of the alarm.
+    :param context: job context, see alarm.
+
+    :return: the job or its DigestJob handle.
+    """
+    start = digest_slot(context[3], due, context[4])
+    if start is None:
+        return job_queue.run_at(alarm, due, context=context)
+    return buffer_alarm(job_queue, due, context, start)
+
+
+def schedule_alarms(job_queue, items):
+    """
+    Function to schedule many alarms in one batch, digest-eligible
+    ones are buffered.
+
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param items: list of (timestamp, context).
+
+    :return: list of jobs and DigestJob handles, in order of `items`.
+    """
+    jobs = [None] * len(items)
+    alone = []
+    for index, (due, context) in enumerate(items):
+        start = digest_slot(context[3], due, context[4])
+        if start is None:
+            alone.append(index)
+        else:
+            jobs[index] = buffer_alarm(job_queue, due, context, start)
+    if len(alone) == len(items):
+        return job_queue.run_at_many(alarm, items)
+    scheduled = job_queue.run_at_many(alarm, [items[index]
+                                              for index in alone])
+    for index, job in zip(alone, scheduled):
+        jobs[index] = job
+    return jobs
+
+
+def job_slack(ahead):
+    """
+    Function to choose the slack of an alarm, short timers fire almost
+    exactly, far events are grouped into bigger scheduler buckets.
+
+    :param ahead: seconds until the alarm is due.
+
+    :return: seconds the alarm may fire late by.
+    """
+    for limit, slack in SLACK_TIERS:
+        if ahead <= limit:
+            return slack
+    return MAX_SLACK
+
+
+def delivery_batch():
+    """
+    Function giving the context the alarms of one scheduler bucket run in,
+    their messages are queued for delivery together.
+    """
+    delivery = get_delivery()
+    if delivery is None:
+        return contextlib.nullcontext()
+    return delivery.batch()
+
+
 def timer_notif_str(timer_dict):
     """
     Function to build timer notification string.
@@ -533,6 +886,38 @@ def timer_notif_str(timer_dict):
 # One timer event setting.
 #------------------------------------------------------------------------------
 
+def parse_timer_args(args, zone=None):
+    """
+    Function to validate arguments of one line timer set.
+
+    :param args: Arguments for new timer (due, name, msg)
+    :param zone: ZoneTable a due like "tomorrow 9:00" is read in,
+                 zone of the server by default.
+
+    :return: timer dict with name, due and msg.
+    :raises ValueError: with the reason if arguments are not valid.
+    """
+    # check for only mandatory argument - timer due
+    if not args:
+        raise ValueError('timer due is missing')
+    zone = zone or get_zone(LOCAL)
+    now = get_clock().time()
+    try:
+        # the due is the longest phrase the arguments start with
+        timer_due, args = split_phrase(
+            args, lambda text: parse_duration(text, now, zone))
+    except ValueError:
+        raise ValueError(f'timer due must be like {DUE_EXAMPLES}')
+    if timer_due < 0:
+        raise ValueError(PAST_DATE)
+    # next argument should contain the name of the timer
+    timer_name = args[0] if args else 'timer'
+    timer_msg = None
+    if args[1:]:
+        timer_msg = ' '.join(args[1:])
+    return {NAME: timer_name, DUE: timer_due, MSG: timer_msg}
+
+
 def new_timer(_bot, update, args, job_queue, chat_data):
     """
     Handler for one line timer set.
@@ -546,35 +931,233 @@ def new_timer(_bot, update, args, job_queue, chat_data):
     user = update.message.from_user
 
     try:
-        # args[1] should contain the name of the timer
-        timer_name = args[1]
-    except IndexError:
-        timer_name = 'timer'
-
-    # check for only mandatory argument - timer due
-    try:
-        # args[0] should contain the time for the timer in seconds
-        timer_due = int(args[0])
-        if timer_due < 0:
-            update.message.reply_text('Sorry we can not go back to future!')
-            raise ValueError
-    except (IndexError, ValueError):
+        entry = parse_timer_args(args, chat_zone(chat_data))
+    except ValueError as exc:
+        if str(exc) == PAST_DATE:
+            PAST_DATE_REPLY.send(update.message)
+        timer_name = args[1] if args[1:] else 'timer'
         get_logger().error(f'{user.first_name}\'s {timer_name} '
                            f'entered wrong timer due: {update.message.text}')
-        update.message.reply_text(
-            'Usage: /new_timer <seconds> [timer_name] [timer_message]')
+        NEW_TIMER_USAGE.send(update.message)
         return
 
-    timer_msg = None
-    if args[2:]:
-        timer_msg = ' '.join(args[2:])
     # adding info about event to chat data dict as 'last_timer_entry'
-    chat_data[LTE] = dict()
-    chat_data[LTE][NAME] = timer_name
-    chat_data[LTE][DUE] = timer_due
-    chat_data[LTE][MSG] = timer_msg
+    chat_data[LTE] = entry
     # set up the job_queue notification for the event
     set_timer(update, job_queue, chat_data)
+
+#------------------------------------------------------------------------------
+# Bulk event and timer setting, many lines in one message or text file.
+#------------------------------------------------------------------------------
+
+
+def parse_bulk(text, parse_args):
+    """
+    Function to validate all lines of a bulk message up front.
+    Empty lines and lines starting with # are skipped.
+
+    :param text: lines, each one with the same arguments as one message set.
+    :param parse_args: parse_event_args or parse_timer_args.
+
+    :return: list of valid entries and list of (line_number, line, reason)
+             for rejected lines.
+    """
+    entries = []
+    rejected = []
+    names = set()
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if len(entries) >= MAX_BULK_LINES:
+            rejected.append((number, line, f'only {MAX_BULK_LINES} lines '
+                                           'are allowed in one message'))
+            continue
+        try:
+            entry = parse_args(line.split())
+        except ValueError as exc:
+            rejected.append((number, line, str(exc)))
+            continue
+        if entry[NAME] in names:
+            rejected.append((number, line, 'name already used above'))
+            continue
+        names.add(entry[NAME])
+        entries.append((number, line, entry))
+    return entries, rejected
+
+
+def set_bulk(update, job_queue, chat_data, entries, notif_str, when_key):
+    """
+    Function to schedule all valid entries of a bulk message in one batch.
+
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    :param entries: valid entries returned by parse_bulk.
+    :param notif_str: event_notif_str or timer_notif_str.
+    :param when_key: DATE for events, DUE for timers.
+
+    :return: number of scheduled jobs and list of rejected lines,
+             None if the whole message was rate limited.
+    """
+    chat_id = update.message.chat_id
+    new_count = sum(1 for _, _, entry in entries
+                    if entry[NAME]+JOB_STR_END not in chat_data)
+    admitted, reason = get_admission().admit_many(chat_id, new_count)
+    if reason == RATE_LIMITED:
+        update.message.reply_text(REJECT_REPLIES[reason])
+        return None
+
+    batch = []
+    texts = []
+    rejected = []
+    now = get_clock().time()
+    for number, line, entry in entries:
+        job_name = entry[NAME]+JOB_STR_END
+        if job_name in chat_data:
+            old_job = chat_data.pop(job_name)
+            old_job.schedule_removal()
+            get_admission().job_done(chat_id)
+            job_finished(job_name, old_job.context, cancelled=True)
+            record_job(old_job, cancelled=True)
+            record_removed(chat_id, entry[NAME])
+            get_search().remove(chat_id, entry[NAME])
+            get_agenda().remove(chat_id, entry[NAME])
+        elif admitted > 0:
+            admitted -= 1
+        else:
+            rejected.append((number, line, 'too many active reminders'))
+            continue
+        if when_key == DATE:
+            due, priority = entry[DATE], IMMINENT
+        else:
+            due = job_queue.to_timestamp(entry[DUE], now)
+            priority = timer_priority(entry[DUE])
+        # same priority as one /new_event or /new_timer, BULK is for fan-out
+        batch.append((due, [chat_id, entry[NAME], notif_str(entry), chat_data,
+                            priority]))
+        texts.append((entry[NAME], entry.get(LOC), entry.get(MSG)))
+
+    jobs = schedule_alarms(job_queue, batch)
+    search = get_search()
+    agenda = get_agenda()
+    duration = EVENT_DURATION if when_key == DATE else 0
+    for job, (_, context), job_texts in zip(jobs, batch, texts):
+        job_name = context[1]+JOB_STR_END
+        chat_data[job_name] = job
+        get_admission().job_added(chat_id)
+        job_created(job_name, context)
+        record_added(job)
+        search.add(chat_id, *job_texts)
+        agenda.add(chat_id, context[1], job.due, duration)
+    return len(jobs), rejected
+
+
+def bulk_summary(kind, count, rejected):
+    """
+    Function to build the one reply sent for a bulk message.
+
+    :param kind: 'event' or 'timer'.
+    :param count: number of scheduled jobs.
+    :param rejected: list of (line_number, line, reason).
+
+    :return: summary string.
+    """
+    summary = f'{count} {kind}(s) successfully set!'
+    if rejected:
+        lines = '\n'.join(f'{number}: {line} - {reason}'
+                          for number, line, reason in rejected)
+        summary = ''.join((summary, f'\nRejected {len(rejected)} line(s):\n',
+                           lines))
+    return summary
+
+
+def bulk_set(update, job_queue, chat_data, text, command):
+    """
+    Function to parse, schedule and report bulk events or timers.
+
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    :param text: lines with one event or timer each.
+    :param command: '/new_events' or '/new_timers'.
+    """
+    user = update.message.from_user
+    if command == '/new_events':
+        zone = chat_zone(chat_data)
+        kind, parse_args, notif_str, when_key = (
+            'event', functools.partial(parse_event_args, zone=zone),
+            functools.partial(event_notif_str, zone=zone), DATE)
+    else:
+        kind, parse_args, notif_str, when_key = (
+            'timer', functools.partial(parse_timer_args,
+                                       zone=chat_zone(chat_data)),
+            timer_notif_str, DUE)
+    entries, rejected = parse_bulk(text, parse_args)
+    if not entries and not rejected:
+        update.message.reply_text(BULK_USAGE)
+        return
+    result = set_bulk(update, job_queue, chat_data, entries, notif_str,
+                      when_key)
+    if result is None:
+        return
+    count, not_admitted = result
+    rejected = sorted(rejected + not_admitted)
+    get_logger().info(f'{user.first_name} set up {count} {kind}(s) at once, '
+                      f'{len(rejected)} line(s) rejected.')
+    update.message.reply_text(bulk_summary(kind, count, rejected))
+
+
+def new_events(_bot, update, job_queue, chat_data):
+    """
+    Handler for many events in one message, one event per line.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    command_and_text = update.message.text.split(None, 1)
+    bulk_set(update, job_queue, chat_data, ''.join(command_and_text[1:]),
+             '/new_events')
+
+
+def new_timers(_bot, update, job_queue, chat_data):
+    """
+    Handler for many timers in one message, one timer per line.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    command_and_text = update.message.text.split(None, 1)
+    bulk_set(update, job_queue, chat_data, ''.join(command_and_text[1:]),
+             '/new_timers')
+
+
+def bulk_file(bot, update, job_queue, chat_data):
+    """
+    Handler for text file sent with /new_events or /new_timers caption.
+
+    :param bot: bot used to download the file.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_BULK_BYTES:
+        update.message.reply_text(f'Sorry, the file is too big, '
+                                  f'max {MAX_BULK_BYTES // 1024} KiB.')
+        return
+    content = bot.get_file(document.file_id).download_as_bytearray()
+    try:
+        text = content.decode('utf-8')
+    except UnicodeDecodeError:
+        update.message.reply_text('Sorry, the file must be UTF-8 text.')
+        return
+    bulk_set(update, job_queue, chat_data, text, update.message.caption.strip())
+
 #------------------------------------------------------------------------------
 # General bot functionality
 #------------------------------------------------------------------------------
@@ -586,9 +1169,7 @@ def start(_bot, update):
     :param _bot: Not used, required only by telegram-bot api.
     :param update: Contains event data, such as user_id, chat_id, text sent.
     """
-    update.message.reply_text('Hi! I\'m organizer helper bot!\n'
-                              'Write /help to see all available commands.',
-                              reply_markup=start_markup)
+    START_REPLY.send(update.message)
 
 def help(_bot, update):
     """
@@ -597,17 +1178,7 @@ def help(_bot, update):
     :param _bot: Not used, required only by telegram-bot api.
     :param update: Contains event data, such as user_id, chat_id, text sent.
     """
-    update.message.reply_text('Currently you can use only:\n'
-                              '/new_timer <seconds> [timer_name] [timer_message]'
-                              ' - to set timer.\n'
-                              f'/new_event <date "{DATE_FORMAT}"> <time "{TIME_FORMAT}">'
-                              '<event_name> [event_loc] [event_msg]'
-                              ' - to create an new event.\n'
-                              '/event to create new event using conversation'
-                              ' handler.\n'
-                              '/timer to create new timer using conversation'
-                              ' handler.\n'
-                              '/unset <name> to unset timer/event.')
+    HELP_REPLY.send(update.message)
 
 def alarm(bot, job):
     """
@@ -615,12 +1186,118 @@ def alarm(bot, job):
     who set up the event or timer.
 
     :param bot: bot object will send the message from the job.
-    :param job: job object contains the chat_id and message in job.context.
+    :param job: job object contains the chat_id, name, message,
+                chat_data of the chat and delivery priority in job.context.
+    """
+    job_message = fire_alarm(job)
+    if job_message is None:
+        return
+    delivery = get_delivery()
+    if delivery is None:
+        bot.send_message(job.context[0], text=job_message)
+    else:
+        delivery.submit(job.context[4], job.context[0], job_message,
+                        due=getattr(job, 'due', None))
+
+
+def fire_alarm(job):
+    """
+    Function to forget an alarm which is due and to send it by email
+    if the user chose so.
+
+    :param job: job or DigestJob handle of the alarm.
+
+    :return: notification string to send by telegram, None if it was
+             sent only by email.
     """
     chat_id = job.context[0]
-    # job_event_name = job.context[1]
+    job_name = ''.join((job.context[1], JOB_STR_END))
     job_message = job.context[2]
-    bot.send_message(chat_id, text=job_message)
+    chat_data = job.context[3]
+    # the job handle is not needed anymore, unless it was already replaced
+    if chat_data.get(job_name) is job:
+        chat_data.pop(job_name, None)
+        get_search().remove(chat_id, job.context[1])
+        get_agenda().remove(chat_id, job.context[1])
+    get_admission().job_done(chat_id)
+    job_finished(job_name, job.context)
+    record_job(job)
+    # before sending, a standby taking over must not send it again
+    record_removed(chat_id, job.context[1], fired=True)
+    channel = chat_data.get(CHANNELS, {}).pop(job.context[1], TELEGRAM)
+    if channel != TELEGRAM and send_email(chat_data, job.context[1],
+                                          job_message):
+        if channel == EMAIL_CHANNEL:
+            return None
+    return job_message
+
+
+def send_digest(bot, job):
+    """
+    Function to send all alarms of a digest slot of a chat together.
+
+    :param bot: bot object will send the message from the job.
+    :param job: job of the slot, job.context is the chat_id and
+                the start of the slot.
+    """
+    chat_id, start = job.context
+    handles = get_digest().take(chat_id, start)
+    if not handles:
+        return
+    zone = chat_zone(handles[0].context[3])
+    lines = []
+    for handle in handles:
+        job_message = fire_alarm(handle)
+        if job_message is not None:
+            lines.append(f'{zone.format(handle.due, DIGEST_TIME_FORMAT)} '
+                         f'{job_message}')
+    delivery = get_delivery()
+    for text in digest_messages(lines):
+        if delivery is None:
+            bot.send_message(chat_id, text=text)
+        else:
+            delivery.submit(DIGEST, chat_id, text, due=start)
+
+
+def digest_messages(lines):
+    """
+    Function to join notification strings of a digest into messages
+    no longer than MAX_MESSAGE_LENGTH.
+
+    :param lines: notification strings, each prefixed with its time.
+
+    :return: list of messages, empty if there are no lines.
+    """
+    if not lines:
+        return []
+    messages = []
+    text = f'Digest of {len(lines)} upcoming reminders:'
+    for line in lines:
+        if len(text) + 2 + len(line) > MAX_MESSAGE_LENGTH:
+            messages.append(text)
+            text = line
+        else:
+            text = '\n\n'.join((text, line))
+    messages.append(text)
+    return messages
+
+
+def send_email(chat_data, name, message):
+    """
+    Function to queue alarm notification email.
+
+    :param chat_data: Dict that contains chat specific data.
+    :param name: name of the event or timer.
+    :param message: notification string.
+
+    :return: True if the email was queued, False if it can not be sent
+             and the notification should go to telegram.
+    """
+    mailer = get_mailer()
+    address = chat_data.get(EMAIL_ADDRESS)
+    if mailer is None or address is None:
+        return False
+    return mailer.send(address, f'Reminder: {name}', message)
 
 #------------------------------------------------------------------------------
 # Unset, error and unknown commands handlers.
@@ -648,9 +1325,305 @@ def unset(_bot, update, args, chat_data):
     job = chat_data[job_name]
     job.schedule_removal()
     del chat_data[job_name]
+    chat_data.get(CHANNELS, {}).pop(job.context[1], None)
+    get_admission().job_done(update.message.chat_id)
+    job_finished(job_name, job.context, cancelled=True)
+    record_job(job, cancelled=True)
+    record_removed(update.message.chat_id, job.context[1])
+    get_search().remove(update.message.chat_id, job.context[1])
+    get_agenda().remove(update.message.chat_id, job.context[1])
     update.message.reply_text(f'{job_name} successfully unset!')
 
 
+def email_address(_bot, update, args, chat_data):
+    """
+    Function for email command handler, sets or removes the address
+    used for reminders sent by email.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Should contain the address or 'off'.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    if not args:
+        address = chat_data.get(EMAIL_ADDRESS, 'not set')
+        update.message.reply_text(f'Your email: {address}\n'
+                                  'Usage: /email <address> or /email off')
+        return
+    if args[0] == 'off':
+        chat_data.pop(EMAIL_ADDRESS, None)
+        update.message.reply_text('Ok, I won\'t send you emails anymore.')
+        return
+    if '@' not in args[0]:
+        update.message.reply_text('Sorry, this does not look like an email '
+                                  'address.')
+        return
+    chat_data[EMAIL_ADDRESS] = args[0]
+    get_logger().info(f'{update.message.from_user.first_name} set an email.')
+    update.message.reply_text(f'Ok! Use /via <name> {EMAIL_CHANNEL} to get'
+                              f' a reminder to {args[0]}.')
+
+
+def chat_zone(chat_data):
+    """
+    Function to get the time zone dates of the chat are entered
+    and shown in.
+
+    :param chat_data: Dict that contains chat specific data.
+
+    :return: ZoneTable of the chat, zone of the server if none was set.
+    """
+    return get_zone(chat_data.get(TIMEZONE, LOCAL))
+
+
+def time_zone(_bot, update, args, chat_data):
+    """
+    Function for timezone command handler, sets the time zone dates
+    of the chat are entered and shown in. Alarms which are already
+    set keep their time.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Should contain IANA zone name or 'off'.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    if not args:
+        zone = chat_data.get(TIMEZONE, 'time zone of the server')
+        update.message.reply_text(f'Your time zone: {zone}\n'
+                                  'Usage: /timezone <Area/City>, e.g. '
+                                  '/timezone Europe/Warsaw, or /timezone off')
+        return
+    if args[0] == 'off':
+        chat_data.pop(TIMEZONE, None)
+        update.message.reply_text('Ok, dates are in the time zone of the '
+                                  'server again.')
+        return
+    try:
+        zone = get_zone(args[0])
+    except ValueError:
+        update.message.reply_text(f'Sorry, I do not know the time zone '
+                                  f'\'{args[0]}\'.')
+        return
+    chat_data[TIMEZONE] = zone.name
+    get_logger().info(f'{update.message.from_user.first_name} set time zone '
+                      f'{zone.name}.')
+    now = zone.format(get_clock().time(), DATE_TIME_FORMAT)
+    update.message.reply_text(f'Ok! It is {now} in {zone.name} now.')
+
+
+def digest_mode(_bot, update, args, job_queue, chat_data):
+    """
+    Function for digest command handler, sets whether reminders of
+    the chat are sent together once an hour or once a day. Reminders
+    waiting in digests are moved to the new ones or sent alone again.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Should contain hourly, daily or 'off'.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    if not args or args[0] not in DIGEST_MODES + ('off',):
+        mode = chat_data.get(DIGEST_MODE, 'off')
+        update.message.reply_text(f'Your digest: {mode}\n'
+                                  'Usage: /digest <'
+                                  + '|'.join(DIGEST_MODES) + '|off>')
+        return
+    if args[0] == 'off':
+        chat_data.pop(DIGEST_MODE, None)
+    else:
+        chat_data[DIGEST_MODE] = args[0]
+    digest = get_digest()
+    for handle in digest.chat_jobs(update.message.chat_id):
+        digest.remove(handle)
+        job = schedule_alarm(job_queue, handle.due, handle.context)
+        job_name = handle.context[1]+JOB_STR_END
+        if chat_data.get(job_name) is handle:
+            chat_data[job_name] = job
+    get_logger().info(f'{update.message.from_user.first_name} set digest '
+                      f'{args[0]}.')
+    if args[0] == 'off':
+        update.message.reply_text('Ok, every reminder will be sent on its '
+                                  'own again.')
+    else:
+        when = ('At every full hour' if args[0] == HOURLY
+                else f'Every day at {DAILY_TIME // 3600:02d}:00')
+        update.message.reply_text(f'Ok! {when} you will get one message with '
+                                  f'the reminders due until the next one. '
+                                  f'Timers up to {SHORT_TIMER_MAX // 60} '
+                                  f'minutes still come on their own.')
+
+
+def via(_bot, update, args, chat_data):
+    """
+    Function for via command handler, chooses how a reminder is delivered.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Should contain job name and channel.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    if len(args) != 2 or args[1] not in DELIVERY_CHANNELS:
+        update.message.reply_text('Usage: /via <name> <'
+                                  + '|'.join(DELIVERY_CHANNELS) + '>')
+        return
+    name, channel = args
+    if name+JOB_STR_END not in chat_data:
+        update.message.reply_text(f'You have no active {name}.')
+        return
+    if channel != TELEGRAM and EMAIL_ADDRESS not in chat_data:
+        update.message.reply_text('Please, set your address with '
+                                  '/email <address> first.')
+        return
+    channels = chat_data.setdefault(CHANNELS, dict())
+    if channel == TELEGRAM:
+        channels.pop(name, None)
+    else:
+        channels[name] = channel
+    update.message.reply_text(f'Ok! {name} will be sent via {channel}.')
+
+
+def find(_bot, update, args, chat_data):
+    """
+    Function for find command handler, looks for active timers and events
+    by a part of their name, location or message.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Should contain the text to look for.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    if not args:
+        update.message.reply_text('Usage: /find <text>')
+        return
+    query = ' '.join(args)
+    names = [name for name in get_search().find(update.message.chat_id, query)
+             if name+JOB_STR_END in chat_data]
+    if not names:
+        update.message.reply_text(f'Nothing found for \'{query}\'.')
+        return
+    update.message.reply_text('\n'.join(['Found:'] + names
+                                         + ['Use /unset <name> to unset one.']))
+
+
+def agenda(_bot, update, args, chat_data):
+    """
+    Function for agenda command handler, lists events and timers
+    of the chat due today or in the next seven days.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Can contain 'today' or 'week'.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    period = args[0].lower() if args else 'today'
+    if period not in AGENDA_RANGES:
+        update.message.reply_text('Usage: /agenda [today|week]')
+        return
+    zone = chat_zone(chat_data)
+    now = get_clock().time()
+    if period == 'today':
+        end = zone.day_end(now)
+    else:
+        end = now + 7 * 24 * 3600
+    entries = get_agenda().between(update.message.chat_id, now, end)
+    if not entries:
+        update.message.reply_text(f'Nothing planned for {period}.')
+        return
+    lines = [' '.join((zone.format(start, '%Y-%m-%d %H:%M'), name))
+             for start, name, _ in entries[:AGENDA_LIMIT]]
+    if len(entries) > AGENDA_LIMIT:
+        lines.append(f'... and {len(entries) - AGENDA_LIMIT} more.')
+    update.message.reply_text('\n'.join(lines))
+
+
+def history(_bot, update, args, chat_data):
+    """
+    Function for history command handler, shows last fired and
+    cancelled reminders of the chat.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Can contain number of records.
+    :param chat_data: Dict that contains chat specific data.
+    """
+    log = get_history()
+    if log is None:
+        update.message.reply_text('Sorry, history is turned off.')
+        return
+    try:
+        limit = int(args[0]) if args else HISTORY_LIMIT
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        update.message.reply_text('Usage: /history [count]')
+        return
+    entries = log.reader.recent(
+        update.message.chat_id, min(limit, MAX_HISTORY_LIMIT))
+    if not entries:
+        update.message.reply_text('Nothing has fired yet.')
+        return
+    zone = chat_zone(chat_data)
+    lines = []
+    for entry in entries:
+        line = ' '.join((zone.format(entry.time, DATE_TIME_FORMAT),
+                         entry.kind, entry.name))
+        if entry.lateness >= 1:
+            line = ''.join((line, f' ({entry.lateness:.0f}s late)'))
+        lines.append(line)
+    update.message.reply_text('\n'.join(lines))
+
+
+def stats(_bot, update):
+    """
+    Function for admin only stats command handler.
+    Other users get the same reply as for an unknown command.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    """
+    user = update.message.from_user
+    if user.id not in ADMIN_IDS:
+        get_logger().warning(f'{user.first_name} ({user.id}) asked for /stats.')
+        unknown(_bot, update)
+        return
+    update.message.reply_text(format_stats(get_stats().collect()))
+
+
+def profile(_bot, update, args):
+    """
+    Function for admin only profile command handler, samples handler
+    and alarm stacks for some seconds and writes them to a file.
+    Other users get the same reply as for an unknown command.
+
+    :param _bot: Not used, required only by telegram-bot api.
+    :param update: Contains event data, such as user_id, chat_id, text sent.
+    :param args: Message as a list. Can contain number of seconds.
+    """
+    user = update.message.from_user
+    if user.id not in ADMIN_IDS:
+        get_logger().warning(f'{user.first_name} ({user.id}) asked for /profile.')
+        unknown(_bot, update)
+        return
+    try:
+        seconds = int(args[0]) if args else PROFILE_SECONDS
+        if seconds <= 0:
+            raise ValueError
+    except ValueError:
+        update.message.reply_text('Usage: /profile [seconds]')
+        return
+    seconds = min(seconds, MAX_PROFILE_SECONDS)
+
+    def done(text):
+        filename = write_profile(text)
+        update.message.reply_text(f'Profile written to {filename}.')
+
+    if not get_profiler().start(seconds, on_done=done):
+        update.message.reply_text('Profiling is already running.')
+        return
+    update.message.reply_text(f'Profiling for {seconds} seconds.')
+
+
 def error(_bot, update, error):
     """
     Log Errors caused by Updates.
@@ -669,20 +1642,150 @@ def unknown(_bot, update):
     :param _bot: Not used, required only by telegram-bot api.
     :param update: update which triggered this handler.
     """
-    update.message.reply_text('Sorry, I didn\'t understand that command.')
+    UNKNOWN_REPLY.send(update.message)
+
+#------------------------------------------------------------------------------
+# Snapshot of jobs and chat settings for the managed shutdown.
+#------------------------------------------------------------------------------
+
+
+def is_chat_setting(key, value):
+    """
+    :return: True if chat_data item is a plain setting which should
+             survive a restart, not an entry or a job handle.
+    """
+    if key in FIELDS or key.endswith(JOB_STR_END):
+        return False
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def make_snapshot(dispatcher, job_queue):
+    """
+    Function to build a compact snapshot of pending alarms and chat settings.
+
+    :param dispatcher: dispatcher with chat_data of all chats.
+    :param job_queue: queue of jobs for invoking functions after some time.
+
+    :return: JSON serializable dict.
+    """
+    pending = list(get_digest().jobs())
+    for job in job_queue.jobs():
+        if (job.removed or job.next_t is None
+                or job.callback.__name__ != alarm.__name__):
+            continue
+        pending.append(job)
+    jobs = []
+    for job in pending:
+        chat_id, name, message = job.context[:3]
+        jobs.append([chat_id, name, message, job.due, job.context[4]])
+    chats = dict()
+    for chat_id, data in dispatcher.chat_data.items():
+        settings = {key: value for key, value in data.items()
+                    if is_chat_setting(key, value)}
+        if settings:
+            chats[chat_id] = settings
+    return {'version': 2, 'time': get_clock().time(), 'jobs': jobs, 'chats': chats}
+
+
+def restore_snapshot(snapshot, dispatcher, job_queue):
+    """
+    Function to reschedule alarms from a snapshot.
+    Alarms which came due while the bot was down fire right away.
+
+    :param snapshot: dict built by make_snapshot.
+    :param dispatcher: dispatcher with chat_data of all chats.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    """
+    for chat_id, settings in snapshot['chats'].items():
+        # JSON object keys are always strings
+        dispatcher.chat_data[int(chat_id)].update(settings)
+    for chat_id, name, message, due, *priority in snapshot['jobs']:
+        # snapshots of version 1 have no delivery priority
+        restore_job(dispatcher, job_queue, chat_id, name, message, due,
+                    priority[0] if priority else IMMINENT)
+    get_logger().info(f'Restored {len(snapshot["jobs"])} jobs from snapshot.')
+
+
+def restore_job(dispatcher, job_queue, chat_id, name, message, due, priority):
+    """
+    Function to reschedule one alarm saved by a snapshot or journal,
+    replacing a job of the same name. If it is already due it fires
+    right away, alarms of chats in digest mode go to their digest.
+
+    :param dispatcher: dispatcher with chat_data of all chats.
+    :param job_queue: queue of jobs for invoking functions after some time.
+    :param chat_id: chat owning the job.
+    :param name: name of the event or timer.
+    :param message: notification string.
+    :param due: timestamp of the alarm.
+    :param priority: delivery priority class.
+    """
+    drop_job(dispatcher, chat_id, name)
+    chat_data = dispatcher.chat_data[chat_id]
+    job_name = name+JOB_STR_END
+    context = [chat_id, name, message, chat_data, priority]
+    chat_data[job_name] = schedule_alarm(
+        job_queue, max(due, get_clock().time()), context)
+    get_admission().job_added(chat_id)
+    job_created(job_name, context)
+    # location and message are only kept inside the notification
+    get_search().add(chat_id, name, message)
+    get_agenda().add(chat_id, name, chat_data[job_name].due,
+                     EVENT_DURATION if message.startswith(EVENT_PREFIX) else 0)
+
+
+def drop_job(dispatcher, chat_id, name):
+    """
+    Function to remove a job which was unset, replaced or fired
+    by another process.
+
+    :param dispatcher: dispatcher with chat_data of all chats.
+    :param chat_id: chat owning the job.
+    :param name: name of the event or timer.
+    """
+    chat_data = dispatcher.chat_data[chat_id]
+    job = chat_data.pop(name+JOB_STR_END, None)
+    if job is None:
+        return
+    job.schedule_removal()
+    get_admission().job_done(chat_id)
+    job_finished(name+JOB_STR_END, job.context, cancelled=True)
+    get_search().remove(chat_id, name)
+    get_agenda().remove(chat_id, name)
+
+
+def journal_applier(dispatcher, job_queue):
+    """
+    :return: function applying journal changes to the dispatcher
+             and the job queue of a standby process.
+    """
+    def apply(op, record):
+        if op == failover.ADD:
+            restore_job(dispatcher, job_queue, record['chat'], record['name'],
+                        record['message'], record['due'], record['priority'])
+        else:
+            drop_job(dispatcher, record['chat'], record['name'])
+    return apply
 
 #------------------------------------------------------------------------------
 # Main function for bot to be run on a computer.
 #------------------------------------------------------------------------------
 
 
-def main():
+def add_handlers(dispatcher):
     """
-    Main function to initialize bot, add all handlers and start listening
-    to the user's input.
+    Function to add all handlers of the bot. It is used by main and
+    by the SIGHUP handler reload, which passes a HandlerTable instead
+    of the dispatcher.
+
+    :param dispatcher: dispatcher or anything with add_handler
+                       and add_error_handler methods.
     """
-    updater = Updater(read_token(TOKEN_FILENAME))
-    dispatcher = updater.dispatcher
+    ADMIN_IDS.update(read_admins(ADMINS_FILENAME))
     dispatcher.add_handler(CommandHandler('start', start))
     dispatcher.add_handler(CommandHandler('help', help))
     dispatcher.add_handler(CommandHandler('new_timer', new_timer,
@@ -693,9 +1796,45 @@ def main():
                                           pass_args=True,
                                           pass_job_queue=True,
                                           pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('new_timers', new_timers,
+                                          pass_job_queue=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('new_events', new_events,
+                                          pass_job_queue=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(MessageHandler(Filters.document.category('text/')
+                                          & Filters.caption(['/new_timers',
+                                                             '/new_events']),
+                                          bulk_file,
+                                          pass_job_queue=True,
+                                          pass_chat_data=True))
     dispatcher.add_handler(CommandHandler('unset', unset,
                                           pass_args=True,
                                           pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('email', email_address,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('via', via,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('find', find,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('history', history,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('agenda', agenda,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('timezone', time_zone,
+                                          pass_args=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('digest', digest_mode,
+                                          pass_args=True,
+                                          pass_job_queue=True,
+                                          pass_chat_data=True))
+    dispatcher.add_handler(CommandHandler('stats', stats))
+    dispatcher.add_handler(CommandHandler('profile', profile, pass_args=True))
     
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('event', event, pass_chat_data=True),
@@ -706,7 +1845,8 @@ def main():
             EVENT_NAME: [MessageHandler(Filters.text, event_name, pass_chat_data=True)],
             EVENT_DATE: [MessageHandler(Filters.text, event_date, pass_chat_data=True)],
             EVENT_LOC: [MessageHandler(Filters.text, event_loc, pass_chat_data=True),
-                        CommandHandler('skip', skip_event_loc)],
+                        CommandHandler('skip', skip_event_loc,
+                                       pass_chat_data=True)],
             EVENT_MSG: [MessageHandler(Filters.text, event_msg,
                                        pass_job_queue=True, pass_chat_data=True),
                         CommandHandler('skip', skip_event_msg, 
@@ -717,25 +1857,146 @@ def main():
                                        pass_job_queue=True, pass_chat_data=True),
 
             CommandHandler('skip', skip_timer_msg,
-                           pass_job_queue=True, pass_chat_data=True)]
+                           pass_job_queue=True, pass_chat_data=True)],
+            ConversationHandler.TIMEOUT: [MessageHandler(Filters.all,
+                                                         conversation_timeout,
+                                                         pass_chat_data=True)]
         },
 
         fallbacks=[CommandHandler('cancel', cancel_event),
                    CommandHandler('event', event, pass_chat_data=True),
                    CommandHandler('timer', timer, pass_chat_data=True)
-                   ]
+                   ],
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        # name lets handler reload carry conversations in progress over
+        name='entries'
     )
     
     dispatcher.add_handler(conv_handler)
+    get_stats().attach(conv_handler=conv_handler)
     dispatcher.add_handler(MessageHandler(Filters.command, unknown))
     # log all errors
     dispatcher.add_error_handler(error)
-    # Start the Bot
+
+
+def parse_args(argv=None):
+    """
+    Function to read the command line options of the bot, a wrong
+    option prints the usage and exits.
+
+    :param argv: options, sys.argv[1:] by default.
+
+    :return: argparse.Namespace with failover, record and scrub.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.bot_organizer',
+        description='Telegram bot reminding about events and timers.')
+    parser.add_argument('--failover', action='store_true',
+                        help=f'run as active or standby process, sharing '
+                             f'{failover.JOURNAL_FILENAME}')
+    parser.add_argument('--record', metavar='FILE',
+                        help='keep incoming updates in FILE for replays')
+    parser.add_argument('--scrub', action='store_true',
+                        help='drop personal data from recorded updates, '
+                             'FILE must not exist')
+    args = parser.parse_args(argv)
+    if args.scrub and args.record is not None and os.path.exists(args.record):
+        parser.error(f'{args.record} exists, pseudonyms of a scrubbed '
+                     f'recording can not be continued')
+    return args
+
+
+def main(argv=None):
+    """
+    Main function to initialize bot, add all handlers and start listening
+    to the user's input.
+
+    :param argv: command line options, sys.argv[1:] by default.
+    """
+    args = parse_args(argv)
+    updater = Updater(read_token(TOKEN_FILENAME))
+    dispatcher = updater.dispatcher
+    # our scheduler takes its time from get_clock(), unlike JobQueue,
+    # alarms due close together share one wakeup, see job_slack
+    scheduler = Scheduler(slack=job_slack, batch=delivery_batch)
+    scheduler.set_dispatcher(dispatcher)
+    updater.job_queue = dispatcher.job_queue = scheduler
+    add_handlers(dispatcher)
+    get_stats().attach(dispatcher)
+    # samples are attributed to handlers and to the alarm job callback
+    get_profiler().attach(dispatcher, job_callbacks=[alarm])
+    # drop abandoned entries and job handles in small slices
+    updater.job_queue.run_repeating(ChatDataSweeper(dispatcher.chat_data,
+                                                    max_age=CONVERSATION_TIMEOUT),
+                                    interval=SWEEP_INTERVAL, first=SWEEP_INTERVAL)
+    # settings of chats first, so restored jobs go to their digests
+    snapshot = read_snapshot(SNAPSHOT_FILENAME)
+    if snapshot is not None:
+        restore_snapshot(dict(snapshot, jobs=[]), dispatcher,
+                         updater.job_queue)
+    if args.failover:
+        # the process holding the lease is active, the other one follows
+        # the journal and takes over when the lease is free
+        tail = failover.JournalTail(failover.JOURNAL_FILENAME,
+                                    journal_applier(dispatcher, scheduler))
+        lease = failover.Lease(failover.LEASE_FILENAME)
+        if lease.try_acquire():
+            tail.poll()
+        else:
+            failover.follow(tail, lease)
+        tail.close()
+        failover.configure_journal(failover.JOURNAL_FILENAME, tail.live)
+    # alarms due in more than an hour wait on disk, not in memory; a standby
+    # gets its store only now, when it holds the lease
+    scheduler = TieredScheduler(scheduler, JobStore(JOBS_FILENAME),
+                                dispatcher.chat_data)
+    updater.job_queue = dispatcher.job_queue = scheduler
+    # reschedule jobs saved by the last managed shutdown
+    if snapshot is not None:
+        # with a journal jobs come from it, it is never older than a snapshot
+        if failover.get_journal() is None:
+            restore_snapshot(dict(snapshot, chats={}), dispatcher,
+                             updater.job_queue)
+        # a restored snapshot must never be restored twice
+        os.remove(SNAPSHOT_FILENAME)
+    # alarms are sent by priority class, short timers first
+    delivery = configure_delivery(
+        lambda chat_id, text: updater.bot.send_message(chat_id, text=text))
+    register_drain('delivery', delivery.drain)
+    # fired and cancelled jobs are appended to day files
+    configure_history(HISTORY_DIRNAME)
+    admission_settings = read_admission_settings(ADMISSION_FILENAME)
+    if admission_settings is not None:
+        get_admission().configure(**admission_settings)
+    # email reminders are sent by a pool of SMTP workers
+    smtp_settings = read_smtp_settings(SMTP_FILENAME)
+    if smtp_settings is not None:
+        register_drain('mailer', configure_mailer(**smtp_settings).drain)
+    # handlers run on a pool of workers, in order within every chat
+    executor = dispatch.install(dispatcher)
+    register_drain('dispatch', executor.drain)
+    get_stats().attach(executor=executor)
+    if args.record is not None:
+        # incoming updates are kept for replays, --scrub drops personal data
+        recorder = replay.Recorder(args.record, scrub=args.scrub)
+        replay.install(dispatcher, recorder)
+        register_drain('recorder', recorder.drain)
+    # poll from the last handled update, drop updates which come twice
+    offset_store = offsets.OffsetStore(offsets.OFFSET_FILENAME)
+    offsets.install(updater, offset_store)
+    register_drain('offsets', offset_store.drain)
+    # local only JSON endpoint with the same data as /stats
+    start_http_server()
+    # Start the Bot, getUpdates limit and timeout follow the intake rate
+    polling.install(updater)
     updater.start_polling()
-    # Block until you press Ctrl-C or the process receives SIGINT, SIGTERM or
-    # SIGABRT. This should be used most of the time, since start_polling() is
-    # non-blocking and will stop the _bot gracefully.
-    updater.idle()
+    # Block until the process receives SIGINT, SIGTERM or SIGABRT, then drain
+    # and write a snapshot. SIGHUP reloads the handlers of this module.
+    run_until_stopped(updater,
+                      lambda: make_snapshot(dispatcher, updater.job_queue),
+                      SNAPSHOT_FILENAME)
+    # the jobs left on disk are in the snapshot now
+    scheduler.store.close()
 
 
 if __name__=='__main__':
@@ -0,0 +1,115 @@
+"""
+Clock abstraction used by the handlers and by the scheduler.
+
+Nothing in the bot should call datetime.now() or time.time() directly,
+but ask get_clock() instead. In production it is the SystemClock,
+tests and simulations install a VirtualClock, which stands still
+until it is moved forward, so a week of alarms can be fired in seconds.
+"""
+
+import time
+from datetime import datetime
+
+REAL_WAIT = 0.01  # real seconds a thread waiting on a virtual clock sleeps
+
+
+class SystemClock:
+    """
+    Clock backed by the real time of the machine.
+    """
+
+    def time(self):
+        """
+        :return: seconds since the epoch, as time.time().
+        """
+        return time.time()
+
+    def now(self):
+        """
+        :return: naive local datetime, as datetime.now().
+        """
+        return datetime.now()
+
+    def monotonic(self):
+        """
+        :return: seconds from a monotonic clock, as time.monotonic().
+        """
+        return time.monotonic()
+
+    def wait(self, event, timeout):
+        """
+        Block until `event` is set or `timeout` seconds passed.
+
+        :param event: threading.Event to wait for.
+        :param timeout: seconds to wait at most.
+
+        :return: True if the event was set.
+        """
+        return event.wait(timeout)
+
+
+class VirtualClock:
+    """
+    Clock which moves only when told to.
+
+    :param start: initial time in seconds since the epoch,
+                  current real time by default.
+    """
+
+    def __init__(self, start=None):
+        self._time = time.time() if start is None else float(start)
+
+    def time(self):
+        return self._time
+
+    def now(self):
+        return datetime.fromtimestamp(self._time)
+
+    def monotonic(self):
+        return self._time
+
+    def wait(self, event, timeout):
+        # virtual time moves only by set/advance from another thread,
+        # so never block for long, just give that thread a chance
+        return event.wait(min(timeout, REAL_WAIT))
+
+    def set(self, timestamp):
+        """
+        Jump to `timestamp`. Virtual time never goes back.
+
+        :param timestamp: seconds since the epoch.
+        """
+        self._time = max(self._time, float(timestamp))
+
+    def advance(self, seconds):
+        """
+        Move the clock `seconds` forward.
+
+        :param seconds: number of seconds, int, float or timedelta.
+        """
+        if hasattr(seconds, 'total_seconds'):
+            seconds = seconds.total_seconds()
+        self.set(self._time + seconds)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    """
+    Function to get the clock used by the bot.
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Install another clock, e.g. a VirtualClock for tests or simulations.
+
+    :param clock: new clock.
+
+    :return: previously installed clock.
+    """
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
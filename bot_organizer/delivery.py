@@ -0,0 +1,303 @@
+"""
+Outbound delivery of alarm messages with priority classes.
+
+Every alarm is put into the queue of its priority class and a sender
+thread picks the next class by smooth weighted round robin, so a short
+/new_timer reminder does not wait behind hundreds of bulk notifications.
+BULK is meant for fan-out traffic sent to many chats at once, reminders
+keep the class of their due time however they were created.
+Low priority items that became stale are merged per chat into one
+message, and dropped with a warning once they are too late to matter.
+Lateness of every sent item is observed as delivery.<class>.lateness.
+
+Alarms of one scheduler bucket are submitted inside DeliveryQueue.batch()
+and queued together, with one lock acquisition and one wakeup of the
+senders.
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from bot_organizer.clock import get_clock
+from bot_organizer.metrics import get_metrics
+
+SHORT_TIMER = 'short_timer'
+IMMINENT = 'imminent'
+DIGEST = 'digest'
+BULK = 'bulk'
+
+MERGE_SCAN = 100  # items of a class looked at when merging stale items
+WAIT = 0.5        # seconds the sender waits for items before checking state
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class PriorityClass:
+    """
+    Settings of one priority class.
+
+    :param name: name of the class.
+    :param weight: share of sends the class gets when all classes wait.
+    :param stale_after: lateness in seconds after which waiting items
+                        of the same chat are merged into one message,
+                        None to never merge.
+    :param drop_after: lateness in seconds after which items are dropped,
+                       None to never drop.
+    """
+    __slots__ = ('name', 'weight', 'stale_after', 'drop_after', 'items',
+                 'current')
+
+    def __init__(self, name, weight, stale_after=None, drop_after=None):
+        self.name = name
+        self.weight = weight
+        self.stale_after = stale_after
+        self.drop_after = drop_after
+        self.items = collections.deque()
+        self.current = 0
+
+
+def default_classes():
+    """
+    :return: list of PriorityClass used by the bot.
+    """
+    return [PriorityClass(SHORT_TIMER, weight=8),
+            PriorityClass(IMMINENT, weight=4),
+            PriorityClass(DIGEST, weight=2, stale_after=15 * 60,
+                          drop_after=24 * 3600),
+            PriorityClass(BULK, weight=1, stale_after=5 * 60,
+                          drop_after=6 * 3600)]
+
+
+class DeliveryQueue:
+    """
+    Priority queue of outbound messages with its sender threads.
+
+    :param send: function called as send(chat_id, text).
+    :param classes: list of PriorityClass, default_classes() by default.
+    :param workers: number of sender threads, 0 to send only with step().
+    """
+
+    def __init__(self, send, classes=None, workers=1):
+        self.send = send
+        self.classes = collections.OrderedDict(
+            (priority.name, priority)
+            for priority in (classes or default_classes()))
+        self._condition = threading.Condition()
+        self._queued = 0
+        self._in_flight = 0
+        self._running = True
+        # messages submitted inside batch(), per thread
+        self._local = threading.local()
+        self._threads = [threading.Thread(target=self._worker,
+                                          name=f'delivery_{number}',
+                                          daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, priority, chat_id, text, due=None):
+        """
+        Queue a message.
+
+        :param priority: name of the priority class.
+        :param chat_id: chat to send the message to.
+        :param text: message text.
+        :param due: timestamp the message was due at, now by default.
+        """
+        if due is None:
+            due = get_clock().time()
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append((priority, due, chat_id, text))
+            return
+        with self._condition:
+            self.classes[priority].items.append((due, chat_id, text))
+            self._queued += 1
+            self._condition.notify()
+        get_metrics().inc(f'delivery.{priority}.queued')
+
+    def submit_many(self, items):
+        """
+        Queue many messages at once.
+
+        :param items: iterable of (priority, due, chat_id, text).
+        """
+        counts = collections.Counter()
+        with self._condition:
+            for priority, due, chat_id, text in items:
+                self.classes[priority].items.append((due, chat_id, text))
+                counts[priority] += 1
+            self._queued += sum(counts.values())
+            self._condition.notify(sum(counts.values()))
+        for priority, count in counts.items():
+            get_metrics().inc(f'delivery.{priority}.queued', count)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager collecting messages submitted by this thread
+        and queueing them with submit_many() when it exits.
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            # nested, the outer batch queues everything
+            yield
+            return
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            if pending:
+                self.submit_many(pending)
+
+    def __len__(self):
+        return self._queued
+
+    def _next_class(self):
+        # smooth weighted round robin over classes with waiting items
+        total = 0
+        best = None
+        for priority in self.classes.values():
+            if priority.items:
+                priority.current += priority.weight
+                total += priority.weight
+                if best is None or priority.current > best.current:
+                    best = priority
+        if best is not None:
+            best.current -= total
+        return best
+
+    def _take(self, now):
+        """
+        Pop the next item to send, dropping or merging stale ones.
+        Must be called with the condition held.
+
+        :return: (priority, due, chat_id, text) or None.
+        """
+        metrics = get_metrics()
+        while True:
+            priority = self._next_class()
+            if priority is None:
+                return None
+            due, chat_id, text = priority.items.popleft()
+            self._queued -= 1
+            lateness = now - due
+            if priority.drop_after is not None and lateness > priority.drop_after:
+                metrics.inc(f'delivery.{priority.name}.dropped')
+                get_logger().warning(f'Dropped {priority.name} message to '
+                                     f'{chat_id}, {lateness:.0f} seconds '
+                                     f'late.')
+                continue
+            if priority.stale_after is not None and lateness > priority.stale_after:
+                text = self._merge(priority, chat_id, text)
+            return priority, due, chat_id, text
+
+    def _merge(self, priority, chat_id, text):
+        merged = [text]
+        kept = []
+        for _ in range(min(MERGE_SCAN, len(priority.items))):
+            item = priority.items.popleft()
+            if item[1] == chat_id:
+                merged.append(item[2])
+            else:
+                kept.append(item)
+        # put the items of other chats back in their order
+        priority.items.extendleft(reversed(kept))
+        if len(merged) == 1:
+            return text
+        self._queued -= len(merged) - 1
+        get_metrics().inc(f'delivery.{priority.name}.merged', len(merged) - 1)
+        return ''.join((f'Sorry, these {len(merged)} reminders are late:\n\n',
+                        '\n\n'.join(merged)))
+
+    def step(self):
+        """
+        Send one message, if any is waiting.
+
+        :return: True if something was sent or dropped.
+        """
+        clock = get_clock()
+        with self._condition:
+            taken = self._take(clock.time())
+            if taken is None:
+                # stale items could have been dropped, wake up drain()
+                self._condition.notify_all()
+                return False
+            self._in_flight += 1
+        priority, due, chat_id, text = taken
+        try:
+            self.send(chat_id, text)
+            get_metrics().observe(f'delivery.{priority.name}.lateness',
+                                  max(clock.time() - due, 0))
+        except Exception:
+            get_logger().exception(f'Could not deliver message to {chat_id}')
+            get_metrics().inc(f'delivery.{priority.name}.failed')
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+        return True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._running and not self._queued:
+                    self._condition.wait(WAIT)
+                if not self._running and not self._queued:
+                    return
+            self.step()
+
+    def drain(self, deadline):
+        """
+        Wait until every queued message was sent.
+
+        :param deadline: time.monotonic value to give up at.
+
+        :return: True if the queue was emptied in time.
+        """
+        with self._condition:
+            while self._queued or self._in_flight:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._condition.wait(left)
+        return True
+
+    def stop(self):
+        """
+        Stop the sender threads once the queue is empty.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+_delivery = None
+
+
+def get_delivery():
+    """
+    Function to get the delivery queue, None means send right away.
+    """
+    return _delivery
+
+
+def configure_delivery(send, **settings):
+    """
+    Start the shared delivery queue, see DeliveryQueue for the settings.
+
+    :return: the new delivery queue.
+    """
+    global _delivery
+    _delivery = DeliveryQueue(send, **settings)
+    return _delivery
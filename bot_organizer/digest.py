@@ -0,0 +1,193 @@
+"""
+Digest buffer of reminders sent together, one message per chat and slot.
+
+A chat in digest mode (hourly or daily) does not get one scheduler job
+and one message per reminder. Its digest-eligible reminders are appended
+to the buffer of the slot they are due in, and chat_data keeps a small
+DigestJob handle for each of them. The first reminder of a slot schedules
+one job for the chat at the start of the slot; when it runs, all
+reminders left in the slot are taken and sent as one message. Unsetting
+the last reminder of a slot removes its job too.
+
+Slots follow the clock of the chat's time zone: hourly slots start at
+full hours, daily slots at DAILY_TIME, so the reminders of a day come
+with the morning digest. A digest is sent ahead, at the start of its
+slot, and lists the reminders due until the slot ends with their times:
+a reminder of the daily digest comes up to a day before it is due.
+
+The buffer lives only in memory. Buffered reminders keep their own
+delivery priority and are written to the snapshot and the journal like
+any other alarm, only the DigestJob handle marks them as buffered. On
+restore they go to a digest again if the chat is still in digest mode,
+so the jobs of the slots are rebuilt and never need to be persisted.
+"""
+
+import threading
+from datetime import datetime
+
+from bot_organizer.metrics import get_metrics
+
+HOURLY = 'hourly'
+DAILY = 'daily'
+SLOT_LENGTHS = {HOURLY: 3600, DAILY: 24 * 3600}
+DAILY_TIME = 8 * 3600  # local time of day the daily digest is sent at
+
+
+def slot_start(due, mode, zone):
+    """
+    :param due: timestamp of a reminder.
+    :param mode: HOURLY or DAILY.
+    :param zone: ZoneTable of the chat.
+
+    :return: timestamp of the start of the slot `due` is in.
+    """
+    length = SLOT_LENGTHS[mode]
+    offset = DAILY_TIME if mode == DAILY else 0
+    local = zone.to_local(due) - offset
+    return zone.to_epoch(local - local % length + offset)
+
+
+class DigestJob:
+    """
+    Handle of a reminder waiting in a digest, kept in chat_data instead
+    of the Job. It has the attributes of Job the handlers, the sweeper
+    and the snapshot look at.
+    """
+    __slots__ = ('buffer', 'context', 'due', 'start', 'removed')
+
+    def __init__(self, buffer, context, due, start):
+        self.buffer = buffer
+        self.context = context
+        self.due = due
+        self.start = start
+        self.removed = False
+
+    @property
+    def next_t(self):
+        if self.removed:
+            return None
+        return datetime.fromtimestamp(self.due)
+
+    def schedule_removal(self):
+        self.buffer.remove(self)
+
+    def __repr__(self):
+        return f'DigestJob({self.context[1]!r}, due={self.due})'
+
+
+class DigestSlot:
+    """
+    Reminders of one chat due in one slot and the job sending them.
+    """
+    __slots__ = ('jobs', 'job')
+
+    def __init__(self):
+        self.jobs = []
+        self.job = None
+
+
+class DigestBuffer:
+    """
+    Digest slots of all chats.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = dict()
+
+    def add(self, job_queue, callback, due, context, start):
+        """
+        Append a reminder to its slot, scheduling the slot if it is new.
+
+        :param job_queue: queue the job of the slot is scheduled in.
+        :param callback: function sending the digest, called at `start`
+                         with the job context [chat_id, start].
+        :param due: timestamp of the reminder.
+        :param context: context of the reminder, like the one of alarm.
+        :param start: start of the slot, from slot_start.
+
+        :return: DigestJob handle of the reminder.
+        """
+        handle = DigestJob(self, context, due, start)
+        key = (context[0], start)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = DigestSlot()
+                slot.job = job_queue.run_at(callback, start,
+                                            context=[context[0], start])
+                get_metrics().inc('digest.slots')
+            slot.jobs.append(handle)
+        get_metrics().inc('digest.buffered')
+        return handle
+
+    def remove(self, handle):
+        """
+        Remove a reminder, used by DigestJob.schedule_removal.
+        The job of a slot left empty is removed as well.
+        """
+        key = (handle.context[0], handle.start)
+        with self._lock:
+            if handle.removed:
+                return
+            handle.removed = True
+            slot = self._slots.get(key)
+            if slot is None:
+                return
+            slot.jobs.remove(handle)
+            if not slot.jobs:
+                slot.job.schedule_removal()
+                del self._slots[key]
+        get_metrics().dec('digest.buffered')
+
+    def take(self, chat_id, start):
+        """
+        Take all reminders of a slot whose job is running.
+
+        :return: list of DigestJob sorted by due time.
+        """
+        with self._lock:
+            slot = self._slots.pop((chat_id, start), None)
+            if slot is None:
+                return []
+            for handle in slot.jobs:
+                handle.removed = True
+        get_metrics().dec('digest.buffered', len(slot.jobs))
+        return sorted(slot.jobs, key=lambda handle: handle.due)
+
+    def chat_jobs(self, chat_id):
+        """
+        :return: list of reminders of `chat_id` waiting in digests.
+        """
+        with self._lock:
+            return [handle for (owner, _), slot in self._slots.items()
+                    if owner == chat_id for handle in slot.jobs]
+
+    def jobs(self):
+        """
+        :return: tuple of all reminders waiting in digests.
+        """
+        with self._lock:
+            return tuple(handle for slot in self._slots.values()
+                         for handle in slot.jobs)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(slot.jobs) for slot in self._slots.values())
+
+    def clear(self):
+        """
+        Forget all slots. Used mostly by tests.
+        """
+        with self._lock:
+            self._slots.clear()
+
+
+buffer = DigestBuffer()
+
+
+def get_digest():
+    """
+    Function to get the shared digest buffer.
+    """
+    return buffer
@@ -0,0 +1,202 @@
+"""
+Parallel dispatch of updates with per-chat ordering.
+
+The dispatcher thread of the updater handles one update after another,
+so one slow reply_text in one chat delays every other chat. ChatExecutor
+runs updates on a pool of worker threads instead, keyed by chat:
+
+* updates of one chat are handled strictly in the order they came,
+  never by two workers at once, so chat_data entries of the /event and
+  /timer conversations see the same sequence as before,
+* updates of different chats run in parallel, a chat with waiting
+  updates is put back at the end of the ready queue after each update,
+  so a chat sending a burst does not hold a worker for all of it.
+
+The dispatcher thread only drops duplicates (offsets.UpdateGate) and
+hands the update over. Errors of polling have no chat and are handled
+right away in the dispatcher thread, like before.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from bot_organizer.metrics import get_metrics
+
+WORKERS = 8  # threads running handlers
+WAIT = 0.5   # seconds a worker waits for updates before checking state
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def chat_key(update):
+    """
+    :return: key of the queue the update is handled in: id of the chat,
+             ('user', id) for updates without chat, None if it has
+             neither and can go to any worker.
+    """
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return 'user', user.id
+    return None
+
+
+class ChatExecutor:
+    """
+    Worker pool running tasks of one key in order, tasks of different
+    keys in parallel.
+
+    :param workers: number of worker threads, 0 to run tasks only with step().
+    """
+
+    def __init__(self, workers=WORKERS):
+        self._condition = threading.Condition()
+        # key -> deque of waiting tasks, a key is here while it has tasks
+        # waiting or running, so it is in `_ready` or taken by one worker
+        self._pending = dict()
+        self._ready = collections.deque()
+        self._queued = 0
+        self._in_flight = 0
+        self._running = True
+        self._threads = [threading.Thread(target=self._worker,
+                                          name=f'dispatch_{number}',
+                                          daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, function, *args):
+        """
+        Queue function(*args) after the waiting tasks of the same key.
+
+        :param key: hashable key, None for a task without ordering.
+        """
+        with self._condition:
+            if key is None:
+                # a key of its own, never equal to another one
+                key = object()
+            tasks = self._pending.get(key)
+            if tasks is None:
+                self._pending[key] = collections.deque([(function, args)])
+                self._ready.append(key)
+                self._condition.notify()
+            else:
+                tasks.append((function, args))
+            self._queued += 1
+        get_metrics().set('dispatch.queued', self._queued)
+
+    def __len__(self):
+        return self._queued
+
+    def step(self):
+        """
+        Run one task of the key which is longest ready, if any.
+
+        :return: True if a task was run.
+        """
+        with self._condition:
+            if not self._ready:
+                return False
+            key = self._ready.popleft()
+            function, args = self._pending[key].popleft()
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            function(*args)
+        except Exception:
+            get_logger().exception(f'Task of {key!r} failed')
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                if self._pending[key]:
+                    # next task of the key, behind the other ready keys
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._pending[key]
+                self._condition.notify_all()
+        get_metrics().inc('dispatch.handled')
+        return True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._running and not self._ready:
+                    self._condition.wait(WAIT)
+                if not self._running and not self._pending:
+                    return
+            self.step()
+
+    def drain(self, deadline):
+        """
+        Wait until every queued task was run.
+
+        :param deadline: time.monotonic value to give up at.
+
+        :return: True if everything was run in time.
+        """
+        with self._condition:
+            while self._pending:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._condition.wait(left)
+        return True
+
+    def stop(self):
+        """
+        Stop the worker threads once every task was run.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class ParallelDispatch:
+    """
+    Replacement of Dispatcher.process_update handing updates
+    to a ChatExecutor.
+
+    :param process_update: the wrapped dispatcher.process_update.
+    :param executor: ChatExecutor running the updates.
+    """
+
+    def __init__(self, process_update, executor):
+        self.process_update = process_update
+        self.executor = executor
+
+    def __call__(self, update):
+        key = chat_key(update)
+        if key is None:
+            # errors of polling, nothing to keep in order with
+            self.process_update(update)
+            return
+        self.executor.submit(key, self.process_update, update)
+
+
+def install(dispatcher, workers=WORKERS):
+    """
+    Run the handlers of the dispatcher on a pool of workers.
+    Install it before offsets.install, so duplicates are dropped
+    in the dispatcher thread, in the order updates came.
+
+    :param dispatcher: dispatcher which was not started yet.
+    :param workers: number of worker threads.
+
+    :return: the ChatExecutor, to be drained on shutdown.
+    """
+    executor = ChatExecutor(workers)
+    dispatcher.process_update = ParallelDispatch(dispatcher.process_update,
+                                                 executor)
+    return executor
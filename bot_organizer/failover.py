@@ -0,0 +1,342 @@
+"""
+Warm standby on one machine: job journal and file lock lease.
+
+The active process holds an exclusive flock on LEASE_FILENAME and appends
+every change of its jobs to JOURNAL_FILENAME as one JSON line:
+
+    {"op":"add","chat":1,"name":"tea","message":"...","due":...,"priority":...}
+    {"op":"remove","chat":1,"name":"tea"}   unset or replaced
+    {"op":"fired","chat":1,"name":"tea"}    written before the alarm is sent
+
+A standby process tails the journal into its own, not started scheduler
+and tries to take the lease every TAIL_INTERVAL seconds. The kernel drops
+the lock the moment the active process dies, so the standby reads the
+journal to its end and starts within about a second. Alarms which came
+due in the gap fire right away; fired records are written before sending,
+so an alarm is never sent by both processes.
+
+The journal is compacted to the live jobs on takeover and whenever
+COMPACT_BYTES were appended, readers notice the new inode and diff it
+against what they have already applied.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+JOURNAL_FILENAME = 'journal.log'
+LEASE_FILENAME = 'lease.lock'
+TAIL_INTERVAL = 0.5              # seconds between two polls of the standby
+COMPACT_BYTES = 16 * 1024 * 1024  # journal bytes appended before compaction
+
+ADD = 'add'
+REMOVE = 'remove'
+FIRED = 'fired'
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def key_of(record):
+    """
+    :return: (chat_id, name) the record is about.
+    """
+    return record['chat'], record['name']
+
+
+def encode(record):
+    """
+    :return: record as one compact JSON line.
+    """
+    return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class Lease:
+    """
+    Exclusive flock on a file, held for the whole life of the active process.
+
+    :param filename: path of the lock file.
+    """
+
+    def __init__(self, filename=LEASE_FILENAME):
+        self.filename = filename
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """
+        Take the lease if nobody holds it, never blocks.
+
+        :return: True if the lease is held now.
+        """
+        if self._fd is not None:
+            return True
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # pid of the holder, only for people looking at the file
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode('ascii'))
+        self._fd = fd
+        return True
+
+    def release(self):
+        """
+        Give the lease up.
+        """
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class Journal:
+    """
+    Writer of the journal, used by the active process.
+
+    :param filename: path of the journal.
+    :param live: dict {(chat_id, name): add record} of live jobs,
+                 the journal is compacted to them right away.
+    :param compact_bytes: bytes appended before the next compaction.
+    """
+
+    def __init__(self, filename=JOURNAL_FILENAME, live=None,
+                 compact_bytes=COMPACT_BYTES):
+        self.filename = filename
+        self.compact_bytes = compact_bytes
+        self.live = dict(live or {})
+        self._lock = threading.Lock()
+        self._fd = None
+        self._appended = 0
+        self.compact()
+
+    def append(self, record):
+        """
+        Write one record, it is on disk when this returns.
+        """
+        data = encode(record)
+        with self._lock:
+            if record['op'] == ADD:
+                self.live[key_of(record)] = record
+            else:
+                self.live.pop(key_of(record), None)
+            # one write of a whole line, readers never see half a record
+            # unless the process dies in the middle of it
+            os.write(self._fd, data)
+            self._appended += len(data)
+            if self._appended >= self.compact_bytes:
+                self._compact()
+
+    def added(self, chat_id, name, message, due, priority):
+        self.append({'op': ADD, 'chat': chat_id, 'name': name,
+                     'message': message, 'due': due, 'priority': priority})
+
+    def removed(self, chat_id, name):
+        self.append({'op': REMOVE, 'chat': chat_id, 'name': name})
+
+    def fired(self, chat_id, name):
+        self.append({'op': FIRED, 'chat': chat_id, 'name': name})
+
+    def compact(self):
+        """
+        Atomically replace the journal with add records of live jobs.
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        tmp_filename = f'{self.filename}.tmp'
+        with open(tmp_filename, 'wb') as file:
+            for record in self.live.values():
+                file.write(encode(record))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self.filename)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND)
+        self._appended = 0
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class JournalTail:
+    """
+    Reader following the journal, used by the standby process.
+
+    :param filename: path of the journal.
+    :param apply: function called as apply(op, record) for every change,
+                  op is ADD or REMOVE (fired jobs are removed as well).
+    """
+
+    def __init__(self, filename, apply):
+        self.filename = filename
+        self.apply = apply
+        self.live = dict()
+        self._file = None
+        self._inode = None
+        self._partial = b''
+
+    def _open(self):
+        try:
+            file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return None
+        self._inode = os.fstat(file.fileno()).st_ino
+        self._partial = b''
+        return file
+
+    def _lines(self):
+        data = self._partial + self._file.read()
+        lines = data.split(b'\n')
+        # the last piece is a line still being written, or empty
+        self._partial = lines.pop()
+        for line in lines:
+            if line:
+                yield json.loads(line)
+
+    def _change(self, record):
+        key = key_of(record)
+        if record['op'] == ADD:
+            if self.live.get(key) != record:
+                self.live[key] = record
+                self.apply(ADD, record)
+        elif self.live.pop(key, None) is not None:
+            self.apply(REMOVE, record)
+
+    def _reload(self):
+        # first open or compacted file, diff it against the applied jobs
+        previous = self.live
+        self.live = dict()
+        count = 0
+        for record in self._lines():
+            count += 1
+            if record['op'] == ADD:
+                self.live[key_of(record)] = record
+            else:
+                self.live.pop(key_of(record), None)
+        for key, record in previous.items():
+            if key not in self.live:
+                self.apply(REMOVE, record)
+        for key, record in self.live.items():
+            if previous.get(key) != record:
+                self.apply(ADD, record)
+        return count
+
+    def poll(self):
+        """
+        Apply everything written since the last poll.
+
+        :return: number of records read.
+        """
+        if self._file is None:
+            self._file = self._open()
+            return 0 if self._file is None else self._reload()
+        count = 0
+        for record in self._lines():
+            self._change(record)
+            count += 1
+        try:
+            inode = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            return count
+        if inode != self._inode:
+            # compacted, the old file was read to its end above
+            self._file.close()
+            self._file = self._open()
+            if self._file is not None:
+                count += self._reload()
+        return count
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def follow(tail, lease, interval=TAIL_INTERVAL, sleep=time.sleep):
+    """
+    Standby loop: tail the journal until the lease can be taken.
+
+    :param tail: JournalTail of the journal.
+    :param lease: Lease of the active process.
+    :param interval: seconds between polls.
+    :param sleep: function used to wait.
+    """
+    get_logger().info('Standing by, following the journal.')
+    while True:
+        tail.poll()
+        if lease.try_acquire():
+            break
+        sleep(interval)
+    # the old active is gone, everything it wrote is in the file now
+    tail.poll()
+    get_logger().info('Lease taken, taking over.')
+
+
+_journal = None
+
+
+def get_journal():
+    """
+    Function to get the journal, None if failover is off.
+    """
+    return _journal
+
+
+def configure_journal(filename=JOURNAL_FILENAME, live=None):
+    """
+    Start writing the journal, compacted to `live` jobs.
+
+    :return: the new journal.
+    """
+    global _journal
+    _journal = Journal(filename, live)
+    return _journal
+
+
+def record_added(job):
+    """
+    Journal a job which was just scheduled.
+
+    :param job: the job, job.context is (chat_id, name, message,
+                chat_data, priority).
+    """
+    journal = get_journal()
+    if journal is not None:
+        chat_id, name, message = job.context[:3]
+        journal.added(chat_id, name, message, job.due,
+                      job.context[4])
+
+
+def record_removed(chat_id, name, fired=False):
+    """
+    Journal a job which was unset or replaced, or is about to fire.
+
+    :param chat_id: chat owning the job.
+    :param name: name of the job.
+    :param fired: True if the alarm of the job is being sent.
+    """
+    journal = get_journal()
+    if journal is not None:
+        if fired:
+            journal.fired(chat_id, name)
+        else:
+            journal.removed(chat_id, name)
@@ -0,0 +1,408 @@
+"""
+Append-only history of fired and cancelled jobs.
+
+Every record has the same width (RECORD_SIZE bytes), names and priority
+classes are interned into a per day string table, so a record costs
+32 bytes no matter how long the name is. Files are rotated by UTC day:
+
+    <directory>/YYYYMMDD.rec  records in the order they were written
+    <directory>/YYYYMMDD.str  length prefixed UTF-8 strings, id = position
+
+Readers mmap the record files and unpack only the records they look at.
+A reader indexes the records of every day by chat once, records appended
+later are added to the index when it is used again, so recent history
+of a chat costs the records returned, not the records of all chats.
+Indexes of the newest MAX_DAYS days are kept, older ones are dropped.
+HistoryLog.reader is the reader shared by the handlers. Records are
+appended in clock order, so the time range of a query is found by
+binary search.
+
+Offline queries:
+
+    python -m bot_organizer.history history --chat 42 --since 2030-01-01
+"""
+
+import argparse
+import bisect
+import collections
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bot_organizer.clock import get_clock
+
+HISTORY_DIRNAME = 'history'
+MAX_DAYS = 31   # days looked back by recent() at most
+
+RECORD = struct.Struct('<dqfIIB3x')  # time, chat_id, lateness, name, priority, kind
+RECORD_SIZE = RECORD.size
+LENGTH = struct.Struct('<H')
+MAX_STRING = 0xffff  # bytes of an interned string at most
+
+FIRED = 'fired'
+CANCELLED = 'cancelled'
+KINDS = (FIRED, CANCELLED)
+
+HistoryEntry = collections.namedtuple(
+    'HistoryEntry', ('time', 'chat_id', 'name', 'kind', 'lateness', 'priority'))
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def day_of(timestamp):
+    """
+    :return: UTC day of `timestamp` as YYYYMMDD string.
+    """
+    return time.strftime('%Y%m%d', time.gmtime(timestamp))
+
+
+class HistoryLog:
+    """
+    Writer of the history files.
+
+    :param directory: directory of the day files, created if missing.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._day = None
+        self._records = None
+        self._strings = None
+        self._ids = dict()
+        self.reader = HistoryReader(directory)
+
+    def _open(self, day):
+        self._close_files()
+        base = os.path.join(self.directory, day)
+        self._ids = {string: number for number, string
+                     in enumerate(read_strings(f'{base}.str'))}
+        self._strings = open(f'{base}.str', 'ab')
+        self._records = open(f'{base}.rec', 'ab')
+        # a torn record at the end (crash mid write) would shift the rest
+        self._records.truncate(self._records.tell()
+                               - self._records.tell() % RECORD_SIZE)
+        self._day = day
+
+    def _intern(self, string):
+        number = self._ids.get(string)
+        if number is None:
+            data = string.encode('utf-8')
+            if len(data) > MAX_STRING:
+                # cut at a character boundary, not inside of one
+                data = data[:MAX_STRING].decode('utf-8', 'ignore').encode(
+                    'utf-8')
+            self._strings.write(LENGTH.pack(len(data)))
+            self._strings.write(data)
+            # readers may see the record only after its strings
+            self._strings.flush()
+            number = self._ids[string] = len(self._ids)
+        return number
+
+    def record(self, kind, chat_id, name, lateness=0.0, priority='',
+               timestamp=None):
+        """
+        Append one record.
+
+        :param kind: FIRED or CANCELLED.
+        :param chat_id: chat owning the job.
+        :param name: name of the timer or event.
+        :param lateness: seconds the job fired after its due time.
+        :param priority: delivery priority class of the job.
+        :param timestamp: time of the record, now by default.
+        """
+        with self._lock:
+            # read under the lock, records of all threads stay in order
+            if timestamp is None:
+                timestamp = get_clock().time()
+            day = day_of(timestamp)
+            if day != self._day:
+                self._open(day)
+            self._records.write(RECORD.pack(
+                timestamp, chat_id, lateness, self._intern(name),
+                self._intern(priority), KINDS.index(kind)))
+            self._records.flush()
+
+    def _close_files(self):
+        for file in (self._records, self._strings):
+            if file is not None:
+                file.close()
+        self._records = self._strings = None
+        self._day = None
+
+    def close(self):
+        """
+        Close the files, next record opens them again.
+        """
+        with self._lock:
+            self._close_files()
+
+
+def read_strings(filename):
+    """
+    :return: list of strings of a day, empty if the file does not exist.
+    """
+    strings = []
+    try:
+        with open(filename, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return strings
+    offset = 0
+    while offset + LENGTH.size <= len(data):
+        length, = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings
+
+
+class DayFile:
+    """
+    Read only mmap view of the records of one day.
+
+    :param directory: directory of the day files.
+    :param day: YYYYMMDD string.
+    """
+
+    def __init__(self, directory, day):
+        base = os.path.join(directory, day)
+        self._map = None
+        self.count = 0
+        try:
+            with open(f'{base}.rec', 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                if size >= RECORD_SIZE:
+                    self._map = mmap.mmap(file.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+                    self.count = size // RECORD_SIZE
+        except FileNotFoundError:
+            pass
+        # strings are read after the records, so every id is known
+        self.strings = read_strings(f'{base}.str') if self.count else []
+
+    def __len__(self):
+        return self.count
+
+    def time_at(self, index):
+        return struct.unpack_from('<d', self._map, index * RECORD_SIZE)[0]
+
+    def chat_at(self, index):
+        return struct.unpack_from('<q', self._map, index * RECORD_SIZE + 8)[0]
+
+    def entry(self, index):
+        """
+        :return: HistoryEntry of record number `index`.
+        """
+        timestamp, chat_id, lateness, name, priority, kind = RECORD.unpack_from(
+            self._map, index * RECORD_SIZE)
+        return HistoryEntry(timestamp, chat_id, self.strings[name],
+                            KINDS[kind], lateness, self.strings[priority])
+
+    def bisect(self, timestamp):
+        """
+        :return: index of the first record at or after `timestamp`.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+
+
+class HistoryReader:
+    """
+    Queries over the history files.
+
+    :param directory: directory of the day files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._indexes = dict()  # day: (records indexed, {chat_id: indexes})
+
+    def _chat_indexes(self, day, day_file, chat_id):
+        """
+        Index the records of `day_file` not indexed yet.
+
+        :return: sorted list of indexes of the records of `chat_id`
+                 in `day_file`.
+        """
+        with self._lock:
+            count, chats = self._indexes.get(day, (0, None))
+            if chats is None or count > len(day_file):
+                # new day, or its files were replaced
+                count, chats = 0, dict()
+            for index in range(count, len(day_file)):
+                chats.setdefault(day_file.chat_at(index), []).append(index)
+            self._indexes[day] = (max(count, len(day_file)), chats)
+            # only the last MAX_DAYS days are read again by recent()
+            for old in sorted(self._indexes)[:-MAX_DAYS]:
+                del self._indexes[old]
+            indexes = chats.get(chat_id, [])
+            # other readers of the day may have indexed more records
+            return indexes[:bisect.bisect_left(indexes, len(day_file))]
+
+    def days(self):
+        """
+        :return: sorted list of YYYYMMDD days with records.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-4] for name in names if name.endswith('.rec'))
+
+    def query(self, chat_id=None, since=None, until=None):
+        """
+        Yield records in time order.
+
+        :param chat_id: only records of this chat, all chats if None.
+        :param since: timestamp of the first record, inclusive.
+        :param until: timestamp of the last record, exclusive.
+        """
+        first = day_of(since) if since is not None else None
+        last = day_of(until) if until is not None else None
+        for day in self.days():
+            if (first is not None and day < first
+                    or last is not None and day > last):
+                continue
+            with DayFile(self.directory, day) as day_file:
+                start = 0 if since is None else day_file.bisect(since)
+                end = len(day_file) if until is None else day_file.bisect(until)
+                if chat_id is None:
+                    indexes = range(start, end)
+                else:
+                    indexes = self._chat_indexes(day, day_file, chat_id)
+                    indexes = indexes[bisect.bisect_left(indexes, start):
+                                      bisect.bisect_left(indexes, end)]
+                for index in indexes:
+                    yield day_file.entry(index)
+
+    def recent(self, chat_id, limit):
+        """
+        :param chat_id: chat to read the history of.
+        :param limit: number of records.
+
+        :return: list of last `limit` records of the chat, newest first.
+        """
+        entries = []
+        for day in reversed(self.days()[-MAX_DAYS:]):
+            with DayFile(self.directory, day) as day_file:
+                indexes = self._chat_indexes(day, day_file, chat_id)
+                wanted = limit - len(entries)
+                for index in reversed(indexes[max(len(indexes) - wanted, 0):]):
+                    entries.append(day_file.entry(index))
+            if len(entries) >= limit:
+                break
+        return entries
+
+
+_history = None
+
+
+def get_history():
+    """
+    Function to get the history log, None if history is disabled.
+    """
+    return _history
+
+
+def configure_history(directory=HISTORY_DIRNAME):
+    """
+    Start writing history to `directory`.
+
+    :return: the new history log.
+    """
+    global _history
+    _history = HistoryLog(directory)
+    return _history
+
+
+def record_job(job, cancelled=False):
+    """
+    Write a history record of a job which fired or was cancelled.
+
+    :param job: the job, job.context is (chat_id, name, message,
+                chat_data, priority).
+    :param cancelled: True if the job was unset or replaced.
+    """
+    history = get_history()
+    if history is None:
+        return
+    lateness = 0.0
+    due = getattr(job, 'due', None)
+    if not cancelled and due is not None:
+        lateness = max(get_clock().time() - due, 0.0)
+    context = job.context
+    try:
+        history.record(CANCELLED if cancelled else FIRED, context[0],
+                       context[1], lateness,
+                       context[4] if len(context) > 4 else '')
+    except OSError:
+        get_logger().exception(f'Could not write history of {context[1]}')
+
+
+def parse_day(text):
+    """
+    :return: timestamp of local midnight of YYYY-MM-DD `text`.
+    """
+    return datetime.strptime(text, '%Y-%m-%d').timestamp()
+
+
+def main(argv=None):
+    """
+    Offline query tool, prints matching records as tab separated
+    values or JSON lines.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.history',
+        description='Query the history of fired and cancelled reminders.')
+    parser.add_argument('directory', nargs='?', default=HISTORY_DIRNAME)
+    parser.add_argument('--chat', type=int, help='only this chat id')
+    parser.add_argument('--since', type=parse_day, help='YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_day,
+                        help='YYYY-MM-DD, exclusive')
+    parser.add_argument('--json', action='store_true',
+                        help='print JSON lines')
+    args = parser.parse_args(argv)
+    reader = HistoryReader(args.directory)
+    for entry in reader.query(args.chat, args.since, args.until):
+        if args.json:
+            print(json.dumps(entry._asdict()))
+        else:
+            print(datetime.fromtimestamp(entry.time).isoformat(' ', 'seconds'),
+                  entry.chat_id, entry.kind, entry.name,
+                  f'{entry.lateness:.1f}', entry.priority, sep='\t')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+Process lifecycle of the bot: managed shutdown and hot handler reload.
+
+On SIGTERM/SIGINT intake is stopped first and the dispatcher is drained,
+then the job queue is stopped, so no alarm fires into an outbound queue
+which was already drained. All registered outbound queues are drained
+until a deadline, and only then a compact snapshot of the scheduler and
+chat state is written.
+On SIGHUP the handler module is reloaded and its handlers are swapped
+into the running dispatcher, the job queue and its jobs stay untouched.
+On SIGUSR1 a profile window of the sampling profiler is opened.
+"""
+
+import importlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+from bot_organizer.profiler import get_profiler, write_profile
+
+DRAIN_TIMEOUT = 10.0  # seconds for all drains together
+HANDLERS_MODULE = 'bot_organizer.bot_organizer'
+
+_drains = []
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def register_drain(name, drain):
+    """
+    Register an outbound queue to be drained on shutdown.
+
+    :param name: name used in logs.
+    :param drain: function taking deadline (time.monotonic value)
+                  and returning True if everything was flushed in time.
+    """
+    _drains.append((name, drain))
+
+
+def drain_update_queue(update_queue, deadline):
+    """
+    Wait until every update put into the queue was processed.
+
+    :param update_queue: dispatcher.update_queue.
+    :param deadline: time.monotonic value to give up at.
+
+    :return: True if queue is fully processed.
+    """
+    with update_queue.all_tasks_done:
+        while update_queue.unfinished_tasks:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            update_queue.all_tasks_done.wait(left)
+    return True
+
+
+def write_snapshot(filename, snapshot):
+    """
+    Atomically write snapshot as compact JSON.
+
+    :param filename: path of the snapshot file.
+    :param snapshot: JSON serializable dict.
+    """
+    tmp_filename = f'{filename}.tmp'
+    with open(tmp_filename, 'w') as file:
+        json.dump(snapshot, file, separators=(',', ':'))
+    os.replace(tmp_filename, filename)
+
+
+def read_snapshot(filename):
+    """
+    :param filename: path of the snapshot file.
+
+    :return: snapshot dict or None if there is no snapshot.
+    """
+    try:
+        with open(filename, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def shutdown(updater, make_snapshot, filename, timeout=DRAIN_TIMEOUT):
+    """
+    Managed shutdown: stop intake, stop jobs, drain, snapshot, stop
+    everything.
+
+    :param updater: running updater.
+    :param make_snapshot: function returning the snapshot dict.
+    :param filename: path of the snapshot file.
+    :param timeout: seconds for all drains together.
+
+    :return: True if everything was drained before the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    # polling thread leaves its loop as soon as running is False
+    updater.running = False
+    drained = drain_update_queue(updater.dispatcher.update_queue, deadline)
+    if not drained:
+        get_logger().warning('Dispatcher was not drained before the deadline.')
+    # an alarm firing later would go to a queue which is already drained,
+    # and it would be missing from the snapshot, so jobs stay where they are
+    updater.job_queue.stop()
+    for name, drain in _drains:
+        if not drain(deadline):
+            get_logger().warning(f'{name} was not drained before the deadline.')
+            drained = False
+    write_snapshot(filename, make_snapshot())
+    get_logger().info(f'Snapshot written to {filename}.')
+    # dispatcher threads are still running, so stop() joins everything
+    updater.stop()
+    return drained
+
+
+class HandlerTable:
+    """
+    Collects handlers the same way dispatcher does, so a full set
+    of handlers can be built aside and swapped in at once.
+    """
+
+    def __init__(self):
+        self.handlers = dict()
+        self.groups = []
+        self.error_handlers = []
+
+    def add_handler(self, handler, group=0):
+        if group not in self.handlers:
+            self.handlers[group] = []
+            self.groups = sorted(self.groups + [group])
+        self.handlers[group].append(handler)
+
+    def add_error_handler(self, callback):
+        self.error_handlers.append(callback)
+
+
+def _conversation_handlers(handlers):
+    return {handler.name: handler
+            for group in handlers.values() for handler in group
+            if getattr(handler, 'conversations', None) is not None
+            and getattr(handler, 'name', None)}
+
+
+def reload_handlers(dispatcher, module_name=HANDLERS_MODULE):
+    """
+    Reload the handler module and swap its handlers into the dispatcher.
+    Conversations in progress are carried over by conversation handler name.
+
+    :param dispatcher: running dispatcher.
+    :param module_name: module with add_handlers(dispatcher) function.
+
+    :return: the reloaded module.
+    """
+    module = importlib.reload(importlib.import_module(module_name))
+    table = HandlerTable()
+    module.add_handlers(table)
+    old_conversations = _conversation_handlers(dispatcher.handlers)
+    for name, handler in _conversation_handlers(table.handlers).items():
+        if name in old_conversations:
+            handler.conversations.update(old_conversations[name].conversations)
+    # the dispatcher thread reads these attributes once per update,
+    # so it sees either the old or the new set, never a mix
+    dispatcher.error_handlers = table.error_handlers
+    dispatcher.handlers = table.handlers
+    dispatcher.groups = table.groups
+    get_logger().info(f'Reloaded handlers from {module_name}.')
+    return module
+
+
+def run_until_stopped(updater, make_snapshot, filename,
+                      timeout=DRAIN_TIMEOUT, module_name=HANDLERS_MODULE):
+    """
+    Replacement of updater.idle() with managed shutdown, SIGHUP reload
+    and SIGUSR1 profiling.
+    Signals only set flags, the work is done in the main thread.
+
+    :param updater: running updater.
+    :param make_snapshot: function returning the snapshot dict.
+    :param filename: path of the snapshot file.
+    :param timeout: seconds for all drains together.
+    :param module_name: handler module reloaded on SIGHUP.
+    """
+    stop = threading.Event()
+    reload = threading.Event()
+    profile = threading.Event()
+    wake = threading.Event()
+
+    def on_stop(_signum, _frame):
+        stop.set()
+        wake.set()
+
+    def on_reload(_signum, _frame):
+        reload.set()
+        wake.set()
+
+    def on_profile(_signum, _frame):
+        profile.set()
+        wake.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, on_stop)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, on_reload)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, on_profile)
+
+    while not stop.is_set():
+        wake.wait(1.0)
+        wake.clear()
+        if reload.is_set() and not stop.is_set():
+            reload.clear()
+            try:
+                reload_handlers(updater.dispatcher, module_name)
+            except Exception:
+                get_logger().exception('Handler reload failed, '
+                                       'old handlers are kept.')
+        if profile.is_set() and not stop.is_set():
+            profile.clear()
+            if not get_profiler().start(on_done=write_profile):
+                get_logger().warning('Profiling is already running.')
+    shutdown(updater, make_snapshot, filename, timeout)
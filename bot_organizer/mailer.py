@@ -0,0 +1,237 @@
+"""
+Email delivery channel with pooled SMTP connections.
+
+Messages are put into a bounded queue and sent by a small fixed pool
+of worker threads. Every worker keeps its SMTP connection open and sends
+up to BATCH_SIZE queued messages per wakeup over it, so a burst of
+reminders at 09:00 costs a few SMTP sessions, not one per message.
+Idle connections are closed after IDLE_TIMEOUT seconds.
+"""
+
+import json
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from bot_organizer.metrics import get_metrics
+
+WORKERS = 2           # SMTP connections open at most
+BATCH_SIZE = 50       # messages sent in one go by a worker
+QUEUE_SIZE = 10000    # messages waiting to be sent at most
+IDLE_TIMEOUT = 30.0   # seconds after which an unused connection is closed
+SMTP_TIMEOUT = 10.0   # socket timeout of SMTP connections
+WAIT = 0.5            # seconds a worker waits for the queue before checking state
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def build_message(sender, to, subject, body):
+    """
+    :return: EmailMessage ready to be sent.
+    """
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    return message
+
+
+class Mailer:
+    """
+    Pool of SMTP workers sending queued messages.
+
+    :param host: SMTP server host.
+    :param port: SMTP server port.
+    :param sender: From address of all messages.
+    :param username: login for SMTP AUTH, None to skip login.
+    :param password: password for SMTP AUTH.
+    :param starttls: True to upgrade connections with STARTTLS.
+    :param workers: number of worker threads and connections.
+    :param batch_size: messages sent by a worker in one go.
+    :param queue_size: max messages waiting in the queue.
+    :param smtp_class: class used to connect, smtplib.SMTP by default.
+    """
+
+    def __init__(self, host, port, sender, username=None, password=None,
+                 starttls=False, workers=WORKERS, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE, smtp_class=smtplib.SMTP):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.smtp_class = smtp_class
+        self._queue = queue.Queue(queue_size)
+        self._running = True
+        self._threads = [threading.Thread(target=self._worker,
+                                          name=f'mailer_{number}',
+                                          daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, to, subject, body):
+        """
+        Queue a message, never blocks.
+
+        :param to: recipient address.
+        :param subject: subject of the message.
+        :param body: plain text body.
+
+        :return: True if queued, False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait(build_message(self.sender, to, subject,
+                                                 body))
+        except queue.Full:
+            get_metrics().inc('mailer.dropped')
+            return False
+        get_metrics().inc('mailer.queued')
+        return True
+
+    def _connect(self):
+        smtp = self.smtp_class(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        get_metrics().inc('mailer.connections')
+        return smtp
+
+    def _next_batch(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send_batch(self, smtp, batch):
+        for message in batch:
+            try:
+                for attempt in range(2):
+                    if smtp is None:
+                        smtp = self._connect()
+                    try:
+                        smtp.send_message(message)
+                        break
+                    except smtplib.SMTPServerDisconnected:
+                        # server closed the idle connection, retry once
+                        smtp = None
+                        if attempt:
+                            raise
+                get_metrics().inc('mailer.sent')
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    smtplib.SMTPDataError):
+                # the message was refused, the connection is still fine
+                get_logger().exception(f'Mail to {message["To"]} was refused')
+                get_metrics().inc('mailer.failed')
+            except (smtplib.SMTPException, OSError):
+                get_logger().exception(f'Could not send mail to '
+                                       f'{message["To"]}')
+                get_metrics().inc('mailer.failed')
+                if smtp is not None:
+                    smtp.close()
+                    smtp = None
+            finally:
+                self._queue.task_done()
+        return smtp
+
+    def _worker(self):
+        smtp = None
+        last_used = time.monotonic()
+        while self._running or not self._queue.empty():
+            # short waits, so stop() does not wait for IDLE_TIMEOUT
+            batch = self._next_batch(WAIT)
+            if not batch:
+                if (smtp is not None
+                        and time.monotonic() - last_used > IDLE_TIMEOUT):
+                    self._close(smtp)
+                    smtp = None
+                continue
+            get_metrics().inc('mailer.batches')
+            smtp = self._send_batch(smtp, batch)
+            last_used = time.monotonic()
+        if smtp is not None:
+            self._close(smtp)
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def drain(self, deadline):
+        """
+        Wait until all queued messages were handed to the SMTP server.
+
+        :param deadline: time.monotonic value to give up at.
+
+        :return: True if the queue was emptied in time.
+        """
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(left)
+        return True
+
+    def stop(self):
+        """
+        Stop the workers after the queue is empty and close connections.
+        """
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+
+
+_mailer = None
+
+
+def get_mailer():
+    """
+    Function to get the configured mailer, None if email is disabled.
+    """
+    return _mailer
+
+
+def configure_mailer(**settings):
+    """
+    Start the shared mailer, see Mailer for the settings.
+
+    :return: the new mailer.
+    """
+    global _mailer
+    _mailer = Mailer(**settings)
+    return _mailer
+
+
+def read_smtp_settings(filename):
+    """
+    Function to read Mailer settings from a JSON file, e.g.
+    ``{"host": "localhost", "port": 25, "sender": "bot@example.com"}``.
+
+    :return: dict of settings or None if the file does not exist.
+    """
+    try:
+        with open(filename, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
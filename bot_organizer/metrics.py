@@ -0,0 +1,105 @@
+"""
+Very small in-process metrics registry.
+
+Counters, gauges and summaries are plain integers/floats kept in one dict
+under a lock, so updating them from handlers, jobs and worker threads
+stays cheap.
+Other modules report through the shared ``registry`` instance,
+which is what /stats and the tests read from.
+"""
+
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Thread safe registry of named counters, gauges and simple summaries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(int)
+
+    def inc(self, name, value=1):
+        """
+        Increase counter or gauge `name` by `value`.
+
+        :param name: name of the metric.
+        :param value: amount to add.
+        """
+        with self._lock:
+            self._values[name] += value
+
+    def dec(self, name, value=1):
+        """
+        Decrease gauge `name` by `value`.
+
+        :param name: name of the metric.
+        :param value: amount to subtract.
+        """
+        with self._lock:
+            self._values[name] -= value
+
+    def set(self, name, value):
+        """
+        Set gauge `name` to `value`.
+
+        :param name: name of the metric.
+        :param value: new value of the gauge.
+        """
+        with self._lock:
+            self._values[name] = value
+
+    def observe(self, name, value):
+        """
+        Add `value` to summary `name`, kept as name.count, name.sum
+        and name.max metrics.
+
+        :param name: name of the summary.
+        :param value: observed value, e.g. lateness in seconds.
+        """
+        with self._lock:
+            self._values[f'{name}.count'] += 1
+            self._values[f'{name}.sum'] += value
+            key = f'{name}.max'
+            if key not in self._values or value > self._values[key]:
+                self._values[key] = value
+
+    def get(self, name, default=0):
+        """
+        :param name: name of the metric.
+        :param default: value returned if metric was never touched.
+
+        :return: current value of the metric.
+        """
+        with self._lock:
+            return self._values.get(name, default)
+
+    def snapshot(self, prefix=''):
+        """
+        :param prefix: if given only metrics starting with it are returned.
+
+        :return: copy of all metrics as a plain dict.
+        """
+        with self._lock:
+            return {name: value for name, value in self._values.items()
+                    if name.startswith(prefix)}
+
+    def reset(self):
+        """
+        Forget all values. Used mostly by tests.
+        """
+        with self._lock:
+            self._values.clear()
+
+
+registry = Metrics()
+
+
+def get_metrics():
+    """
+    Function to get the shared metrics registry.
+    Same as get_logger it makes patching in tests easier.
+    """
+    return registry
@@ -0,0 +1,205 @@
+"""
+Persistent polling offset and suppression of duplicate updates.
+
+The update_id of every update taken by the dispatcher is written over
+the same 8 bytes of OFFSET_FILENAME with one pwrite, which survives a
+crash of the process; fsync, which is what makes it survive a crash
+of the machine, is batched every FSYNC_EVERY updates or FSYNC_INTERVAL
+seconds. On start the updater polls from the saved offset, so Telegram
+does not resend handled updates at all.
+
+Updates which still come twice (a replay around a restart or a retried
+getUpdates) are dropped by UpdateGate before any handler runs: a ring
+buffer of the last WINDOW update_ids with a set for O(1) lookups, plus
+everything at or below the offset loaded on start.
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+
+from bot_organizer.metrics import get_metrics
+
+OFFSET_FILENAME = 'offset.bin'
+WINDOW = 1024         # recent update_ids remembered by the dedup window
+FSYNC_EVERY = 100     # updates between two fsyncs of the offset file
+FSYNC_INTERVAL = 1.0  # seconds between two fsyncs of the offset file
+
+OFFSET = struct.Struct('<q')
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class UpdateWindow:
+    """
+    Bounded set of recently seen update_ids.
+
+    :param size: number of update_ids remembered.
+    :param floor: update_ids at or below it count as seen, e.g. the
+                  offset saved before a restart.
+    """
+
+    def __init__(self, size=WINDOW, floor=None):
+        self._ring = [None] * size
+        self._position = 0
+        self._seen = set()
+        self.floor = floor
+
+    def seen(self, update_id):
+        """
+        Check `update_id` and remember it.
+
+        :return: True if the update_id was already seen.
+        """
+        if self.floor is not None and update_id <= self.floor:
+            return True
+        if update_id in self._seen:
+            return True
+        oldest = self._ring[self._position]
+        if oldest is not None:
+            self._seen.discard(oldest)
+        self._ring[self._position] = update_id
+        self._position = (self._position + 1) % len(self._ring)
+        self._seen.add(update_id)
+        return False
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class OffsetStore:
+    """
+    Last handled update_id kept in a small file.
+
+    :param filename: path of the offset file.
+    :param fsync_every: updates between two fsyncs.
+    :param fsync_interval: seconds between two fsyncs.
+    """
+
+    def __init__(self, filename=OFFSET_FILENAME, fsync_every=FSYNC_EVERY,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.filename = filename
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._fd = None
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def load(self):
+        """
+        :return: saved update_id or None if there is none.
+        """
+        try:
+            with open(self.filename, 'rb') as file:
+                data = file.read(OFFSET.size)
+        except FileNotFoundError:
+            return None
+        if len(data) < OFFSET.size:
+            return None
+        return OFFSET.unpack(data)[0]
+
+    def mark(self, update_id):
+        """
+        Save `update_id` as the last handled one.
+        """
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+            os.pwrite(self._fd, OFFSET.pack(update_id), 0)
+            self._unsynced += 1
+            if (self._unsynced >= self.fsync_every
+                    or time.monotonic() - self._synced_at >= self.fsync_interval):
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._fd)
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        get_metrics().inc('offsets.fsyncs')
+
+    def drain(self, _deadline):
+        """
+        Fsync the last offset, used on shutdown.
+
+        :return: always True, fsync of 8 bytes does not need a deadline.
+        """
+        with self._lock:
+            if self._fd is not None and self._unsynced:
+                self._sync()
+        return True
+
+    def close(self):
+        """
+        Fsync and close the offset file.
+        """
+        self.drain(None)
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class UpdateGate:
+    """
+    Wrapper of Dispatcher.process_update dropping duplicate updates
+    and saving the offset of the others.
+
+    :param process_update: the wrapped dispatcher.process_update.
+    :param window: UpdateWindow of seen update_ids.
+    :param store: OffsetStore or None to keep nothing on disk.
+    """
+
+    def __init__(self, process_update, window, store=None):
+        self.process_update = process_update
+        self.window = window
+        self.store = store
+        self._lock = threading.Lock()
+
+    def __call__(self, update):
+        update_id = getattr(update, 'update_id', None)
+        # errors of polling and other non Update objects pass through
+        if update_id is not None:
+            with self._lock:
+                duplicate = self.window.seen(update_id)
+            if duplicate:
+                get_metrics().inc('updates.duplicates')
+                get_logger().info(f'Dropped duplicate update {update_id}')
+                return
+            # marked before handling, a crash in a handler must not
+            # make the same update run again after restart
+            if self.store is not None:
+                try:
+                    self.store.mark(update_id)
+                except OSError:
+                    get_logger().exception('Could not save update offset')
+        self.process_update(update)
+
+
+def install(updater, store, window_size=WINDOW):
+    """
+    Continue polling from the saved offset and put an UpdateGate
+    in front of the dispatcher.
+
+    :param updater: updater which was not started yet.
+    :param store: OffsetStore with the saved offset.
+    :param window_size: number of update_ids in the dedup window.
+
+    :return: the UpdateGate.
+    """
+    last = store.load()
+    if last is not None:
+        updater.last_update_id = last + 1
+        get_logger().info(f'Polling from saved offset {last + 1}.')
+    dispatcher = updater.dispatcher
+    gate = UpdateGate(dispatcher.process_update,
+                      UpdateWindow(window_size, floor=last), store)
+    dispatcher.process_update = gate
+    return gate
@@ -0,0 +1,263 @@
+"""
+Natural language times of events and timers.
+
+Besides the exact "%Y-%m-%d %H:%M:%S" dates and raw seconds, users can
+type phrases like:
+
+    in 15m          in 1 hour 30 minutes      90s
+    tomorrow 9:00   next monday 14:30         friday at 6pm
+    at 18:00        2030-01-01 12:00          today
+
+The grammar is one regular expression compiled at import time. A phrase
+is first compiled to a spec which does not depend on the current time,
+e.g. ('weekday', 0, 52200) for "next monday 14:30", and the specs of
+frequent phrases are kept in an LRU cache. Resolving a spec against the
+current time and the zone of the chat is a few integer operations, so
+a message costs microseconds, see main() for a benchmark:
+
+    python -m bot_organizer.phrases
+
+Weekdays mean the first such day after today, with or without "next".
+A day without a time means DEFAULT_TIME, a time without a day means the
+next time the clock shows it.
+
+Amounts written apart from their unit ("in 1 hour") need the "in", so
+"/new_timer 10 d" stays a 10 seconds timer named "d". A timer due like
+"00:10" is neither seconds nor HH:MM:SS and is rejected, "at 00:10"
+means the time of day.
+"""
+
+import argparse
+import calendar
+import functools
+import re
+import sys
+import time
+
+PHRASE_CACHE = 1024          # compiled phrases kept by the LRU cache
+DAY = 24 * 3600
+DEFAULT_TIME = 9 * 3600      # time of day of a phrase without a time
+UNITS = {'s': 1, 'sec': 1, 'secs': 1, 'second': 1, 'seconds': 1,
+         'm': 60, 'min': 60, 'mins': 60, 'minute': 60, 'minutes': 60,
+         'h': 3600, 'hr': 3600, 'hrs': 3600, 'hour': 3600, 'hours': 3600,
+         'd': DAY, 'day': DAY, 'days': DAY,
+         'w': 7 * DAY, 'week': 7 * DAY, 'weeks': 7 * DAY}
+WEEKDAYS = {'monday': 0, 'mon': 0, 'tuesday': 1, 'tue': 1, 'tues': 1,
+            'wednesday': 2, 'wed': 2, 'thursday': 3, 'thu': 3, 'thurs': 3,
+            'friday': 4, 'fri': 4, 'saturday': 5, 'sat': 5,
+            'sunday': 6, 'sun': 6}
+DAY_OFFSETS = {'today': 0, 'tomorrow': 1}
+
+
+def alternatives(words):
+    """
+    :return: regex alternation of `words`, longest first.
+    """
+    return '|'.join(sorted(words, key=len, reverse=True))
+
+
+AMOUNT = rf'(\d+)\s*({alternatives(UNITS)})\b'
+ATTACHED_AMOUNT = rf'\d+(?:{alternatives(UNITS)})\b'
+TIME = r'\d{1,2}:\d{2}(?::\d{2})?(?:\s*[ap]m)?|\d{1,2}\s*[ap]m'
+GRAMMAR = re.compile(rf'''
+    in\s+(?P<span>(?:{AMOUNT}\s*)+)
+  | (?P<attached>(?:{ATTACHED_AMOUNT}\s*)+)
+  | (?:(?P<offset>{alternatives(DAY_OFFSETS)})
+     | (?:next\s+)?(?P<weekday>{alternatives(WEEKDAYS)})
+     | (?P<date>\d{{4}}-\d{{1,2}}-\d{{1,2}}))
+    (?:\s+(?:at\s+)?(?P<day_time>{TIME}))?
+  | (?:at\s+)?(?P<time>{TIME})
+''', re.VERBOSE)
+AMOUNTS = re.compile(AMOUNT)
+# any single word of a phrase, the words of the arguments which match it
+# are the most words a phrase at their start can have
+PHRASE_WORD = re.compile(rf'''
+    in|at|next|[ap]m
+  | {alternatives(DAY_OFFSETS)}|{alternatives(WEEKDAYS)}|{alternatives(UNITS)}
+  | -?\d+(?:{alternatives(UNITS)}|[ap]m|(?::\d+)+(?:\s*[ap]m)?)?
+  | \d{{4}}-\d{{1,2}}-\d{{1,2}}
+''', re.VERBOSE | re.IGNORECASE)
+CLOCK = re.compile(r'(\d{1,2})(?::(\d{2})(?::(\d{2}))?)?\s*([ap]m)?')
+
+
+def time_of_day(text):
+    """
+    :return: seconds since midnight of a time like '14:30' or '6pm'.
+    :raises ValueError: if it is not a valid time.
+    """
+    hour, minute, second, half = CLOCK.fullmatch(text).groups()
+    hour, minute, second = int(hour), int(minute or 0), int(second or 0)
+    if half is not None:
+        if not 1 <= hour <= 12:
+            raise ValueError(f'bad hour in {text!r}')
+        hour = hour % 12 + (12 if half == 'pm' else 0)
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f'bad time {text!r}')
+    return hour * 3600 + minute * 60 + second
+
+
+def day_number(text):
+    """
+    :return: days since 1970-01-01 of a date like '2030-01-31'.
+    :raises ValueError: if it is not a valid date.
+    """
+    year, month, day = (int(part) for part in text.split('-'))
+    if not 1 <= month <= 12 or not 1 <= day <= calendar.monthrange(
+            year, month)[1]:
+        raise ValueError(f'bad date {text!r}')
+    return calendar.timegm((year, month, day, 0, 0, 0)) // DAY
+
+
+@functools.lru_cache(maxsize=PHRASE_CACHE)
+def compile_phrase(text):
+    """
+    :return: spec of a phrase, independent of the current time:
+             ('in', seconds), ('offset', days, time of day),
+             ('weekday', weekday, time of day), ('date', day number,
+             time of day) or ('time', None, time of day);
+             None if `text` is not a phrase.
+    """
+    phrase = ' '.join(text.lower().split())
+    match = GRAMMAR.fullmatch(phrase)
+    if match is None:
+        return None
+    try:
+        span = match['span'] or match['attached']
+        if span is not None:
+            return 'in', sum(int(amount) * UNITS[unit]
+                             for amount, unit in AMOUNTS.findall(span))
+        if match['time'] is not None:
+            return 'time', None, time_of_day(match['time'])
+        clock = (DEFAULT_TIME if match['day_time'] is None
+                 else time_of_day(match['day_time']))
+        if match['offset'] is not None:
+            return 'offset', DAY_OFFSETS[match['offset']], clock
+        if match['weekday'] is not None:
+            return 'weekday', WEEKDAYS[match['weekday']], clock
+        return 'date', day_number(match['date']), clock
+    except ValueError:
+        return None
+
+
+def resolve(spec, now, zone):
+    """
+    :param spec: spec returned by compile_phrase.
+    :param now: current epoch seconds.
+    :param zone: ZoneTable days and times of the phrase are in.
+
+    :return: epoch seconds the phrase means.
+    """
+    kind, value, clock = spec[0], spec[1], spec[-1]
+    if kind == 'in':
+        return int(now) + value
+    local = zone.to_local(int(now))
+    today = local // DAY
+    if kind == 'offset':
+        day = today + value
+    elif kind == 'weekday':
+        # 1970-01-01 was a thursday, weekday 3
+        day = today + (value - (today + 3) % 7 - 1) % 7 + 1
+    elif kind == 'date':
+        day = value
+    else:
+        day = today if today * DAY + clock > local else today + 1
+    return zone.to_epoch(day * DAY + clock)
+
+
+def parse_when(text, now, zone):
+    """
+    :param text: phrase typed by the user.
+    :param now: current epoch seconds.
+    :param zone: ZoneTable of the chat.
+
+    :return: epoch seconds the phrase means.
+    :raises ValueError: if `text` is not a phrase.
+    """
+    spec = compile_phrase(text)
+    if spec is None:
+        raise ValueError(f'can not read time {text!r}')
+    return resolve(spec, now, zone)
+
+
+def parse_duration(text, now, zone):
+    """
+    Read the due of a timer: seconds, HH:MM:SS or any phrase.
+
+    :return: seconds from `now` until the timer is due.
+    :raises ValueError: if `text` is none of them.
+    """
+    text = text.strip()
+    if text.lstrip('-').isdigit():
+        return int(text)
+    parts = text.split(':')
+    if all(part.isdigit() for part in parts):
+        if len(parts) != 3:
+            # e.g. '00:10', ten minutes or ten seconds, a mistyped HH:MM:SS
+            raise ValueError(f'timer due must be HH:MM:SS, not {text!r}')
+        return int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
+    return parse_when(text, now, zone) - int(now)
+
+
+def phrase_length(args):
+    """
+    :return: number of words at the start of `args` which can be words
+             of a phrase, no longer phrase can start `args`.
+    """
+    length = 0
+    for word in args:
+        if PHRASE_WORD.fullmatch(word) is None:
+            break
+        length += 1
+    return length
+
+
+def split_phrase(args, parse, longest=None):
+    """
+    Find the longest phrase at the start of command arguments.
+
+    :param args: list of words.
+    :param parse: function reading a phrase, raising ValueError.
+    :param longest: most words a phrase can have, phrase_length by default.
+
+    :return: (result of parse, remaining words).
+    :raises ValueError: if no prefix of `args` is a phrase.
+    """
+    if longest is None:
+        longest = phrase_length(args)
+    for length in range(min(longest, len(args)), 0, -1):
+        try:
+            return parse(' '.join(args[:length])), args[length:]
+        except ValueError:
+            continue
+    raise ValueError(f'can not read time {" ".join(args[:longest or 1])!r}')
+
+
+def main(argv=None):
+    """
+    Print the cost of parsing typical phrases, with and without the cache.
+    """
+    # imported here, the benchmark is the only user of the zone of the server
+    from bot_organizer.timezones import get_zone
+
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.phrases',
+        description='Benchmark the time phrase parser.')
+    parser.add_argument('--rounds', type=int, default=100000)
+    args = parser.parse_args(argv)
+    zone = get_zone()
+    now = int(time.time())
+    phrases = ['in 15m', 'tomorrow 9:00', 'next monday 14:30', '90s',
+               'friday at 6pm', '2030-01-01 12:00:00', 'in 1 hour 30 minutes']
+    for name, clear in (('cached', False), ('uncached', True)):
+        started = time.perf_counter()
+        for number in range(args.rounds):
+            if clear:
+                compile_phrase.cache_clear()
+            parse_when(phrases[number % len(phrases)], now, zone)
+        elapsed = time.perf_counter() - started
+        print(f'{name}: {1e6 * elapsed / args.rounds:.2f} us per phrase')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
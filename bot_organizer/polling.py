@@ -0,0 +1,224 @@
+"""
+Adaptive long polling of getUpdates.
+
+AdaptivePoller replaces the fixed settings of Updater.start_polling:
+
+* a full batch means updates are queued on Telegram's side, so the limit
+  is doubled (up to 100, the API maximum) and the next call does not wait,
+* a partial batch sizes the limit to about TARGET_BATCH seconds
+  of the observed intake rate,
+* an empty batch halves the limit and doubles the long poll timeout,
+  so a quiet bot makes one request per MAX_TIMEOUT seconds.
+
+Batches are handed to the dispatcher queue and the next getUpdates is sent
+right away, so fetching overlaps with dispatching. Fetching pauses while
+more than MAX_BACKLOG updates wait in the queue.
+Intake rate, backlog and current settings are reported as polling.*
+metrics.
+"""
+
+import logging
+import math
+import threading
+
+from telegram.error import (TelegramError, TimedOut, RetryAfter, Unauthorized,
+                            InvalidToken)
+
+from bot_organizer.clock import get_clock
+from bot_organizer.metrics import get_metrics
+
+MIN_LIMIT = 10
+MAX_LIMIT = 100       # getUpdates returns at most 100 updates
+MIN_TIMEOUT = 1       # long poll seconds while updates keep coming
+MAX_TIMEOUT = 20      # long poll seconds of a quiet bot
+TARGET_BATCH = 1.0    # seconds of intake a batch is sized for
+MAX_BACKLOG = 1000    # updates waiting for the dispatcher before fetching pauses
+BACKLOG_WAIT = 0.05   # seconds between two backlog checks
+READ_LATENCY = 2.0    # grace seconds for the reply on top of the timeout
+MAX_BACKOFF = 30.0    # seconds between retries after errors at most
+RATE_SMOOTHING = 0.3  # weight of the newest batch in the intake rate
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class AdaptivePoller:
+    """
+    getUpdates loop tuning its limit and timeout to the intake rate.
+
+    :param bot: bot with get_updates.
+    :param update_queue: queue the dispatcher takes updates from.
+    :param offset: update_id to poll from.
+    :param min_limit: smallest batch asked for.
+    :param max_limit: largest batch asked for.
+    :param min_timeout: long poll timeout while updates keep coming.
+    :param max_timeout: longest long poll timeout.
+    :param max_backlog: queued updates at which fetching pauses.
+    :param allowed_updates: passed to get_updates.
+    """
+
+    def __init__(self, bot, update_queue, offset=0, min_limit=MIN_LIMIT,
+                 max_limit=MAX_LIMIT, min_timeout=MIN_TIMEOUT,
+                 max_timeout=MAX_TIMEOUT, max_backlog=MAX_BACKLOG,
+                 allowed_updates=None):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.offset = offset
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_backlog = max_backlog
+        self.allowed_updates = allowed_updates
+        self.limit = min_limit
+        self.timeout = min_timeout
+        self.rate = 0.0
+        self._last_batch = None
+        self._backoff = 0.0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """
+        Make run() return after the getUpdates in flight.
+        """
+        self._stopped.set()
+
+    def backlog(self):
+        """
+        :return: number of updates waiting for the dispatcher.
+        """
+        return self.update_queue.qsize()
+
+    def adapt(self, count):
+        """
+        Tune limit and timeout after a batch of `count` updates.
+        """
+        now = get_clock().monotonic()
+        if self._last_batch is not None and now > self._last_batch:
+            rate = count / (now - self._last_batch)
+            self.rate += RATE_SMOOTHING * (rate - self.rate)
+        self._last_batch = now
+        if count >= self.limit:
+            # Telegram holds more updates, take them without waiting
+            self.limit = min(self.limit * 2, self.max_limit)
+            self.timeout = 0
+        elif count:
+            self.limit = min(max(math.ceil(self.rate * TARGET_BATCH),
+                                 self.min_limit), self.max_limit)
+            self.timeout = self.min_timeout
+        else:
+            self.limit = max(self.limit // 2, self.min_limit)
+            self.timeout = min(max(self.timeout * 2, self.min_timeout),
+                               self.max_timeout)
+        metrics = get_metrics()
+        metrics.set('polling.limit', self.limit)
+        metrics.set('polling.timeout', self.timeout)
+        metrics.set('polling.rate', round(self.rate, 3))
+
+    def poll_once(self, is_running=lambda: True):
+        """
+        Send one getUpdates and queue what it returned. A batch coming
+        after a stop is dropped and the offset stays, like in
+        Updater._start_polling, so Telegram sends it again after a restart.
+
+        :param is_running: function telling whether updates are still
+                           handled.
+
+        :return: number of queued updates.
+        """
+        metrics = get_metrics()
+        updates = self.bot.get_updates(self.offset, limit=self.limit,
+                                       timeout=self.timeout,
+                                       read_latency=READ_LATENCY,
+                                       allowed_updates=self.allowed_updates)
+        metrics.inc('polling.requests')
+        if updates and (not is_running() or self._stopped.is_set()):
+            get_logger().info(f'Stopped, {len(updates)} updates are left '
+                              f'at Telegram.')
+            return 0
+        for update in updates:
+            self.update_queue.put(update)
+        if updates:
+            self.offset = updates[-1].update_id + 1
+            metrics.inc('polling.updates', len(updates))
+        else:
+            metrics.inc('polling.empty')
+        self.adapt(len(updates))
+        metrics.set('polling.backlog', self.backlog())
+        return len(updates)
+
+    def _wait(self, seconds):
+        return get_clock().wait(self._stopped, seconds)
+
+    def run(self, is_running=lambda: True):
+        """
+        Poll until stop() is called or `is_running()` returns False.
+
+        :param is_running: function telling whether to go on.
+        """
+        metrics = get_metrics()
+        while is_running() and not self._stopped.is_set():
+            if self.backlog() > self.max_backlog:
+                # the dispatcher is behind, let updates wait at Telegram
+                metrics.set('polling.backlog', self.backlog())
+                self._wait(BACKLOG_WAIT)
+                continue
+            try:
+                self.poll_once(is_running)
+                self._backoff = 0.0
+            except TimedOut:
+                # long poll ended without a reply in time, just poll again
+                continue
+            except RetryAfter as error:
+                metrics.inc('polling.errors')
+                self._wait(error.retry_after)
+            except (Unauthorized, InvalidToken) as error:
+                metrics.inc('polling.errors')
+                get_logger().error(f'Polling stopped: {error}')
+                self.update_queue.put(error)
+                return
+            except TelegramError as error:
+                metrics.inc('polling.errors')
+                # the dispatcher error handler logs it, like Updater does
+                self.update_queue.put(error)
+                self._backoff = min(max(self._backoff * 2, 1.0), MAX_BACKOFF)
+                self._wait(self._backoff)
+
+
+def install(updater, **settings):
+    """
+    Make updater.start_polling run an AdaptivePoller instead of
+    its fixed interval loop. The dispatcher and job queue threads
+    are still started and stopped by the updater.
+
+    :param updater: updater which was not started yet.
+    :param settings: AdaptivePoller settings.
+
+    :return: the AdaptivePoller.
+    """
+    poller = AdaptivePoller(updater.bot, updater.update_queue, **settings)
+
+    def start_polling(*_fixed_settings):
+        # thread target of the 'updater' thread started by start_polling
+        poller.offset = updater.last_update_id
+        try:
+            updater.bot.delete_webhook()
+        except TelegramError:
+            get_logger().exception('Could not delete webhook')
+        poller.run(lambda: updater.running)
+        updater.last_update_id = poller.offset
+
+    stop = updater.stop
+
+    def stop_polling_first():
+        # end waits of the poller, so joining its thread is quick
+        poller.stop()
+        stop()
+
+    updater._start_polling = start_polling
+    updater.stop = stop_polling_first
+    return poller
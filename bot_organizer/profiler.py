@@ -0,0 +1,223 @@
+"""
+On-demand sampling profiler of handlers and job callbacks.
+
+While a profile window is open, a thread takes the stacks of all threads
+from sys._current_frames() every INTERVAL seconds. A sample is attributed
+to the handler callback or job callback (e.g. alarm) found on the stack,
+the frames above it are dropped, and the rest is counted as one collapsed
+stack line, ready for flamegraph.pl or speedscope:
+
+    event_date;bot_organizer.py:event_date;_strptime.py:_strptime 12
+
+Callbacks are recognised by file and function name of their code, taken
+from the handlers of the dispatcher when the window opens, so nothing is
+wrapped and handlers pay nothing while the profiler is off.
+
+A window is opened by the admin command /profile or by SIGUSR1.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_DIRNAME = 'profiles'
+PROFILE_SECONDS = 30      # length of a window opened without a length
+MAX_PROFILE_SECONDS = 300  # longest window
+INTERVAL = 0.01           # seconds between two samples
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def code_key(function):
+    """
+    :return: (file name, function name) of the code of `function`,
+             it stays the same when the module is reloaded.
+    """
+    code = getattr(function, '__code__', None)
+    if code is None:
+        return None
+    return code.co_filename, code.co_name
+
+
+def handler_callbacks(handlers):
+    """
+    :param handlers: dict {group: list of handlers} of a dispatcher.
+
+    :return: list of callbacks of the handlers, including the ones
+             inside conversation handlers.
+    """
+    callbacks = []
+    waiting = [handler for group in handlers.values() for handler in group]
+    while waiting:
+        handler = waiting.pop()
+        if getattr(handler, 'states', None) is not None:
+            waiting.extend(handler.entry_points)
+            waiting.extend(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                waiting.extend(state_handlers)
+        elif getattr(handler, 'callback', None) is not None:
+            callbacks.append(handler.callback)
+    return callbacks
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+class SamplingProfiler:
+    """
+    Stack sampler running only inside profile windows.
+
+    :param interval: seconds between two samples.
+    :param current_frames: function returning {thread id: frame}.
+    """
+
+    def __init__(self, interval=INTERVAL, current_frames=sys._current_frames):
+        self.interval = interval
+        self.current_frames = current_frames
+        self.dispatcher = None
+        self.job_callbacks = []
+        self.samples = collections.Counter()
+        self.unattributed = 0
+        self._callbacks = dict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def attach(self, dispatcher=None, job_callbacks=()):
+        """
+        :param dispatcher: dispatcher whose handlers are profiled.
+        :param job_callbacks: job callbacks to profile, e.g. alarm.
+        """
+        if dispatcher is not None:
+            self.dispatcher = dispatcher
+        self.job_callbacks = list(job_callbacks)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def callbacks(self):
+        """
+        :return: dict {(file name, function name): callback name}
+                 of everything samples are attributed to.
+        """
+        functions = list(self.job_callbacks)
+        if self.dispatcher is not None:
+            functions += handler_callbacks(self.dispatcher.handlers)
+        keys = ((code_key(function), function) for function in functions)
+        return {key: function.__name__ for key, function in keys
+                if key is not None}
+
+    def sample(self):
+        """
+        Take one sample of every thread but the sampling one.
+        """
+        own = threading.get_ident()
+        for thread_id, frame in self.current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame)
+                frame = frame.f_back
+            # outermost frame first, the outermost callback wins
+            stack.reverse()
+            for index, frame in enumerate(stack):
+                code = frame.f_code
+                section = self._callbacks.get((code.co_filename, code.co_name))
+                if section is not None:
+                    self.samples[';'.join(
+                        [section] + [frame_name(frame)
+                                     for frame in stack[index:]])] += 1
+                    break
+            else:
+                self.unattributed += 1
+
+    def start(self, seconds=PROFILE_SECONDS, on_done=None):
+        """
+        Open a profile window, samples of an earlier window are dropped.
+
+        :param seconds: length of the window, MAX_PROFILE_SECONDS at most.
+        :param on_done: function called with the collapsed stack text
+                        when the window is closed.
+
+        :return: False if a window is already open.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.samples = collections.Counter()
+            self.unattributed = 0
+            self._callbacks = self.callbacks()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(min(seconds, MAX_PROFILE_SECONDS), on_done),
+                name='profiler', daemon=True)
+            self._thread.start()
+        get_logger().info(f'Profiling for {seconds} seconds.')
+        return True
+
+    def stop(self):
+        """
+        Close the open window now.
+        """
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, seconds, on_done):
+        deadline = time.monotonic() + seconds
+        while (not self._stopped.wait(self.interval)
+               and time.monotonic() < deadline):
+            self.sample()
+        if on_done is not None:
+            try:
+                on_done(self.collapsed())
+            except Exception:
+                get_logger().exception('Could not hand the profile over')
+
+    def collapsed(self):
+        """
+        :return: collapsed stack text, one 'stack count' line per stack,
+                 most sampled first.
+        """
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.samples.most_common())
+
+
+def write_profile(text, directory=PROFILE_DIRNAME):
+    """
+    Write collapsed stacks to a new file named by the current time.
+
+    :return: path of the file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(
+        directory, f'{datetime.now().strftime("%Y%m%d-%H%M%S")}.folded')
+    with open(filename, 'w') as file:
+        file.write(text)
+    get_logger().info(f'Profile written to {filename}.')
+    return filename
+
+
+profiler = SamplingProfiler()
+
+
+def get_profiler():
+    """
+    Function to get the shared profiler.
+    """
+    return profiler
@@ -0,0 +1,369 @@
+"""
+Recording of incoming updates and their replay against a stub API.
+
+With `--record FILE` the bot appends every update it handles to a gzip
+compressed JSON lines file, one {"t": arrival time, "update": {...}} per
+line. With `--scrub` as well, names, usernames and contact data are
+dropped, user and chat ids are replaced by stable pseudonyms and every
+word of a text which is not a command, number, date or time is replaced
+by x's of the same length, so command entities still match. Pseudonyms
+are numbered from 1 by every run and the real ids are kept nowhere, so
+a scrubbed recording is never appended to: its pseudonyms would belong
+to other users in the new run.
+
+The replayer feeds a recording through a dispatcher with the real
+handlers, a StubBot instead of the Telegram API and a VirtualClock
+following the recorded arrival times, so "date is in the past" checks
+and alarms behave as they did. It can pace the updates at 1x, 10x or
+any speed, or run them as fast as possible, and reports throughput and
+handling latency:
+
+    python -m bot_organizer.replay updates.jsonl.gz --speed max
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import math
+import queue
+import re
+import sys
+import threading
+import time
+
+from telegram import Update
+
+from bot_organizer.clock import VirtualClock, get_clock, set_clock
+
+SCRUBBED_KEYS = {'last_name', 'username', 'phone_number', 'email',
+                 'contact', 'location', 'venue', 'bio', 'description',
+                 'invite_link'}
+# required by the telegram classes, so replaced instead of dropped
+PLACEHOLDERS = {'first_name': 'User', 'title': 'Chat'}
+ID_PARENTS = {'from', 'chat', 'user', 'forward_from', 'forward_from_chat',
+              'sender_chat'}
+TEXT_KEYS = {'text', 'caption'}
+# words kept by scrubbing: commands, numbers, dates and times
+KEPT_WORD = re.compile(r'/\w+(@\w+)?|[\d.:+-]+')
+WORD = re.compile(r'\S+')
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class Scrubber:
+    """
+    Removes personal data from update dicts. The same id always gets
+    the same pseudonym, so chats and users of a recording stay apart.
+    """
+
+    def __init__(self):
+        self._ids = dict()
+
+    def pseudonym(self, value):
+        # group chats have negative ids, keep the sign
+        number = self._ids.setdefault(abs(value), len(self._ids) + 1)
+        return number if value >= 0 else -number
+
+    def scrub_text(self, text):
+        return WORD.sub(lambda match: match.group()
+                        if KEPT_WORD.fullmatch(match.group())
+                        else 'x' * len(match.group()), text)
+
+    def scrub(self, data, parent=None):
+        """
+        :return: copy of the dict `data` without personal data.
+        """
+        if isinstance(data, list):
+            return [self.scrub(item, parent) for item in data]
+        if not isinstance(data, dict):
+            return data
+        scrubbed = dict()
+        for key, value in data.items():
+            if key in SCRUBBED_KEYS:
+                continue
+            if key in PLACEHOLDERS:
+                scrubbed[key] = PLACEHOLDERS[key]
+                continue
+            if key == 'id' and parent in ID_PARENTS:
+                scrubbed[key] = self.pseudonym(value)
+            elif key in TEXT_KEYS and isinstance(value, str):
+                scrubbed[key] = self.scrub_text(value)
+            else:
+                scrubbed[key] = self.scrub(value, key)
+        return scrubbed
+
+
+class Recorder:
+    """
+    Appends updates to a gzip compressed JSON lines file.
+
+    :param filename: path of the recording, appended to if it exists.
+    :param scrub: True to remove personal data, see Scrubber.
+    :raises FileExistsError: if `scrub` is True and `filename` exists.
+    """
+
+    def __init__(self, filename, scrub=False):
+        self.filename = filename
+        self.scrubber = Scrubber() if scrub else None
+        # a scrubbed recording always starts with a new file
+        self._file = gzip.open(filename, 'xt' if scrub else 'at',
+                               encoding='utf-8')
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, update):
+        """
+        Write one update with the current time.
+        """
+        data = update.to_dict()
+        if self.scrubber is not None:
+            data = self.scrubber.scrub(data)
+        line = json.dumps({'t': get_clock().time(), 'update': data},
+                          separators=(',', ':'))
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+            self.count += 1
+
+    def drain(self, _deadline=None):
+        """
+        Flush what was recorded so far.
+
+        :return: True, flushing does not wait for anything.
+        """
+        with self._lock:
+            self._file.flush()
+        return True
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingGate:
+    """
+    Wrapper of Dispatcher.process_update recording every update.
+
+    :param process_update: the wrapped dispatcher.process_update.
+    :param recorder: Recorder of the updates.
+    """
+
+    def __init__(self, process_update, recorder):
+        self.process_update = process_update
+        self.recorder = recorder
+
+    def __call__(self, update):
+        # errors of polling are not updates and are not recorded
+        if isinstance(update, Update):
+            try:
+                self.recorder.record(update)
+            except (OSError, ValueError):
+                get_logger().exception('Could not record update')
+        self.process_update(update)
+
+
+def install(dispatcher, recorder):
+    """
+    Record every update before it is handled. Install it before
+    offsets.install, so duplicates dropped there are not recorded.
+
+    :return: the RecordingGate.
+    """
+    gate = RecordingGate(dispatcher.process_update, recorder)
+    dispatcher.process_update = gate
+    return gate
+
+
+def read_recording(filename):
+    """
+    :return: iterator of (arrival time, update dict) of a recording.
+    """
+    with gzip.open(filename, 'rt', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['t'], entry['update']
+
+
+class StubBot:
+    """
+    Stand-in of telegram.Bot answering every API call at once.
+    Sent messages are only counted.
+    """
+
+    id = 1
+    username = 'replay_bot'
+    first_name = 'Replay'
+    defaults = None
+
+    def __init__(self):
+        self.sent = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, _chat_id, *_args, **_kwargs):
+        with self._lock:
+            self.sent += 1
+            self.calls += 1
+
+    def get_file(self, *_args, **_kwargs):
+        with self._lock:
+            self.calls += 1
+        return StubFile()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        # any other API method
+        def call(*_args, **_kwargs):
+            with self._lock:
+                self.calls += 1
+        return call
+
+
+class StubFile:
+    """
+    Downloaded file of the StubBot, always empty.
+    """
+
+    def download_as_bytearray(self):
+        return bytearray()
+
+
+def percentile(values, fraction):
+    """
+    :return: value at `fraction` of the sorted `values`, 0 if empty.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, math.ceil(fraction * len(values)) - 1)]
+
+
+class Replayer:
+    """
+    Feeds recorded updates through a dispatcher in virtual time.
+
+    :param dispatcher: dispatcher with the handlers to test.
+    :param job_queue: Scheduler of the dispatcher, alarms due before
+                      an update are run before it.
+    :param clock: VirtualClock used by the bot.
+    :param speed: 1 for recorded pace, 10 for ten times faster,
+                  None for as fast as possible.
+    :param sleep: function used to wait for the pace.
+    """
+
+    def __init__(self, dispatcher, job_queue, clock, speed=None,
+                 sleep=time.sleep):
+        self.dispatcher = dispatcher
+        self.job_queue = job_queue
+        self.clock = clock
+        self.speed = speed
+        self.sleep = sleep
+
+    def run(self, entries):
+        """
+        :param entries: iterable of (arrival time, update dict).
+
+        :return: report dict with throughput and latency.
+        """
+        bot = self.dispatcher.bot
+        latencies = []
+        alarms = 0
+        first = None
+        started = time.perf_counter()
+        for arrival, data in entries:
+            if first is None:
+                first = arrival
+                self.clock.set(arrival)
+            if self.speed:
+                wait = (arrival - first) / self.speed \
+                    - (time.perf_counter() - started)
+                if wait > 0:
+                    self.sleep(wait)
+            alarms += self.job_queue.run_until(arrival)
+            update = Update.de_json(data, bot)
+            begin = time.perf_counter()
+            self.dispatcher.process_update(update)
+            latencies.append(time.perf_counter() - begin)
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        latency = {name: round(1000 * percentile(latencies, fraction), 3)
+                   for name, fraction in (('p50', 0.5), ('p95', 0.95),
+                                          ('p99', 0.99), ('max', 1.0))}
+        return {
+            'updates': len(latencies),
+            'seconds': round(elapsed, 3),
+            'updates_per_second': (round(len(latencies) / elapsed, 1)
+                                   if elapsed else 0.0),
+            'latency_ms': latency,
+            'alarms_fired': alarms,
+            'jobs_pending': len(self.job_queue),
+            'messages_sent': getattr(bot, 'sent', 0),
+        }
+
+
+def build_dispatcher(bot, clock):
+    """
+    Dispatcher with the handlers of the bot and our Scheduler,
+    everything outbound goes to `bot`.
+
+    :return: (dispatcher, scheduler).
+    """
+    # imported here, the bot module is only needed for replays
+    from telegram.ext import Dispatcher
+    from bot_organizer import bot_organizer
+    from bot_organizer.scheduler import Scheduler
+
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=0)
+    scheduler = Scheduler(bot=bot, clock=clock)
+    scheduler.set_dispatcher(dispatcher)
+    dispatcher.job_queue = scheduler
+    bot_organizer.add_handlers(dispatcher)
+    return dispatcher, scheduler
+
+
+def parse_speed(text):
+    """
+    :return: speed factor, None for 'max'.
+    """
+    if text == 'max':
+        return None
+    speed = float(text.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('speed must be positive')
+    return speed
+
+
+def main(argv=None):
+    """
+    Replay a recording and print the report as JSON.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m bot_organizer.replay',
+        description='Replay recorded updates against a stub API.')
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=parse_speed, default=None,
+                        help='1, 10, ... times the recorded pace, or max')
+    args = parser.parse_args(argv)
+    clock = VirtualClock(0)
+    previous = set_clock(clock)
+    try:
+        bot = StubBot()
+        dispatcher, scheduler = build_dispatcher(bot, clock)
+        report = Replayer(dispatcher, scheduler, clock, args.speed).run(
+            read_recording(args.recording))
+    finally:
+        set_clock(previous)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
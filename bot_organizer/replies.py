@@ -0,0 +1,81 @@
+"""
+Static replies with pre-serialized request bodies.
+
+/start, /help, unknown commands and usage hints always send the same text
+and keyboard, only the chat differs. StaticReply serializes text and
+reply_markup to JSON once, when it is created, and sends sendMessage with
+that body and the chat id put in front of it, so a reply costs neither
+dict building, nor ReplyMarkup.to_json(), nor json.dumps() of the request.
+
+The fast path needs a telegram.Bot without defaults, anything else
+(e.g. mocks in tests) gets a plain reply_text. It posts through
+Request._request_wrapper and Request._parse, internals of
+python-telegram-bot 12.8 which requirements.txt pins; with a version
+without them replies fall back to reply_text as well.
+"""
+
+import json
+import logging
+
+from telegram import Bot, Message
+from telegram.utils.request import Request
+
+from bot_organizer.metrics import get_metrics
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+class StaticReply:
+    """
+    Reply text and keyboard serialized once.
+
+    :param text: text of the reply.
+    :param reply_markup: ReplyMarkup sent with the reply, or None.
+    """
+    __slots__ = ('text', 'reply_markup', '_tail')
+
+    def __init__(self, text, reply_markup=None):
+        self.text = text
+        self.reply_markup = reply_markup
+        payload = {'text': text}
+        if reply_markup is not None:
+            payload['reply_markup'] = reply_markup.to_dict()
+        # everything after the chat id: ,"text":"...","reply_markup":{...}}
+        self._tail = b',' + json.dumps(payload,
+                                       separators=(',', ':'))[1:].encode('utf-8')
+
+    def body(self, chat_id):
+        """
+        :return: JSON body of sendMessage to `chat_id`.
+        """
+        return b''.join((b'{"chat_id":', str(int(chat_id)).encode('ascii'),
+                         self._tail))
+
+    def send(self, message):
+        """
+        Send the reply to the chat of `message`.
+
+        :param message: message being answered.
+
+        :return: the sent Message, like reply_text.
+        """
+        bot = message.bot
+        if (not isinstance(bot, Bot) or bot.defaults
+                or not hasattr(bot.request, '_request_wrapper')
+                or not hasattr(Request, '_parse')):
+            if self.reply_markup is None:
+                return message.reply_text(self.text)
+            return message.reply_text(self.text, reply_markup=self.reply_markup)
+        # errors are raised as TelegramError, like by reply_text
+        result = bot.request._request_wrapper(
+            'POST', f'{bot.base_url}/sendMessage',
+            body=self.body(message.chat_id), headers=dict(JSON_HEADERS))
+        get_metrics().inc('replies.static')
+        return Message.de_json(Request._parse(result), bot)
@@ -0,0 +1,439 @@
+"""
+Heap based job scheduler driven by the bot clock.
+
+It implements the part of telegram.ext.JobQueue the bot uses
+(run_once, run_repeating, jobs, start, stop and Job.schedule_removal),
+so it can be installed as the job queue of the updater and dispatcher.
+Unlike JobQueue it asks get_clock() for the time, so with a VirtualClock
+jobs can be fired with run_until/advance without waiting for real time.
+Due times are whole epoch seconds, rounded up, and absolute times are
+best given as such with run_at/run_at_many.
+
+A job may have slack, a tolerance of N seconds it can fire late by. It
+then fires at the first multiple of N not before its due time, so jobs
+with the same slack due within the same N seconds share one wakeup of
+the scheduler thread. The jobs of such a bucket run one after another
+inside Scheduler.batch, e.g. DeliveryQueue.batch, which queues their
+messages at once. Slack is 0 (exact) by default and can be set per job,
+or for all jobs as a number or a function of seconds until due.
+"""
+
+import heapq
+import itertools
+import logging
+import math
+import threading
+from datetime import datetime, timedelta
+
+from bot_organizer.clock import get_clock
+from bot_organizer.metrics import get_metrics
+
+MAX_WAIT = 60.0  # seconds the scheduler thread sleeps at most between checks
+
+
+def get_logger():
+    """
+    Function to get logger instance of the module.
+    """
+    return logging.getLogger(__name__)
+
+
+def epoch_seconds(timestamp):
+    """
+    :return: `timestamp` rounded up to whole seconds, so a job never
+             fires before it is due.
+    """
+    return math.ceil(timestamp)
+
+
+def fire_time(due, slack):
+    """
+    :param due: timestamp the job is due at.
+    :param slack: seconds the job may fire late by, 0 for exact.
+
+    :return: timestamp the job fires at, the first multiple of `slack`
+             not before `due`, shared by jobs of the same bucket.
+    """
+    if not slack:
+        return due
+    return math.ceil(due / slack) * slack
+
+
+class Job:
+    """
+    Scheduled callback, called as ``callback(bot, job)`` like JobQueue does.
+
+    :param callback: function to call.
+    :param context: any data for the callback.
+    :param name: name of the job.
+    :param interval: seconds between runs of a repeating job, None for once.
+    :param job_queue: scheduler owning the job.
+    :param slack: seconds the job may fire late by, 0 for exact.
+    """
+    __slots__ = ('callback', 'context', 'name', 'interval', 'due', 'slack',
+                 'removed', 'enabled', 'job_queue')
+
+    def __init__(self, callback, context=None, name=None, interval=None,
+                 job_queue=None, slack=0):
+        self.callback = callback
+        self.context = context
+        self.name = name or getattr(callback, '__name__', repr(callback))
+        self.interval = interval
+        self.due = None
+        self.slack = slack
+        self.removed = False
+        self.enabled = True
+        self.job_queue = job_queue
+
+    @property
+    def repeat(self):
+        """
+        True if the job runs every `interval` seconds.
+        """
+        return self.interval is not None
+
+    @property
+    def next_t(self):
+        """
+        Datetime of the next run, None if job was removed or already ran.
+        """
+        if self.removed or self.due is None:
+            return None
+        return datetime.fromtimestamp(self.due)
+
+    def schedule_removal(self):
+        """
+        Remove the job, it will not run anymore.
+        """
+        self.removed = True
+
+    def __repr__(self):
+        return f'Job({self.name!r}, due={self.due})'
+
+
+class Scheduler:
+    """
+    Drop-in replacement of JobQueue with injectable clock.
+
+    :param bot: bot passed to the callbacks.
+    :param clock: clock to use, the one from get_clock() by default.
+    :param slack: slack of jobs scheduled without one, seconds or
+                  function called with seconds until due.
+    :param batch: function returning a context manager the jobs of one
+                  bucket run in, None to run them one by one.
+    """
+
+    def __init__(self, bot=None, clock=None, slack=0, batch=None):
+        self.bot = bot
+        self.slack = slack
+        self.batch = batch
+        self._clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+    @property
+    def clock(self):
+        return self._clock if self._clock is not None else get_clock()
+
+    def set_dispatcher(self, dispatcher):
+        """
+        Same as JobQueue.set_dispatcher, takes the bot of the dispatcher.
+        """
+        self.bot = dispatcher.bot
+
+    def to_timestamp(self, when, reference=None):
+        """
+        Convert time specification to seconds since the epoch.
+
+        :param when: seconds from now (int/float), timedelta
+                     or datetime (naive means local time).
+        :param reference: timestamp `when` is relative to, now by default.
+
+        :return: int timestamp, see epoch_seconds.
+        """
+        if isinstance(when, datetime):
+            return epoch_seconds(when.timestamp())
+        if reference is None:
+            reference = self.clock.time()
+        if isinstance(when, timedelta):
+            return epoch_seconds(reference + when.total_seconds())
+        return epoch_seconds(reference + when)
+
+    def job_slack(self, due, now, slack=None):
+        """
+        :param due: timestamp the job is due at.
+        :param now: current timestamp.
+        :param slack: slack given for the job, None for the default one.
+
+        :return: slack of the job in seconds.
+        """
+        if slack is None:
+            slack = self.slack
+        if callable(slack):
+            slack = slack(due - now)
+        return slack
+
+    def _put(self, job, due):
+        due = epoch_seconds(due)
+        with self._lock:
+            job.due = due
+            heapq.heappush(self._heap, (fire_time(due, job.slack),
+                                        next(self._counter), job))
+            earliest = self._heap[0][2] is job
+        if earliest:
+            self._wake.set()
+        return job
+
+    def run_once(self, callback, when, context=None, name=None, slack=None):
+        """
+        Schedule `callback` to run once.
+
+        :param callback: function called as callback(bot, job).
+        :param when: seconds, timedelta or datetime, see to_timestamp.
+        :param context: data available as job.context.
+        :param name: name of the job, name of callback by default.
+        :param slack: seconds the job may fire late by, the slack
+                      of the scheduler by default.
+
+        :return: the new Job.
+        """
+        return self.run_at(callback, self.to_timestamp(when), context, name,
+                           slack)
+
+    def run_at(self, callback, timestamp, context=None, name=None,
+               slack=None):
+        """
+        Schedule `callback` to run once at epoch second `timestamp`.
+        Other arguments are the same as for run_once.
+
+        :return: the new Job.
+        """
+        due = epoch_seconds(timestamp)
+        job = Job(callback, context, name, job_queue=self,
+                  slack=self.job_slack(due, self.clock.time(), slack))
+        return self._put(job, due)
+
+    def run_once_many(self, callback, items, name=None, slack=None):
+        """
+        Schedule many one time jobs with one lock acquisition.
+        Big batches are merged into the heap with one heapify.
+
+        :param callback: function called as callback(bot, job).
+        :param items: iterable of (when, context) pairs.
+        :param name: name of the jobs, name of callback by default.
+        :param slack: slack of every job, the slack of the scheduler
+                      by default.
+
+        :return: list of new Jobs, in order of items.
+        """
+        now = self.clock.time()
+        return self.run_at_many(callback, [(self.to_timestamp(when, now),
+                                            context)
+                                           for when, context in items],
+                                name, slack)
+
+    def run_at_many(self, callback, items, name=None, slack=None):
+        """
+        Same as run_once_many, with epoch seconds instead of `when`.
+
+        :param items: iterable of (timestamp, context) pairs.
+
+        :return: list of new Jobs, in order of items.
+        """
+        now = self.clock.time()
+        jobs = []
+        entries = []
+        for timestamp, context in items:
+            due = epoch_seconds(timestamp)
+            job = Job(callback, context, name, job_queue=self,
+                      slack=self.job_slack(due, now, slack))
+            job.due = due
+            jobs.append(job)
+            entries.append((fire_time(due, job.slack), next(self._counter),
+                            job))
+        if not entries:
+            return jobs
+        with self._lock:
+            if len(entries) > len(self._heap):
+                self._heap.extend(entries)
+                heapq.heapify(self._heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self._heap, entry)
+        self._wake.set()
+        return jobs
+
+    def run_repeating(self, callback, interval, first=None, context=None,
+                      name=None):
+        """
+        Schedule `callback` to run every `interval` seconds.
+
+        :param callback: function called as callback(bot, job).
+        :param interval: seconds (or timedelta) between runs.
+        :param first: time of the first run, `interval` from now by default.
+        :param context: data available as job.context.
+        :param name: name of the job, name of callback by default.
+
+        :return: the new Job.
+        """
+        if isinstance(interval, timedelta):
+            interval = interval.total_seconds()
+        job = Job(callback, context, name, interval=interval, job_queue=self)
+        return self._put(job, self.to_timestamp(interval if first is None
+                                                else first))
+
+    def jobs(self):
+        """
+        :return: tuple of all jobs waiting to run.
+        """
+        with self._lock:
+            return tuple(job for _, _, job in self._heap if not job.removed)
+
+    def get_jobs_by_name(self, name):
+        """
+        :return: tuple of waiting jobs with given name.
+        """
+        return tuple(job for job in self.jobs() if job.name == name)
+
+    def __len__(self):
+        """
+        Number of heap entries, including removed jobs not yet dropped.
+        """
+        return len(self._heap)
+
+    def next_due(self):
+        """
+        :return: timestamp the earliest waiting job fires at or None.
+        """
+        with self._lock:
+            while self._heap and self._heap[0][2].removed:
+                heapq.heappop(self._heap)[2].due = None
+            return self._heap[0][0] if self._heap else None
+
+    def _pop_bucket(self, now):
+        """
+        Pop the jobs firing at the earliest fire time, if it is not
+        after `now`.
+
+        :return: (fire time, list of jobs not removed), fire time is None
+                 if nothing is due.
+        """
+        jobs = []
+        fire = None
+        with self._lock:
+            while (self._heap and self._heap[0][0] <= now
+                   and (fire is None or self._heap[0][0] == fire)):
+                fire, _, job = heapq.heappop(self._heap)
+                if job.removed:
+                    job.due = None
+                else:
+                    jobs.append(job)
+        return fire, jobs
+
+    def _run_bucket(self, jobs):
+        if len(jobs) > 1 and self.batch is not None:
+            with self.batch():
+                for job in jobs:
+                    self._run(job)
+        else:
+            for job in jobs:
+                self._run(job)
+        get_metrics().inc('scheduler.buckets')
+        get_metrics().inc('scheduler.jobs', len(jobs))
+
+    def _run(self, job):
+        if job.enabled:
+            try:
+                job.callback(self.bot, job)
+            except Exception:
+                get_logger().exception(f'An uncaught error was raised while '
+                                       f'executing job {job.name}')
+        if job.repeat and not job.removed:
+            self._put(job, job.due + job.interval)
+        else:
+            job.due = None
+
+    def tick(self):
+        """
+        Run all jobs which are due now.
+
+        :return: number of jobs run.
+        """
+        count = 0
+        now = self.clock.time()
+        fire, jobs = self._pop_bucket(now)
+        while fire is not None:
+            self._run_bucket(jobs)
+            count += len(jobs)
+            fire, jobs = self._pop_bucket(now)
+        return count
+
+    def run_until(self, timestamp):
+        """
+        Run all jobs firing until `timestamp` in order. A virtual clock is
+        moved to the fire time of every bucket before it runs, so callbacks
+        see the time they were scheduled for, plus the slack.
+
+        :param timestamp: seconds since the epoch.
+
+        :return: number of jobs run.
+        """
+        clock = self.clock
+        move = getattr(clock, 'set', None)
+        count = 0
+        fire, jobs = self._pop_bucket(timestamp)
+        while fire is not None:
+            if move is not None:
+                move(fire)
+            self._run_bucket(jobs)
+            count += len(jobs)
+            fire, jobs = self._pop_bucket(timestamp)
+        if move is not None:
+            move(timestamp)
+        return count
+
+    def advance(self, seconds):
+        """
+        Move a virtual clock `seconds` forward and run everything due.
+
+        :param seconds: number of seconds, int, float or timedelta.
+
+        :return: number of jobs run.
+        """
+        return self.run_until(self.to_timestamp(seconds))
+
+    def start(self):
+        """
+        Start the scheduler thread.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._main_loop,
+                                        name='scheduler', daemon=True)
+        self._thread.start()
+
+    def _main_loop(self):
+        while self._running:
+            self.tick()
+            next_due = self.next_due()
+            timeout = MAX_WAIT
+            if next_due is not None:
+                timeout = min(max(next_due - self.clock.time(), 0), MAX_WAIT)
+            self.clock.wait(self._wake, timeout)
+            self._wake.clear()
+            get_metrics().inc('scheduler.wakeups')
+
+    def stop(self):
+        """
+        Stop the scheduler thread, waiting for the running job to finish.
+        """
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,251 @@
+"""
+Per chat search over names, locations and messages of active jobs.
+
+Every chat has its own index, updated when a job is set, fired or unset:
+
+* a trie of words, answering "some word starts with the query",
+* trigram posting sets, answering "the text contains the query" for
+  queries of TRIGRAM or more characters; names from the smallest posting
+  set of the query are checked against the other sets and the text,
+  switching to set intersections after SCAN_BUDGET names.
+
+Lookups stop as soon as `limit` names are found, so a query costs
+about the same for a chat with ten jobs and for one with 50k jobs.
+"""
+
+import re
+import threading
+
+TRIGRAM = 3
+LIMIT = 10      # names returned by find() by default
+SCAN_BUDGET = 200   # names checked one by one before intersecting posting sets
+WORD = re.compile(r'\w+')
+END = ''        # key of the set of names in a trie node, never a character
+
+
+def words_of(text):
+    """
+    :return: lower case words of `text`.
+    """
+    return WORD.findall(text.lower())
+
+
+def trigrams_of(text):
+    """
+    :return: set of trigrams of lower case `text`.
+    """
+    return {text[start:start + TRIGRAM]
+            for start in range(len(text) - TRIGRAM + 1)}
+
+
+class ChatIndex:
+    """
+    Index of the jobs of one chat.
+    """
+    __slots__ = ('texts', 'names', 'trie', 'postings')
+
+    def __init__(self):
+        self.texts = dict()
+        self.names = dict()
+        self.trie = dict()
+        self.postings = dict()
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, name, text):
+        """
+        Index job `name` with searchable `text`, replacing old text.
+
+        :param name: name of the job.
+        :param text: lower case name, location and message of the job.
+        """
+        if name in self.texts:
+            self.remove(name)
+        self.texts[name] = text
+        self.names[name.lower()] = name
+        for word in set(words_of(text)):
+            node = self.trie
+            for char in word:
+                node = node.setdefault(char, dict())
+            node.setdefault(END, set()).add(name)
+        for trigram in trigrams_of(text):
+            self.postings.setdefault(trigram, set()).add(name)
+
+    def remove(self, name):
+        """
+        Drop job `name` from the index, if it is there.
+        """
+        text = self.texts.pop(name, None)
+        if text is None:
+            return
+        if self.names.get(name.lower()) == name:
+            del self.names[name.lower()]
+        for word in set(words_of(text)):
+            self._remove_word(self.trie, word, 0, name)
+        for trigram in trigrams_of(text):
+            names = self.postings[trigram]
+            names.discard(name)
+            if not names:
+                del self.postings[trigram]
+
+    def _remove_word(self, node, word, depth, name):
+        # returns True if the node became empty and can be dropped
+        if depth == len(word):
+            names = node.get(END)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del node[END]
+        else:
+            child = node.get(word[depth])
+            if child is not None and self._remove_word(child, word,
+                                                       depth + 1, name):
+                del node[word[depth]]
+        return not node
+
+    def prefix(self, prefix, limit, found):
+        """
+        Add names with a word starting with `prefix` to `found`.
+        """
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            for name in node.get(END, ()):
+                found[name] = None
+                if len(found) >= limit:
+                    return
+            stack.extend(child for char, child in node.items()
+                         if char != END)
+
+    def substring(self, query, limit, found):
+        """
+        Add names whose text contains `query` to `found`.
+        """
+        if len(query) < TRIGRAM:
+            return
+        postings = []
+        for trigram in trigrams_of(query):
+            names = self.postings.get(trigram)
+            if names is None:
+                return
+            postings.append(names)
+        postings.sort(key=len)
+        smallest, others = postings[0], postings[1:]
+        # common queries fill the limit within a few candidates ...
+        for checked, name in enumerate(smallest):
+            if checked == SCAN_BUDGET:
+                break
+            if (name not in found
+                    and all(name in names for names in others)
+                    and query in self.texts[name]):
+                found[name] = None
+                if len(found) >= limit:
+                    return
+        else:
+            return
+        # ... rare ones are faster with intersections done in C
+        candidates = smallest
+        for names in others:
+            candidates = candidates & names
+            if not candidates:
+                return
+        for name in candidates:
+            if name not in found and query in self.texts[name]:
+                found[name] = None
+                if len(found) >= limit:
+                    return
+
+    def find(self, query, limit=LIMIT):
+        """
+        :param query: text to look for.
+        :param limit: max number of names returned.
+
+        :return: list of names, exact name first, then word prefix
+                 matches, then substring matches.
+        """
+        query = query.lower().strip()
+        if not query:
+            return []
+        # dict keeps the order names were found in, without duplicates
+        found = dict()
+        name = self.names.get(query)
+        if name is not None:
+            found[name] = None
+        words = words_of(query)
+        if len(words) == 1:
+            self.prefix(words[0], limit, found)
+        if len(found) < limit:
+            self.substring(query, limit, found)
+        return list(found)[:limit]
+
+
+class SearchIndex:
+    """
+    Thread safe registry of ChatIndex objects, one per chat.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chats = dict()
+
+    def add(self, chat_id, name, *texts):
+        """
+        Index job `name` of `chat_id`.
+
+        :param chat_id: chat owning the job.
+        :param name: name of the job.
+        :param texts: location, message or other searchable texts,
+                      None values are skipped.
+        """
+        text = '\n'.join(text for text in (name,) + texts
+                         if text is not None).lower()
+        with self._lock:
+            index = self._chats.get(chat_id)
+            if index is None:
+                index = self._chats[chat_id] = ChatIndex()
+            index.add(name, text)
+
+    def remove(self, chat_id, name):
+        """
+        Drop job `name` of `chat_id` from the index.
+        """
+        with self._lock:
+            index = self._chats.get(chat_id)
+            if index is None:
+                return
+            index.remove(name)
+            if not index:
+                del self._chats[chat_id]
+
+    def find(self, chat_id, query, limit=LIMIT):
+        """
+        :return: list of names of `chat_id` jobs matching `query`.
+        """
+        with self._lock:
+            index = self._chats.get(chat_id)
+            if index is None:
+                return []
+            return index.find(query, limit)
+
+    def clear(self):
+        """
+        Forget all chats. Used mostly by tests.
+        """
+        with self._lock:
+            self._chats.clear()
+
+
+index = SearchIndex()
+
+
+def get_search():
+    """
+    Function to get the shared search index.
+    """
+    return index
@@ -0,0 +1,211 @@
+"""
+Live introspection of the bot: memory held by jobs and chats,
+scheduler and dispatcher load, threads and process RSS.
+
+Everything reported here is either a counter kept up to date when jobs
+are created and finished, or an O(1) length/size lookup, so collecting
+the stats never walks over all chats or jobs.
+The same data is served to admins by /stats and as JSON over a small
+HTTP server bound to localhost.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bot_organizer.metrics import get_metrics
+
+STATS_HOST = '127.0.0.1'
+STATS_PORT = 8765
+PAGE_SIZE = resource.getpagesize()
+
+# (chat_id, job_name): context size counted when the job was created,
+# the context of a finished job may not be the one it was created with
+_context_sizes = dict()
+_context_lock = threading.Lock()
+
+
+def context_size(context):
+    """
+    Approximate number of bytes held by a job context.
+    Chat data referenced from the context is counted separately.
+
+    :param context: job context list (chat_id, name, message, ...).
+
+    :return: size in bytes.
+    """
+    return sys.getsizeof(context) + sum(sys.getsizeof(item)
+                                        for item in context[:3])
+
+
+def job_created(job_name, context):
+    """
+    Account for a job which was just scheduled.
+
+    :param job_name: key of the job handle in chat_data.
+    :param context: context of the job.
+    """
+    size = context_size(context)
+    with _context_lock:
+        # a job replaced without job_finished gives its bytes back
+        old_size = _context_sizes.get((context[0], job_name), 0)
+        _context_sizes[(context[0], job_name)] = size
+    metrics = get_metrics()
+    metrics.inc('jobs.created')
+    metrics.inc('jobs.context_bytes', size - old_size)
+    metrics.inc('chat_data.bytes', sys.getsizeof(job_name))
+
+
+def job_finished(job_name, context, cancelled=False):
+    """
+    Account for a job which fired or was cancelled.
+
+    :param job_name: key of the job handle in chat_data.
+    :param context: context of the job, only its chat_id is read.
+    :param cancelled: True if the job was unset or replaced.
+    """
+    with _context_lock:
+        size = _context_sizes.pop((context[0], job_name), 0)
+    metrics = get_metrics()
+    metrics.inc('jobs.cancelled' if cancelled else 'jobs.fired')
+    metrics.dec('jobs.context_bytes', size)
+    metrics.dec('chat_data.bytes', sys.getsizeof(job_name))
+
+
+def process_rss():
+    """
+    :return: resident set size of the process in bytes.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # not Linux, fall back to peak RSS (KiB on Linux, bytes on macOS)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class StatsCollector:
+    """
+    Collects the stats from metrics and from objects attached in main().
+    """
+
+    def __init__(self):
+        self.dispatcher = None
+        self.executor = None
+        self.conversations = ()
+
+    def attach(self, dispatcher=None, conv_handler=None, executor=None):
+        """
+        :param dispatcher: dispatcher of the updater, gives chat_data
+                           and the update queue.
+        :param conv_handler: conversation handler, gives conversations
+                             in progress.
+        :param executor: ChatExecutor, gives updates waiting for a worker.
+        """
+        if dispatcher is not None:
+            self.dispatcher = dispatcher
+        if conv_handler is not None:
+            self.conversations = conv_handler.conversations
+        if executor is not None:
+            self.executor = executor
+
+    def collect(self):
+        """
+        :return: dict with the current stats, ready for JSON.
+        """
+        metrics = get_metrics()
+        stats = {
+            'chats_with_data': 0,
+            'jobs_pending': metrics.get('jobs.pending'),
+            'jobs_created': metrics.get('jobs.created'),
+            'jobs_fired': metrics.get('jobs.fired'),
+            'jobs_cancelled': metrics.get('jobs.cancelled'),
+            'conversations_in_progress': len(self.conversations),
+            'chat_data_bytes': metrics.get('chat_data.bytes'),
+            'job_context_bytes': metrics.get('jobs.context_bytes'),
+            'update_queue_depth': 0,
+            'dispatch_queue_depth': 0,
+            'threads': threading.active_count(),
+            'rss_bytes': process_rss(),
+            'pid': os.getpid(),
+        }
+        if self.dispatcher is not None:
+            stats['chats_with_data'] = len(self.dispatcher.chat_data)
+            stats['update_queue_depth'] = self.dispatcher.update_queue.qsize()
+        if self.executor is not None:
+            # taken from the update queue, but not handled yet
+            stats['dispatch_queue_depth'] = len(self.executor)
+            stats['update_queue_depth'] += stats['dispatch_queue_depth']
+        stats['admission'] = metrics.snapshot('admission.')
+        stats['polling'] = metrics.snapshot('polling.')
+        return stats
+
+
+collector = StatsCollector()
+
+
+def get_stats():
+    """
+    Function to get the shared stats collector.
+    """
+    return collector
+
+
+def format_stats(stats):
+    """
+    Function to build /stats reply text.
+
+    :param stats: dict returned by StatsCollector.collect.
+
+    :return: reply string.
+    """
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            value = ', '.join(f'{name}={count}'
+                              for name, count in sorted(value.items())) or '-'
+        lines.append(f'{key}: {value}')
+    return '\n'.join(lines)
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /stats as JSON, everything else is 404.
+    """
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/stats':
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.collector.collect()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(stats_collector=collector, host=STATS_HOST,
+                      port=STATS_PORT):
+    """
+    Start the JSON stats endpoint in a daemon thread.
+
+    :param stats_collector: collector which provides the stats.
+    :param host: address to bind, localhost by default.
+    :param port: port to bind, 0 picks a free one.
+
+    :return: the running server, call its shutdown() to stop it.
+    """
+    server = HTTPServer((host, port), StatsRequestHandler)
+    server.collector = stats_collector
+    thread = threading.Thread(target=server.serve_forever,
+                              name='stats_http', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,101 @@
+"""
+Periodic cleanup of per-chat state which nobody will use anymore.
+
+Unfinished /event and /timer entries and handles of jobs which already
+fired or were removed stay in chat_data forever otherwise.
+The sweeper runs as a repeating job and looks only at a bounded
+slice of chats on each run, so it never blocks the job queue for long.
+"""
+
+from bot_organizer.admission import get_admission
+from bot_organizer.clock import get_clock
+from bot_organizer.metrics import get_metrics
+
+STARTED = 'started'     # monotonic time an entry was started or last replied to
+SLICE_SIZE = 500        # chats inspected on one run of the sweeper
+# same as LEE, LTE and JOB_STR_END of bot_organizer, which imports this module
+ENTRY_KEYS = ('last_event_entry', 'last_timer_entry')
+JOB_STR_END = '_job'
+
+
+def is_stale_job(job):
+    """
+    :param job: job handle stored in chat_data.
+
+    :return: True if the job was removed or will not run again.
+    """
+    return job.removed or job.next_t is None
+
+
+class ChatDataSweeper:
+    """
+    Callable for ``job_queue.run_repeating`` which cleans chat_data in slices.
+
+    :param chat_data: dict of all chats' data, e.g. ``dispatcher.chat_data``.
+    :param max_age: seconds without a reply after which an unfinished
+                    entry is dropped.
+    :param slice_size: number of chats inspected on one run.
+    :param timer: function returning monotonic time in seconds.
+    """
+
+    def __init__(self, chat_data, max_age, slice_size=SLICE_SIZE,
+                 timer=None):
+        self.chat_data = chat_data
+        self.max_age = max_age
+        self.slice_size = slice_size
+        self._timer = timer or (lambda: get_clock().monotonic())
+        self._pass = []
+        self._position = 0
+
+    def __call__(self, _bot, _job):
+        self.sweep_slice()
+
+    def sweep_slice(self):
+        """
+        Inspect next `slice_size` chats. When a full pass over all chats
+        is done, the next call starts a new one with a fresh list of chats.
+
+        :return: number of removed entries.
+        """
+        if self._position >= len(self._pass):
+            # only the list of keys is copied, the chats are looked at lazily
+            self._pass = list(self.chat_data.keys())
+            self._position = 0
+        # a slice of the buckets of the admission controller, like of chats
+        get_admission().prune_buckets(self.slice_size)
+        end = self._position + self.slice_size
+        chat_ids = self._pass[self._position:end]
+        self._position = end
+
+        now = self._timer()
+        removed = 0
+        for chat_id in chat_ids:
+            data = self.chat_data.get(chat_id)
+            if data:
+                removed += self.sweep_chat(data, now)
+        if removed:
+            get_metrics().inc('sweeper.removed', removed)
+        return removed
+
+    def sweep_chat(self, data, now):
+        """
+        Remove stale entries from the data of one chat.
+
+        :param data: chat_data dict of the chat.
+        :param now: current monotonic time in seconds.
+
+        :return: number of removed entries.
+        """
+        stale = []
+        for key, value in list(data.items()):
+            if key in ENTRY_KEYS:
+                # entries without a stamp are in the middle of one message
+                # handler (new_event/new_timer), so they are left alone
+                started = value.get(STARTED)
+                if started is not None and now - started > self.max_age:
+                    stale.append(key)
+            elif key.endswith(JOB_STR_END) and is_stale_job(value):
+                stale.append(key)
+        for key in stale:
+            data.pop(key, None)
+        return len(stale)
@@ -0,0 +1,371 @@
+"""
+Tiered job storage: near-term jobs in memory, far-future jobs on disk.
+
+TieredScheduler sits in front of the Scheduler. Alarms due within WINDOW
+seconds become normal in-memory jobs. Later ones are written to a sqlite
+table sorted by due time, and chat_data keeps only a small StoredJob
+handle for them, without the context list and notification string.
+Every PROMOTE_INTERVAL seconds jobs which entered the window are loaded
+in batches of BATCH_SIZE, scheduled in memory and their handles swapped
+for the real jobs, so memory follows the near-term load instead of the
+number of scheduled events.
+
+The table is a cache of the running process: every process has its own
+file, named after the process id (see store_filename), which is emptied
+on start and deleted on close. Jobs survive restarts through the snapshot
+and the journal, so an active and a standby process in one directory
+never see each other's rows.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from bot_organizer.metrics import get_metrics
+from bot_organizer.scheduler import epoch_seconds
+
+JOBS_FILENAME = 'jobs.sqlite3'
+WINDOW = 3600          # seconds ahead kept in memory
+PROMOTE_INTERVAL = 60  # seconds between two loads of jobs entering the window
+BATCH_SIZE = 500       # jobs loaded from disk in one query
+JOB_STR_END = '_job'
+TIERED_CALLBACK = 'alarm'  # only jobs of this callback can go to disk
+
+
+def store_filename(filename, owner=None):
+    """
+    :param filename: base path, e.g. 'jobs.sqlite3'.
+    :param owner: id of the process owning the store, this process
+                  by default.
+
+    :return: path of the store of `owner`, e.g. 'jobs.1234.sqlite3';
+             ':memory:' is returned as is.
+    """
+    if filename == ':memory:':
+        return filename
+    root, extension = os.path.splitext(filename)
+    owner = os.getpid() if owner is None else owner
+    return f'{root}.{owner}{extension}'
+
+
+class JobStore:
+    """
+    Jobs sorted by due time in a sqlite table.
+
+    :param filename: base path of the database, ':memory:' for tests.
+    :param owner: id of the process owning the store, see store_filename.
+    """
+
+    def __init__(self, filename=JOBS_FILENAME, owner=None):
+        self.filename = store_filename(filename, owner)
+        self._db = sqlite3.connect(self.filename, check_same_thread=False,
+                                   isolation_level=None)
+        # a cache rebuilt on every start does not need to survive a crash
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('DROP TABLE IF EXISTS jobs')
+        # AUTOINCREMENT never reuses the id of a deleted row, so a handle
+        # of a replaced job can not match the row of the new one
+        self._db.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY '
+                         'AUTOINCREMENT, '
+                         'due INTEGER NOT NULL, chat_id INTEGER NOT NULL, '
+                         'name TEXT NOT NULL, message TEXT NOT NULL, '
+                         'priority TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX jobs_due ON jobs (due)')
+
+    def add(self, due, chat_id, name, message, priority):
+        """
+        :return: id of the new row.
+        """
+        return self._db.execute(
+            'INSERT INTO jobs (due, chat_id, name, message, priority) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (due, chat_id, name, message, priority)).lastrowid
+
+    def add_many(self, rows):
+        """
+        :param rows: list of (due, chat_id, name, message, priority).
+
+        :return: list of ids of the new rows, in order.
+        """
+        self._db.execute('BEGIN')
+        try:
+            ids = [self.add(*row) for row in rows]
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+        return ids
+
+    def remove(self, row_id):
+        self._db.execute('DELETE FROM jobs WHERE id = ?', (row_id,))
+
+    def message(self, row_id):
+        """
+        :return: notification string of the row, None if it is gone.
+        """
+        row = self._db.execute('SELECT message FROM jobs WHERE id = ?',
+                               (row_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def take_due(self, until, limit):
+        """
+        Delete and return up to `limit` earliest rows due before `until`.
+
+        :return: list of (id, due, chat_id, name, message, priority).
+        """
+        self._db.execute('BEGIN')
+        rows = self._db.execute(
+            'SELECT id, due, chat_id, name, message, priority FROM jobs '
+            'WHERE due < ? ORDER BY due LIMIT ?', (until, limit)).fetchall()
+        self._db.executemany('DELETE FROM jobs WHERE id = ?',
+                             [(row[0],) for row in rows])
+        self._db.execute('COMMIT')
+        return rows
+
+    def rows(self):
+        """
+        :return: all rows as (id, due, chat_id, name, message, priority).
+        """
+        return self._db.execute(
+            'SELECT id, due, chat_id, name, message, priority FROM jobs '
+            'ORDER BY due').fetchall()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+    def close(self):
+        """
+        Close the database and delete its file, it is never read again.
+        """
+        self._db.close()
+        if self.filename != ':memory:':
+            try:
+                os.remove(self.filename)
+            except FileNotFoundError:
+                pass
+
+
+class StoredJob:
+    """
+    Handle of a job waiting on disk, kept in chat_data instead of the Job.
+    It has the attributes of Job the handlers and the sweeper look at.
+    """
+    __slots__ = ('tiers', 'row_id', 'chat_id', 'name', 'priority', 'due',
+                 'removed', 'message', 'job')
+
+    def __init__(self, tiers, row_id, chat_id, name, priority, due,
+                 message=None):
+        self.tiers = tiers
+        self.row_id = row_id
+        self.chat_id = chat_id
+        self.name = name
+        self.priority = priority
+        self.due = due
+        self.removed = False
+        # only set for copies made by TieredScheduler.jobs()
+        self.message = message
+        # the in-memory Job, once the handle was promoted
+        self.job = None
+
+    @property
+    def callback(self):
+        return self.tiers.callback
+
+    @property
+    def context(self):
+        """
+        Same list as the context of the Job, the message is read from disk
+        and chat_data is None, it is not needed outside of alarm.
+        """
+        message = self.message
+        if message is None:
+            message = self.tiers.store_message(self.row_id)
+        return [self.chat_id, self.name, message, None, self.priority]
+
+    @property
+    def next_t(self):
+        if self.removed:
+            return None
+        return datetime.fromtimestamp(self.due)
+
+    def schedule_removal(self):
+        self.tiers.remove(self)
+
+    def __repr__(self):
+        return f'StoredJob({self.name!r}, due={self.due})'
+
+
+class TieredScheduler:
+    """
+    Job queue keeping far-future alarms on disk. Everything not about
+    those alarms is passed to the wrapped Scheduler.
+
+    :param scheduler: the in-memory Scheduler.
+    :param store: JobStore for the far-future jobs.
+    :param chat_data: dict of all chats' data, e.g. ``dispatcher.chat_data``.
+    :param window: seconds ahead kept in memory.
+    :param batch_size: jobs loaded from disk in one query.
+    """
+
+    def __init__(self, scheduler, store, chat_data, window=WINDOW,
+                 batch_size=BATCH_SIZE):
+        self.scheduler = scheduler
+        self.store = store
+        self.chat_data = chat_data
+        self.window = window
+        self.batch_size = batch_size
+        self.callback = None
+        self._lock = threading.RLock()
+        scheduler.run_repeating(self.promote, PROMOTE_INTERVAL, first=0)
+
+    def __getattr__(self, name):
+        # start, stop, tick, advance, run_repeating, ... of the scheduler
+        return getattr(self.scheduler, name)
+
+    def _is_far(self, callback, due):
+        if getattr(callback, '__name__', None) != TIERED_CALLBACK:
+            return False
+        # a reloaded handler module brings a new alarm function
+        self.callback = callback
+        return due - self.scheduler.clock.time() > self.window
+
+    def run_once(self, callback, when, context=None, name=None, slack=None):
+        """
+        Same as Scheduler.run_once, far alarms go to disk. Their slack
+        is given by the scheduler when they are promoted.
+
+        :return: the new Job or StoredJob.
+        """
+        return self.run_at(callback, self.scheduler.to_timestamp(when),
+                           context, name, slack)
+
+    def run_at(self, callback, timestamp, context=None, name=None,
+               slack=None):
+        """
+        Same as Scheduler.run_at, far alarms go to disk.
+
+        :return: the new Job or StoredJob.
+        """
+        due = epoch_seconds(timestamp)
+        if name is not None or not self._is_far(callback, due):
+            return self.scheduler.run_at(callback, due, context, name, slack)
+        return self._store([(due, context)])[0]
+
+    def run_once_many(self, callback, items, name=None, slack=None):
+        """
+        Same as Scheduler.run_once_many, far alarms go to disk.
+
+        :return: list of new Jobs and StoredJobs, in order of items.
+        """
+        now = self.scheduler.clock.time()
+        return self.run_at_many(callback,
+                                [(self.scheduler.to_timestamp(when, now),
+                                  context) for when, context in items],
+                                name, slack)
+
+    def run_at_many(self, callback, items, name=None, slack=None):
+        """
+        Same as Scheduler.run_at_many, far alarms go to disk.
+
+        :return: list of new Jobs and StoredJobs, in order of items.
+        """
+        near, far, order = [], [], []
+        for timestamp, context in items:
+            due = epoch_seconds(timestamp)
+            if name is None and self._is_far(callback, due):
+                far.append((due, context))
+                order.append(False)
+            else:
+                near.append((due, context))
+                order.append(True)
+        near_jobs = iter(self.scheduler.run_at_many(callback, near, name,
+                                                    slack)
+                         if near else ())
+        far_jobs = iter(self._store(far))
+        return [next(near_jobs) if in_memory else next(far_jobs)
+                for in_memory in order]
+
+    def _store(self, items):
+        if not items:
+            return []
+        rows = [(due, context[0], context[1], context[2], context[4])
+                for due, context in items]
+        with self._lock:
+            ids = self.store.add_many(rows)
+        get_metrics().inc('jobs.stored', len(ids))
+        return [StoredJob(self, row_id, chat_id, name, priority, due)
+                for row_id, (due, chat_id, name, _, priority)
+                in zip(ids, rows)]
+
+    def store_message(self, row_id):
+        with self._lock:
+            return self.store.message(row_id)
+
+    def remove(self, handle):
+        """
+        Remove a job waiting on disk, used by StoredJob.schedule_removal.
+        """
+        with self._lock:
+            if handle.job is not None:
+                # promoted after the caller took the handle from chat_data
+                handle.job.schedule_removal()
+                return
+            if handle.removed:
+                return
+            handle.removed = True
+            self.store.remove(handle.row_id)
+        get_metrics().dec('jobs.stored')
+
+    def promote(self, _bot=None, _job=None):
+        """
+        Move jobs which entered the window from disk to memory.
+        Runs as a repeating job of the scheduler.
+
+        :return: number of promoted jobs.
+        """
+        until = self.scheduler.clock.time() + self.window
+        promoted = 0
+        while True:
+            with self._lock:
+                rows = self.store.take_due(until, self.batch_size)
+                promoted += self._schedule(rows)
+            if len(rows) < self.batch_size:
+                break
+        if promoted:
+            get_metrics().inc('jobs.promoted', promoted)
+        return promoted
+
+    def _schedule(self, rows):
+        # called with the lock held, so no handle is removed meanwhile
+        handles = []
+        items = []
+        for row_id, due, chat_id, name, message, priority in rows:
+            chat_data = self.chat_data[chat_id]
+            handle = chat_data.get(name+JOB_STR_END)
+            get_metrics().dec('jobs.stored')
+            if (not isinstance(handle, StoredJob) or handle.row_id != row_id
+                    or handle.removed or handle.job is not None):
+                # unset or replaced while the row was read
+                continue
+            handles.append((chat_data, handle))
+            items.append((due, [chat_id, name, message, chat_data,
+                                priority]))
+        jobs = self.scheduler.run_at_many(self.callback, items)
+        for (chat_data, handle), job in zip(handles, jobs):
+            handle.job = job
+            chat_data[handle.name+JOB_STR_END] = job
+        return len(jobs)
+
+    def jobs(self):
+        """
+        :return: tuple of in-memory jobs and copies of the jobs on disk.
+        """
+        with self._lock:
+            rows = self.store.rows()
+        return self.scheduler.jobs() + tuple(
+            StoredJob(self, row_id, chat_id, name, priority, due, message)
+            for row_id, due, chat_id, name, message, priority in rows)
+
+    def __len__(self):
+        return len(self.scheduler)
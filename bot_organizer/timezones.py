@@ -0,0 +1,286 @@
+"""
+Per chat time zones backed by precomputed offset tables.
+
+Dates typed by a user are wall clock times of their zone. A ZoneTable
+holds every UTC offset change of a zone as two sorted lists, transition
+epochs and offsets, built once when the zone is first used. The changes
+listed by the TZif file of the zone are taken as they are; the years
+after its last transition follow the rule of the file, where changes are
+months apart, so they are found by scanning the offsets day by day and
+bisecting each change to the second. Without a TZif file (e.g. a TZ
+variable with a POSIX rule) the whole table is scanned. After that
+converting between epoch seconds and wall clock seconds is a bisect
+over a few hundred integers, without asking the tz database or building
+aware datetimes per message:
+
+    zone = get_zone('Europe/Warsaw')
+    due = zone.parse('2030-07-01 09:00:00', '%Y-%m-%d %H:%M:%S')
+    zone.format(due, '%H:%M')
+
+Wall clock times skipped by a change (spring forward) are read with the
+offset before it, so they land after the change; repeated times (fall
+back) mean the first of the two, the same as datetime with fold=0.
+Chats without a zone use the zone of the server, LOCAL. Tables are kept
+for the life of the process, there are only a few hundred zones.
+"""
+
+import bisect
+import calendar
+import functools
+import os
+import struct
+import time
+import zoneinfo
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+LOCAL = 'local'              # name of the zone of the server
+TABLE_START = 0              # 1970-01-01, first epoch second of a table
+TABLE_END = 4102444800       # 2100-01-01, later times keep the last offset
+SCAN_STEP = 24 * 3600        # seconds between two offsets compared by a scan
+LOCALTIME = '/etc/localtime' # TZif file of the server zone
+DAY = 24 * 3600
+TZIF_HEADER = struct.Struct('>4sc15x6l')
+TTINFO = struct.Struct('>lBB')
+
+
+def local_offset(epoch):
+    """
+    :return: UTC offset of the server zone at `epoch` in seconds.
+    """
+    return time.localtime(epoch).tm_gmtoff
+
+
+def zone_offset(zone):
+    """
+    :param zone: ZoneInfo object.
+
+    :return: function giving the UTC offset of `zone` at an epoch second.
+    """
+    def offset(epoch):
+        return int(datetime.fromtimestamp(epoch, zone).utcoffset()
+                   .total_seconds())
+    return offset
+
+
+def scan_transitions(offset, start=TABLE_START, end=TABLE_END,
+                     step=SCAN_STEP):
+    """
+    :param offset: function giving the UTC offset at an epoch second.
+
+    :return: (list of epochs offsets change at, starting with `start`,
+              list of offsets in force from each of them).
+    """
+    starts = [start]
+    offsets = [offset(start)]
+    previous = start
+    for current in range(start + step, end + step, step):
+        value = offset(current)
+        if value == offsets[-1]:
+            previous = current
+            continue
+        # the change is in (previous, current], find its first second
+        low, high = previous, current
+        while high - low > 1:
+            middle = (low + high) // 2
+            if offset(middle) == value:
+                high = middle
+            else:
+                low = middle
+        starts.append(high)
+        offsets.append(value)
+        previous = current
+    return starts, offsets
+
+
+def tzif_transitions(data):
+    """
+    Read the transitions of a TZif file (RFC 8536), the 64-bit block
+    of version 2 and later files.
+
+    :param data: contents of the file.
+
+    :return: (list of transition epochs, list of offsets in force from
+              each of them, offset before the first one).
+    :raises ValueError: if `data` is not a TZif file.
+    """
+    try:
+        (magic, version, utc_count, std_count, leap_count, time_count,
+         type_count, char_count) = TZIF_HEADER.unpack_from(data, 0)
+        if magic != b'TZif':
+            raise ValueError('not a TZif file')
+        position = TZIF_HEADER.size
+        time_format = 'l'
+        if version >= b'2':
+            # skip the 32-bit block, the header of the 64-bit one follows
+            position += (time_count * 5 + type_count * TTINFO.size
+                         + char_count + leap_count * 8 + std_count + utc_count)
+            (_, _, _, _, _, time_count, type_count,
+             _) = TZIF_HEADER.unpack_from(data, position)
+            position += TZIF_HEADER.size
+            time_format = 'q'
+        times = struct.unpack_from(f'>{time_count}{time_format}', data,
+                                   position)
+        position += time_count * struct.calcsize(f'>{time_format}')
+        indexes = struct.unpack_from(f'>{time_count}B', data, position)
+        position += time_count
+        types = [TTINFO.unpack_from(data, position + number * TTINFO.size)[0]
+                 for number in range(type_count)]
+        return list(times), [types[index] for index in indexes], types[0]
+    except (struct.error, IndexError):
+        raise ValueError('truncated TZif file')
+
+
+def read_tzif(name):
+    """
+    :param name: IANA zone name, already checked by ZoneInfo, or LOCAL.
+
+    :return: contents of the TZif file of the zone, None if there is none.
+    """
+    if name == LOCAL:
+        # TZ overrides the file for time.localtime
+        if 'TZ' in os.environ:
+            return None
+        paths = [LOCALTIME]
+    else:
+        paths = [os.path.join(directory, name)
+                 for directory in zoneinfo.TZPATH]
+    for path in paths:
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except OSError:
+            continue
+    if name == LOCAL:
+        return None
+    try:
+        # the tzdata package, used by zoneinfo when the system has no files
+        from importlib import resources
+        return resources.files('tzdata.zoneinfo').joinpath(name).read_bytes()
+    except (ImportError, OSError):
+        return None
+
+
+def tzif_table(data, offset, start=TABLE_START, end=TABLE_END):
+    """
+    :param data: contents of a TZif file.
+    :param offset: function giving the UTC offset at an epoch second,
+                   used for the years after the last transition of the file.
+
+    :return: (list of epochs offsets change at, starting with `start`,
+              list of offsets in force from each of them).
+    """
+    times, values, first = tzif_transitions(data)
+    starts, offsets = [start], [first]
+    for when, value in zip(times, values):
+        if when <= start:
+            offsets[0] = value
+        elif when < end and value != offsets[-1]:
+            starts.append(when)
+            offsets.append(value)
+    last = max(times[-1] if times else start, start)
+    if last < end:
+        for when, value in zip(*scan_transitions(offset, last, end)):
+            if value != offsets[-1]:
+                starts.append(when)
+                offsets.append(value)
+    return starts, offsets
+
+
+class ZoneTable:
+    """
+    UTC offsets of one zone, sorted by the epoch they start at.
+
+    :param name: name of the zone.
+    :param starts: epochs the offsets start at, sorted.
+    :param offsets: offset in seconds in force from each start.
+    """
+    __slots__ = ('name', 'starts', 'offsets', 'local_starts')
+
+    def __init__(self, name, starts, offsets):
+        self.name = name
+        self.starts = starts
+        self.offsets = offsets
+        # wall clock second every offset starts at
+        self.local_starts = [start + value
+                             for start, value in zip(starts, offsets)]
+
+    def utc_offset(self, epoch):
+        """
+        :return: UTC offset in seconds at `epoch`.
+        """
+        return self.offsets[max(bisect.bisect_right(self.starts, epoch) - 1,
+                                0)]
+
+    def to_local(self, epoch):
+        """
+        :return: wall clock seconds, epoch seconds as if the zone was UTC.
+        """
+        return epoch + self.utc_offset(epoch)
+
+    def to_epoch(self, local):
+        """
+        :param local: wall clock seconds, see to_local.
+
+        :return: epoch second of the wall clock time.
+        """
+        index = max(bisect.bisect_right(self.local_starts, local) - 1, 0)
+        # a repeated wall clock time means the earlier one
+        if index > 0 and local - self.offsets[index - 1] < self.starts[index]:
+            index -= 1
+        return local - self.offsets[index]
+
+    def parse(self, text, fmt):
+        """
+        :return: epoch second of wall clock time `text` in format `fmt`.
+        :raises ValueError: if `text` does not match `fmt`.
+        """
+        return self.to_epoch(calendar.timegm(time.strptime(text, fmt)))
+
+    def format(self, epoch, fmt):
+        """
+        :return: wall clock time of `epoch` in format `fmt`.
+        """
+        return time.strftime(fmt, time.gmtime(self.to_local(int(epoch))))
+
+    def day_end(self, epoch):
+        """
+        :return: epoch second of the midnight ending the day of `epoch`.
+        """
+        return self.to_epoch((self.to_local(int(epoch)) // DAY + 1) * DAY)
+
+    def __repr__(self):
+        return f'ZoneTable({self.name!r}, {len(self.starts)} offsets)'
+
+
+def get_zone(name=LOCAL):
+    """
+    Function to get the offset table of a zone, built on the first use.
+
+    :param name: IANA zone name, e.g. 'Europe/Warsaw', or LOCAL.
+
+    :return: ZoneTable of the zone.
+    :raises ValueError: if there is no such zone.
+    """
+    return load_zone(name)
+
+
+@functools.lru_cache(maxsize=None)
+def load_zone(name):
+    """
+    :return: new ZoneTable of zone `name`, see get_zone.
+    """
+    if name == LOCAL:
+        offset = local_offset
+    else:
+        try:
+            offset = zone_offset(ZoneInfo(name))
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f'unknown time zone {name!r}')
+    data = read_tzif(name)
+    if data is not None:
+        try:
+            return ZoneTable(name, *tzif_table(data, offset))
+        except ValueError:
+            pass
+    return ZoneTable(name, *scan_transitions(offset))
@@ -1,8 +1,21 @@
 import pytest
 from bot_organizer import bot_organizer as bo
+from bot_organizer import metrics as bo_metrics
+from bot_organizer import stats as bo_stats
+from bot_organizer.admission import AdmissionController
+from bot_organizer.clock import VirtualClock, set_clock
+from bot_organizer.scheduler import Scheduler
 from datetime import datetime, timedelta
 
 
+@pytest.fixture(name='clock', autouse=True)
+def _clock():
+    clock = VirtualClock(datetime(2030, 1, 1, 12).timestamp())
+    previous = set_clock(clock)
+    yield clock
+    set_clock(previous)
+
+
 @pytest.fixture(name='get_logger')
 def _get_logger(mocker):
     return mocker.patch('bot_organizer.bot_organizer.get_logger')()
@@ -30,24 +43,23 @@ def _timer_chat_data():
 
 
 @pytest.fixture(name='good_event_chat_data', scope='function')
-def _good_event_chat_data():
+def _good_event_chat_data(clock):
     data = dict()
     data[bo.LEE] = dict()
     data[bo.LEE][bo.NAME] = 'TEST LEE'
-    now_plus_10 = datetime.now() + timedelta(minutes=10)
-    data[bo.LEE][bo.DATE] = now_plus_10
+    # event dates are epoch seconds
+    data[bo.LEE][bo.DATE] = int(clock.time()) + 10 * 60
     data[bo.LEE][bo.LOC] = 'TEST LOC'
     data[bo.LEE][bo.MSG] = 'TEST MSG'
     return data
 
 
 @pytest.fixture(name='bad_event_chat_data', scope='function')
-def _bad_event_chat_data():
+def _bad_event_chat_data(clock):
     data = dict()
     data[bo.LEE] = dict()
     data[bo.LEE][bo.NAME] = 'TEST LEE'
-    now_minus_10 = datetime.now() - timedelta(minutes=10)
-    data[bo.LEE][bo.DATE] = now_minus_10
+    data[bo.LEE][bo.DATE] = int(clock.time()) - 10 * 60
     data[bo.LEE][bo.LOC] = 'TEST LOC'
     data[bo.LEE][bo.MSG] = 'TEST MSG'
     return data
@@ -60,8 +72,8 @@ def _update(mocker):
 
 
 @pytest.fixture(name='good_due_update', scope='function')
-def _good_due_update(mocker, update):
-    now = datetime.now()
+def _good_due_update(mocker, update, clock):
+    now = clock.now()
     now_plus_10 = now + timedelta(seconds=10)
     update.message.text = now_plus_10.strftime(bo.TIME_FORMAT)
     return update
@@ -73,25 +85,37 @@ def _bad_due_update(mocker, update):
     return update
 
 
+@pytest.fixture(name='phrase_due_update', scope='function')
+def _phrase_due_update(mocker, update):
+    update.message.text = 'in 10 minutes'
+    return update
+
+
+@pytest.fixture(name='bad_phrase_due_update', scope='function')
+def _bad_phrase_due_update(mocker, update):
+    update.message.text = 'ten minutes'
+    return update
+
+
 @pytest.fixture(name='good_date_update', scope='function')
-def _good_date_update(mocker, update):
-    now = datetime.now()
+def _good_date_update(mocker, update, clock):
+    now = clock.now()
     now_plus_10 = now + timedelta(minutes=10)
     update.message.text = now_plus_10.strftime(bo.DATE_TIME_FORMAT)
     return update
 
 
 @pytest.fixture(name='bad_date_update', scope='function')
-def _bad_date_update(mocker, update):
-    now = datetime.now()
+def _bad_date_update(mocker, update, clock):
+    now = clock.now()
     now_minus_10 = now - timedelta(minutes=10)
     update.message.text = now_minus_10.strftime(bo.DATE_TIME_FORMAT)
     return update
 
 
 @pytest.fixture(name='bad_format_date_update', scope='function')
-def _bad_format_date_update(mocker, update):
-    update.message.text = datetime.now().strftime('%f')
+def _bad_format_date_update(mocker, update, clock):
+    update.message.text = clock.now().strftime('%f')
     return update
 
 
@@ -112,9 +136,9 @@ def _set_timer(mocker):
 
 
 @pytest.fixture(name='good_event_args', scope='function')
-def _good_event_args():
+def _good_event_args(clock):
     args = []
-    date_time = datetime.now() + timedelta(minutes=10)
+    date_time = clock.now() + timedelta(minutes=10)
     date = date_time.strftime(bo.DATE_FORMAT)
     args.append(date)
     time = date_time.strftime(bo.TIME_FORMAT)
@@ -125,9 +149,9 @@ def _good_event_args():
 
 
 @pytest.fixture(name='bad_event_args', scope='function')
-def _bad_event_args():
+def _bad_event_args(clock):
     args = []
-    date_time = datetime.now() - timedelta(minutes=10)
+    date_time = clock.now() - timedelta(minutes=10)
     date = date_time.strftime(bo.DATE_FORMAT)
     args.append(date)
     time = date_time.strftime(bo.TIME_FORMAT)
@@ -164,6 +188,28 @@ def _good_timer_chat_data():
     data = dict()
     data[bo.LTE] = dict()
     data[bo.LTE][bo.NAME] = 'TEST LTE'
-    data[bo.LTE][bo.DUE] = '10'
+    data[bo.LTE][bo.DUE] = 10
     data[bo.LTE][bo.MSG] = 'TEST MSG'
-    return data
\ No newline at end of file
+    return data
+
+@pytest.fixture(name='metrics', scope='function')
+def _metrics():
+    bo_metrics.registry.reset()
+    bo_stats._context_sizes.clear()
+    return bo_metrics.registry
+
+
+@pytest.fixture(name='admission', scope='function')
+def _admission(mocker):
+    controller = AdmissionController(rate=1.0, burst=2,
+                                     max_pending_per_chat=3,
+                                     max_pending_total=5,
+                                     timer=mocker.Mock(return_value=0.0))
+    mocker.patch('bot_organizer.bot_organizer.get_admission',
+                 return_value=controller)
+    return controller
+
+
+@pytest.fixture(name='scheduler', scope='function')
+def _scheduler(mocker):
+    return Scheduler(bot=mocker.Mock())
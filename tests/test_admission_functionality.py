@@ -0,0 +1,119 @@
+from bot_organizer import bot_organizer as bo
+from bot_organizer import admission as adm
+
+
+class TestTokenBucket:
+
+    def test_consume_until_empty(self):
+        bucket = adm.TokenBucket(rate=1.0, capacity=2, now=0.0)
+        assert bucket.consume(0.0)
+        assert bucket.consume(0.0)
+        assert not bucket.consume(0.0)
+
+    def test_refill(self):
+        bucket = adm.TokenBucket(rate=2.0, capacity=2, now=0.0)
+        bucket.consume(0.0)
+        bucket.consume(0.0)
+        assert bucket.consume(0.5)
+        assert bucket.is_full(10.0)
+
+
+class TestAdmissionController:
+
+    def test_rate_limit(self, admission, metrics):
+        assert admission.admit(1) is None
+        assert admission.admit(1) is None
+        assert admission.admit(1) == adm.RATE_LIMITED
+        # other chats are not affected
+        assert admission.admit(2) is None
+        assert metrics.get('admission.rejected.rate_limited') == 1
+
+    def test_chat_quota(self, admission, metrics):
+        for _ in range(3):
+            admission.job_added(1)
+        assert admission.admit(1) == adm.CHAT_QUOTA
+        assert admission.admit(1, replacing=True) is None
+        admission.job_done(1)
+        assert admission.admit(1) is None
+        assert metrics.get('jobs.pending') == 2
+
+    def test_global_cap(self, admission, metrics):
+        for chat_id in range(5):
+            admission.job_added(chat_id)
+        assert admission.admit(42) == adm.OVERLOADED
+        assert metrics.get('admission.rejected.overloaded') == 1
+
+    def test_configure(self, admission):
+        admission.configure(burst=1)
+        assert admission.admit(1) is None
+        assert admission.admit(1) == adm.RATE_LIMITED
+
+    def test_read_admission_settings(self, tmp_path, admission):
+        filename = tmp_path / 'ADMISSION.json'
+        assert adm.read_admission_settings(str(filename)) is None
+        filename.write_text('{"burst": 1, "max_pending_per_chat": 3}')
+        admission.configure(**adm.read_admission_settings(str(filename)))
+        assert admission.max_pending_per_chat == 3
+        assert admission.admit(1) is None
+        assert admission.admit(1) == adm.RATE_LIMITED
+
+    def test_prune_buckets(self, admission):
+        admission.admit(1)
+        admission._timer.return_value = 100.0
+        assert admission.prune_buckets() == 1
+
+    def test_prune_buckets_in_slices(self, admission):
+        for chat_id in range(5):
+            admission.admit(chat_id)
+        admission._timer.return_value = 100.0
+        assert [admission.prune_buckets(limit=2) for _ in range(3)] == \
+            [2, 2, 1]
+        assert admission.prune_buckets(limit=2) == 0
+
+    def test_unknown_settings_are_ignored(self, mocker, tmp_path):
+        warning = mocker.patch.object(adm, 'get_logger').return_value.warning
+        filename = tmp_path / 'ADMISSION.json'
+        filename.write_text('{"burts": 5, "rate": "fast", "burst": 5, '
+                            '"max_pending_total": -1}')
+        assert adm.read_admission_settings(str(filename)) == {'burst': 5}
+        assert warning.call_count == 3
+
+
+class TestAdmissionHandlers:
+
+    def test_rejected_set_timer(self, update, job_queue, good_timer_chat_data,
+                                get_logger, admission):
+        admission.configure(burst=0)
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        job_queue.run_once.assert_not_called()
+        update.message.reply_text.assert_called_once_with(
+            adm.REJECT_REPLIES[adm.RATE_LIMITED])
+        assert bo.LTE not in good_timer_chat_data
+
+    def test_set_and_unset_timer_counts(self, mocker, bot, update, job_queue,
+                                        good_timer_chat_data, get_logger,
+                                        admission):
+        job_queue.run_once.side_effect = (
+            lambda callback, when, context: mocker.Mock(context=context))
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        assert admission.pending(update.message.chat_id) == 1
+        bo.unset(bot, update, ['TEST LTE'], good_timer_chat_data)
+        assert admission.pending() == 0
+
+    def test_rejected_set_event(self, update, job_queue, good_event_chat_data,
+                                get_logger, admission):
+        for chat_id in range(5):
+            admission.job_added(chat_id)
+        bo.set_event(update, job_queue, good_event_chat_data)
+        job_queue.run_once.assert_not_called()
+        update.message.reply_text.assert_called_once_with(
+            adm.REJECT_REPLIES[adm.OVERLOADED])
+
+    def test_past_event_takes_no_token(self, update, job_queue,
+                                       bad_event_chat_data, get_logger,
+                                       admission):
+        admission.configure(burst=1)
+        bo.set_event(update, job_queue, bad_event_chat_data)
+        job_queue.run_once.assert_not_called()
+        assert bo.LEE not in bad_event_chat_data
+        assert admission.admit(update.message.chat_id) is None
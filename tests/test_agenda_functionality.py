@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.agenda import ChatAgenda, EVENT_DURATION, get_agenda
+from bot_organizer.scheduler import Scheduler
+
+
+@pytest.fixture(name='agenda')
+def _agenda():
+    index = get_agenda()
+    index.clear()
+    yield index
+    index.clear()
+
+
+class TestChatAgenda:
+
+    def test_between(self):
+        agenda = ChatAgenda()
+        agenda.add('long meeting', 0, 10000)
+        agenda.add('timer', 5000, 5000)
+        agenda.add('later', 20000, 23600)
+        names = [name for _, name, _ in agenda.between(4000, 6000)]
+        assert names == ['long meeting', 'timer']
+        assert agenda.between(10000, 20000) == []
+        assert [name for _, name, _ in agenda.between(20000, 20001)] == \
+            ['later']
+
+    def test_overlapping_ignores_points_and_self(self):
+        agenda = ChatAgenda()
+        agenda.add('dentist', 1000, 1000 + EVENT_DURATION)
+        agenda.add('timer', 1500, 1500)
+        agenda.add('gym', 1000 + EVENT_DURATION, 1000 + 2 * EVENT_DURATION)
+        overlaps = agenda.overlapping(1200, 1200 + EVENT_DURATION,
+                                      exclude='gym')
+        assert [name for _, name, _ in overlaps] == ['dentist']
+        assert agenda.overlapping(0, 1000) == []
+
+    def test_replace_and_remove(self):
+        agenda = ChatAgenda()
+        agenda.add('dentist', 1000, 2000)
+        agenda.add('dentist', 5000, 6000)
+        assert agenda.between(0, 3000) == []
+        assert len(agenda) == 1
+        agenda.remove('dentist')
+        agenda.remove('dentist')
+        assert len(agenda) == 0 and agenda.starts == []
+
+
+class TestAgendaHandler:
+
+    def test_overlap_warning(self, update, admission, agenda,
+                             good_event_chat_data, get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        first = dict(good_event_chat_data[bo.LEE])
+        bo.set_event(update, job_queue, good_event_chat_data)
+        update.message.reply_text.assert_called_once_with(
+            'Event TEST LEE successfully set!')
+        first[bo.NAME] = 'OTHER'
+        first[bo.DATE] += 30 * 60
+        good_event_chat_data[bo.LEE] = first
+        bo.set_event(update, job_queue, good_event_chat_data)
+        update.message.reply_text.assert_called_with(
+            'Note: it overlaps with \'TEST LEE\'.')
+
+    def test_agenda_today_and_week(self, update, admission, agenda, clock,
+                                   good_timer_chat_data, good_event_chat_data,
+                                   get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        good_event_chat_data[bo.LEE][bo.DATE] = (int(clock.time())
+                                                 + 2 * 24 * 3600)
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        bo.set_event(update, job_queue, good_event_chat_data)
+        bo.agenda(None, update, [], dict())
+        due = (clock.now() + timedelta(seconds=10)).strftime('%Y-%m-%d %H:%M')
+        update.message.reply_text.assert_called_with(f'{due} TEST LTE')
+        bo.agenda(None, update, ['week'], dict())
+        lines = update.message.reply_text.call_args[0][0].splitlines()
+        assert [line.split(' ', 2)[2] for line in lines] == \
+            ['TEST LTE', 'TEST LEE']
+
+    def test_fired_and_unset_jobs_are_dropped(self, update, admission, agenda,
+                                             clock, good_timer_chat_data,
+                                             get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        entry = dict(good_timer_chat_data[bo.LTE])
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        job_queue.advance(15)
+        assert agenda.between(42, 0, clock.time() + 3600) == []
+        good_timer_chat_data[bo.LTE] = entry
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        assert len(agenda.between(42, 0, clock.time() + 3600)) == 1
+        bo.unset(None, update, ['TEST LTE'], good_timer_chat_data)
+        assert agenda.between(42, 0, clock.time() + 3600) == []
+
+    def test_replaced_jobs_move(self, mocker, update, admission, agenda,
+                                clock, get_logger):
+        admission.configure(burst=10)
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        chat_data = {bo.LTE: {bo.NAME: 'tea', bo.DUE: 60, bo.MSG: None}}
+        bo.set_timer(update, job_queue, chat_data)
+        remove = mocker.spy(agenda, 'remove')
+        chat_data[bo.LTE] = {bo.NAME: 'tea', bo.DUE: 600, bo.MSG: None}
+        bo.set_timer(update, job_queue, chat_data)
+        update.message.text = '/new_timers 1200 tea'
+        bo.new_timers(None, update, job_queue, chat_data)
+        assert remove.call_args_list == [mocker.call(42, 'tea')] * 2
+        assert [name for _, name, _ in agenda.between(
+            42, 0, clock.time() + 3600)] == ['tea']
+        assert agenda.between(42, 0, clock.time() + 900) == []
+
+    def test_nothing_and_usage(self, update, agenda):
+        bo.agenda(None, update, [], dict())
+        update.message.reply_text.assert_called_once_with(
+            'Nothing planned for today.')
+        bo.agenda(None, update, ['month'], dict())
+        update.message.reply_text.assert_called_with(
+            'Usage: /agenda [today|week]')
@@ -0,0 +1,135 @@
+from collections import defaultdict
+from datetime import timedelta
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from bot_organizer import analytics
+from bot_organizer import bot_organizer as bo
+from bot_organizer.analytics import ScheduleColumns
+from bot_organizer.phrases import parse_when
+from bot_organizer.timezones import get_zone
+
+
+class TestScheduleColumns:
+
+    def test_from_jobs_takes_pending_alarms(self, scheduler, clock):
+        chat_data = defaultdict(dict)
+        for number, due in enumerate((30, 10, 20)):
+            scheduler.run_once(bo.alarm, due,
+                               [number, f'job {number}', 'Timer',
+                                chat_data[number], bo.SHORT_TIMER])
+        scheduler.run_once(bo.alarm, 5, [9, 'gone', '', {}, bo.BULK]) \
+            .schedule_removal()
+        scheduler.run_repeating(lambda *_: None, 60)
+        columns = ScheduleColumns.from_jobs(scheduler.jobs())
+        assert columns.chat.tolist() == [1, 2, 0]
+        assert (columns.due - clock.time()).tolist() == [10, 20, 30]
+        assert columns.kind_counts()[bo.SHORT_TIMER] == 3
+
+    def test_from_snapshot_of_version_1(self):
+        columns = ScheduleColumns.from_snapshot(
+            {'jobs': [[1, 'a', '', 100.0], [2, 'b', '', 50.0, bo.BULK]]})
+        assert columns.chat.tolist() == [2, 1]
+        assert columns.kind.tolist() == [analytics.kind_of(bo.BULK),
+                                         analytics.kind_of(bo.IMMINENT)]
+
+
+class TestAnalytics:
+
+    def test_firing_histogram(self):
+        columns = ScheduleColumns([0, 59, 60, 61, 179, 180, -1],
+                                  [1] * 7, [0] * 7)
+        counts = analytics.firing_histogram(columns, 0, 180)
+        assert counts.tolist() == [2, 2, 1]
+        assert analytics.busiest_bins(counts, top=2) == [(0, 2), (1, 2)]
+
+    def test_hot_spots(self):
+        due = [0, 100, 200, 0, 1000, 2000, 300]
+        chat = [1, 1, 1, 2, 2, 2, 1]
+        columns = ScheduleColumns(due, chat, [0] * 7)
+        assert analytics.hot_spots(columns, window=250, count=3) == {1: 2}
+        assert analytics.hot_spots(columns, window=10, count=3) == {}
+
+    def test_million_jobs(self):
+        rng = np.random.default_rng(1)
+        columns = ScheduleColumns(rng.uniform(0, 86400, 10**6),
+                                  rng.integers(0, 10**5, 10**6),
+                                  np.zeros(10**6))
+        counts = analytics.firing_histogram(columns, 0, 86400)
+        assert counts.sum() == 10**6 and len(counts) == 1440
+        assert isinstance(analytics.hot_spots(columns, 60, 3), dict)
+
+
+class TestBulkValidation:
+
+    def test_dates_match_parse_when(self, clock):
+        now = clock.now()
+        texts = [(now + timedelta(days=1)).strftime(bo.DATE_TIME_FORMAT),
+                 (now - timedelta(days=1)).strftime(bo.DATE_TIME_FORMAT),
+                 '2031-02-29 10:00:00', '2032-02-29 10:00:00',
+                 '2031-13-01 10:00:00', '2031-01-01 24:00:00',
+                 '2031-01-01T10:00:00', '2031-01-01 10:00', 'tomorrow',
+                 'tomorrow 9:00', 'in 2 hours', '2000-01-01', '']
+        zone = get_zone()
+        due, reasons = analytics.validate_dates(texts)
+        assert reasons[:2].tolist() == [analytics.VALID, analytics.PAST]
+        for text, timestamp, reason in zip(texts, due, reasons):
+            try:
+                expected = parse_when(text, clock.time(), zone)
+            except ValueError:
+                assert reason == analytics.BAD_FORMAT
+                continue
+            assert timestamp == expected
+            assert reason == (analytics.PAST if expected < clock.time()
+                              else analytics.VALID)
+
+    def test_dates_in_zone_of_chat(self, clock):
+        zone = get_zone('Asia/Tokyo')
+        texts = ['2031-01-01 10:00:00', '2031-07-01 23:59:59',
+                 'tomorrow 9:00']
+        due, reasons = analytics.validate_dates(texts, zone=zone)
+        assert reasons.tolist() == [analytics.VALID] * 3
+        assert due[:2].tolist() == [zone.parse(text, bo.DATE_TIME_FORMAT)
+                                    for text in texts[:2]]
+        assert due[2] == parse_when('tomorrow 9:00', clock.time(), zone)
+
+    def test_dates_at_dst_changes(self):
+        zone = get_zone('Europe/Warsaw')
+        texts = ['2031-03-30 02:30:00', '2031-10-26 02:30:00',
+                 '2031-10-26 03:30:00']
+        due, _ = analytics.validate_dates(texts, now=0, zone=zone)
+        assert due.tolist() == [zone.parse(text, bo.DATE_TIME_FORMAT)
+                                for text in texts]
+
+    def test_dues_match_parse_timer_args(self):
+        texts = ['15', ' 7 ', '-15', '-0', 'abc', '', '1.5', '²',
+                 '9' * 30]
+        seconds, reasons = analytics.validate_dues(texts)
+        assert seconds[:2].tolist() == [15, 7]
+        assert reasons.tolist() == [analytics.VALID, analytics.VALID,
+                                    analytics.PAST, analytics.VALID] + \
+            [analytics.BAD_FORMAT] * 5
+
+    def test_due_phrases(self):
+        seconds, reasons = analytics.validate_dues(
+            ['00:10:00', 'in 15m', '2h', 'in ten'])
+        assert seconds[:3].tolist() == [600, 900, 7200]
+        assert reasons.tolist() == [analytics.VALID] * 3 + \
+            [analytics.BAD_FORMAT]
+
+    def test_check_lines(self, clock):
+        tomorrow = (clock.now() + timedelta(days=1)).strftime(bo.DATE_TIME_FORMAT)
+        lines = [f'{tomorrow} fine', '# comment', '', '2000-01-01 10:00:00 old',
+                 'junk']
+        assert analytics.check_lines(lines) == [
+            (4, '2000-01-01 10:00:00 old', bo.PAST_DATE),
+            (5, 'junk', 'wrong format')]
+
+    def test_check_phrase_lines(self):
+        lines = ['tomorrow 9:00 dentist', 'next monday lunch',
+                 '2000-01-01 10:00 late', 'someday maybe']
+        assert analytics.check_lines(lines) == [
+            (3, '2000-01-01 10:00 late', bo.PAST_DATE),
+            (4, 'someday maybe', 'wrong format')]
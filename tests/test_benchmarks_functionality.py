@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from bot_organizer import benchmarks
+from bot_organizer.admission import get_admission
+from bot_organizer.clock import get_clock
+
+
+def record(label, results, baseline=False):
+    return {'time': 0, 'label': label, 'commit': None, 'python': '3',
+            'baseline': baseline,
+            'results': {name: {'min': value, 'median': value, 'number': 1}
+                        for name, value in results.items()}}
+
+
+@pytest.fixture(name='history')
+def _history(tmp_path):
+    return str(tmp_path / 'benchmarks.jsonl')
+
+
+class TestBenchmarks:
+
+    def test_every_hot_path_runs(self, clock):
+        shared = get_admission()
+        results = benchmarks.run_all(number=3, rounds=1)
+        assert list(results) == list(benchmarks.BENCHMARKS)
+        assert all(result['min'] > 0 for result in results.values())
+        assert get_clock() is clock
+        assert get_admission() is shared
+
+    def test_run_appends_history(self, history):
+        assert benchmarks.main(['--history', history, 'run', 'timer_due',
+                                '--number', '2', '--rounds', '1',
+                                '--label', 'first', '--baseline']) == 0
+        benchmarks.main(['--history', history, 'run', 'timer_due',
+                         '--number', '2', '--rounds', '1'])
+        records = benchmarks.read_history(history)
+        assert [entry['baseline'] for entry in records] == [True, False]
+        assert list(records[0]['results']) == ['timer_due']
+
+    def test_compare_thresholds(self):
+        rows = benchmarks.compare({'unset': {'min': 10.0},
+                                   'alarm': {'min': 10.0}},
+                                  {'unset': {'min': 12.0},
+                                   'alarm': {'min': 14.0},
+                                   'new': {'min': 1.0}})
+        assert [(name, slower) for name, _, _, _, slower in rows] == \
+            [('unset', False), ('alarm', True)]
+        assert benchmarks.compare({'unset': {'min': 10.0}},
+                                  {'unset': {'min': 12.0}},
+                                  threshold=0.1)[0][4]
+
+    def test_compare_fails_on_regression(self, history):
+        with open(history, 'w', encoding='utf-8') as file:
+            for entry in (record('old', {'unset': 5.0}),
+                          record('master', {'unset': 10.0}, baseline=True),
+                          record('change', {'unset': 11.0})):
+                file.write(json.dumps(entry) + '\n')
+        assert benchmarks.main(['--history', history, 'compare']) == 0
+        assert benchmarks.main(['--history', history, 'compare',
+                                '--baseline', 'old']) == 1
+        assert benchmarks.main(['--history', history, 'compare',
+                                '--threshold', '0.05']) == 1
+
+    def test_pick_baseline(self):
+        records = [record('a', {}), record('b', {})]
+        assert benchmarks.pick_baseline(records)['label'] == 'a'
+        assert benchmarks.pick_baseline(records, 'b')['label'] == 'b'
+        assert benchmarks.pick_baseline(records, 'c') is None
+        assert benchmarks.pick_baseline([]) is None
@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import admission as adm
+
+
+class TestParseBulk:
+
+    def test_parse_timers(self):
+        entries, rejected = bo.parse_bulk('10 tea\n\n# comment\nx coffee\n'
+                                          '-5 late\n20 tea again',
+                                          bo.parse_timer_args)
+        assert [entry[bo.DUE] for _, _, entry in entries] == [10]
+        assert [(number, reason) for number, _, reason in rejected] == [
+            (4, f'timer due must be like {bo.DUE_EXAMPLES}'),
+            (5, bo.PAST_DATE),
+            (6, 'name already used above')]
+
+    def test_parse_events(self, clock):
+        date_time = clock.now() + timedelta(days=1)
+        good = date_time.strftime(bo.DATE_TIME_FORMAT)
+        entries, rejected = bo.parse_bulk(f'{good} dentist city centre\n'
+                                          f'{good}\n'
+                                          '2000-01-01 10:00:00 old',
+                                          bo.parse_event_args)
+        assert len(entries) == 1
+        assert entries[0][2][bo.LOC] == 'city'
+        assert [reason for _, _, reason in rejected] == [
+            'event name is missing', bo.PAST_DATE]
+
+    def test_too_many_lines(self, mocker):
+        mocker.patch.object(bo, 'MAX_BULK_LINES', 2)
+        entries, rejected = bo.parse_bulk('1 a\n2 b\n3 c', bo.parse_timer_args)
+        assert len(entries) == 2
+        assert len(rejected) == 1
+
+
+class TestBulkHandlers:
+
+    def test_new_timers(self, bot, update, scheduler, admission, get_logger):
+        chat_data = dict()
+        update.message.text = '/new_timers 10 tea\n20 coffee hot!\nx bad'
+        bo.new_timers(bot, update, scheduler, chat_data)
+        assert len(scheduler.jobs()) == 2
+        assert {'tea_job', 'coffee_job'} <= set(chat_data)
+        assert admission.pending(update.message.chat_id) == 2
+        update.message.reply_text.assert_called_once()
+        reply = update.message.reply_text.call_args[0][0]
+        assert reply.startswith('2 timer(s) successfully set!')
+        assert '3: x bad' in reply
+        assert [job.context[4] for job in scheduler.jobs()] == \
+            [bo.SHORT_TIMER, bo.SHORT_TIMER]
+        assert scheduler.advance(30) == 2
+
+    def test_new_events(self, bot, update, scheduler, admission, get_logger,
+                        clock):
+        date_time = (clock.now() + timedelta(hours=1)).strftime(
+            bo.DATE_TIME_FORMAT)
+        update.message.text = (f'/new_events\n{date_time} a\n'
+                               f'{date_time} b place message')
+        chat_data = dict()
+        bo.new_events(bot, update, scheduler, chat_data)
+        assert len(scheduler.jobs()) == 2
+        assert chat_data['b_job'].context[2].endswith('Message: message')
+        assert chat_data['a_job'].context[4] == bo.IMMINENT
+
+    def test_replaces_existing(self, bot, update, scheduler, admission,
+                               get_logger):
+        chat_data = dict()
+        update.message.text = '/new_timers 10 tea'
+        bo.new_timers(bot, update, scheduler, chat_data)
+        old_job = chat_data['tea_job']
+        update.message.text = '/new_timers 20 tea'
+        bo.new_timers(bot, update, scheduler, chat_data)
+        assert old_job.removed
+        assert scheduler.jobs() == (chat_data['tea_job'],)
+        assert admission.pending() == 1
+
+    def test_chat_quota(self, bot, update, scheduler, admission, get_logger):
+        update.message.text = '/new_timers\n' + '\n'.join(
+            f'{i + 1} t{i}' for i in range(5))
+        bo.new_timers(bot, update, scheduler, dict())
+        assert len(scheduler.jobs()) == 3
+        reply = update.message.reply_text.call_args[0][0]
+        assert reply.count('too many active reminders') == 2
+
+    def test_rate_limited(self, bot, update, scheduler, admission, get_logger):
+        admission.configure(burst=0)
+        update.message.text = '/new_timers 10 tea'
+        bo.new_timers(bot, update, scheduler, dict())
+        assert scheduler.jobs() == ()
+        update.message.reply_text.assert_called_once_with(
+            adm.REJECT_REPLIES[adm.RATE_LIMITED])
+
+    def test_empty(self, bot, update, scheduler, admission, get_logger):
+        update.message.text = '/new_timers'
+        bo.new_timers(bot, update, scheduler, dict())
+        update.message.reply_text.assert_called_once_with(bo.BULK_USAGE)
+
+    def test_bulk_file(self, mocker, update, scheduler, admission, get_logger):
+        bot = mocker.Mock()
+        bot.get_file.return_value.download_as_bytearray.return_value = \
+            bytearray(b'10 tea\n20 coffee')
+        update.message.document.file_size = 16
+        update.message.caption = '/new_timers'
+        bo.bulk_file(bot, update, scheduler, dict())
+        assert len(scheduler.jobs()) == 2
+
+    def test_run_once_many(self, mocker, scheduler):
+        callback = mocker.Mock()
+        scheduler.run_once(callback, 15, context='single')
+        jobs = scheduler.run_once_many(callback, [(30, 'c'), (10, 'a'),
+                                                  (20, 'b')])
+        assert [job.context for job in jobs] == ['c', 'a', 'b']
+        scheduler.advance(60)
+        assert [call[0][1].context for call in callback.call_args_list] == [
+            'a', 'single', 'b', 'c']
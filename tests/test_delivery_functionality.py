@@ -0,0 +1,107 @@
+import time
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import delivery as bo_delivery
+from bot_organizer.delivery import DeliveryQueue
+
+
+class TestDeliveryQueue:
+
+    def _queue(self, mocker):
+        return DeliveryQueue(mocker.Mock(), workers=0)
+
+    def test_weighted_order(self, mocker, metrics):
+        delivery = self._queue(mocker)
+        for number in range(20):
+            delivery.submit(bo_delivery.BULK, 1, f'bulk {number}')
+        for number in range(8):
+            delivery.submit(bo_delivery.SHORT_TIMER, 2, f'timer {number}')
+        while delivery.step():
+            pass
+        texts = [call[0][1] for call in delivery.send.call_args_list]
+        # short timers get 8 of every 9 sends while both classes wait
+        assert texts[:9].count('bulk 0') == 1
+        assert [text for text in texts[:9] if text.startswith('timer')] == \
+            [f'timer {number}' for number in range(8)]
+        assert len(texts) == 28
+        assert len(delivery) == 0
+        assert metrics.get('delivery.bulk.lateness.count') == 20
+
+    def test_stale_items_are_merged(self, mocker, clock, metrics):
+        delivery = self._queue(mocker)
+        for number in range(3):
+            delivery.submit(bo_delivery.BULK, 1, f'bulk {number}')
+        delivery.submit(bo_delivery.BULK, 2, 'other chat')
+        clock.advance(10 * 60)
+        assert delivery.step()
+        delivery.send.assert_called_once_with(
+            1, 'Sorry, these 3 reminders are late:\n\nbulk 0\n\nbulk 1\n\nbulk 2')
+        assert len(delivery) == 1
+        assert delivery.step()
+        delivery.send.assert_called_with(2, 'other chat')
+        assert metrics.get('delivery.bulk.merged') == 2
+        assert metrics.get('delivery.bulk.lateness.max') == 10 * 60
+
+    def test_very_late_items_are_dropped(self, mocker, clock, metrics):
+        logger = mocker.patch('bot_organizer.delivery.get_logger')
+        delivery = self._queue(mocker)
+        delivery.submit(bo_delivery.BULK, 1, 'bulk')
+        delivery.submit(bo_delivery.IMMINENT, 1, 'event')
+        clock.advance(7 * 3600)
+        while delivery.step():
+            pass
+        delivery.send.assert_called_once_with(1, 'event')
+        assert metrics.get('delivery.bulk.dropped') == 1
+        logger.return_value.warning.assert_called_once()
+
+    def test_send_error_does_not_stop_queue(self, mocker, metrics):
+        delivery = self._queue(mocker)
+        delivery.send.side_effect = [RuntimeError('network'), None]
+        mocker.patch('bot_organizer.delivery.get_logger')
+        delivery.submit(bo_delivery.IMMINENT, 1, 'first')
+        delivery.submit(bo_delivery.IMMINENT, 1, 'second')
+        assert delivery.step() and delivery.step()
+        assert metrics.get('delivery.imminent.failed') == 1
+        assert delivery.send.call_count == 2
+
+    def test_workers_drain(self, mocker, metrics):
+        send = mocker.Mock()
+        delivery = DeliveryQueue(send, workers=2)
+        for number in range(50):
+            delivery.submit(bo_delivery.DIGEST, number, 'digest')
+        assert delivery.drain(time.monotonic() + 5)
+        delivery.stop()
+        assert send.call_count == 50
+
+    def test_batch_queues_at_exit(self, mocker, metrics):
+        delivery = self._queue(mocker)
+        with delivery.batch():
+            delivery.submit(bo_delivery.IMMINENT, 1, 'first')
+            with delivery.batch():
+                delivery.submit(bo_delivery.BULK, 2, 'second')
+            assert len(delivery) == 0
+        assert len(delivery) == 2
+        assert metrics.get('delivery.imminent.queued') == 1
+        while delivery.step():
+            pass
+        assert [call[0][1] for call in delivery.send.call_args_list] == \
+            ['first', 'second']
+
+
+class TestAlarmDelivery:
+
+    def test_alarm_submits_with_priority(self, mocker, admission):
+        delivery = mocker.patch('bot_organizer.bot_organizer.get_delivery')()
+        bot = mocker.Mock()
+        chat_data = dict()
+        job = mocker.Mock(due=100.0)
+        job.context = [1, 'tea', 'Timer: tea', chat_data, bo.SHORT_TIMER]
+        chat_data['tea_job'] = job
+        bo.alarm(bot, job)
+        delivery.submit.assert_called_once_with(bo.SHORT_TIMER, 1,
+                                                'Timer: tea', due=100.0)
+        bot.send_message.assert_not_called()
+
+    def test_timer_priority(self):
+        assert bo.timer_priority(60) == bo.SHORT_TIMER
+        assert bo.timer_priority(bo.SHORT_TIMER_MAX + 1) == bo.IMMINENT
@@ -0,0 +1,137 @@
+from collections import defaultdict
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import failover
+from bot_organizer.digest import (DAILY, HOURLY, DigestJob, get_digest,
+                                  slot_start)
+from bot_organizer.scheduler import Scheduler
+from bot_organizer.timezones import get_zone
+
+
+@pytest.fixture(name='digest')
+def _digest(admission):
+    admission.configure(burst=10, max_pending_per_chat=10,
+                        max_pending_total=10)
+    buffer = get_digest()
+    buffer.clear()
+    yield buffer
+    buffer.clear()
+
+
+def set_timers(update, job_queue, chat_data, dues):
+    for number, due in enumerate(dues):
+        chat_data[bo.LTE] = {bo.NAME: f'tea {number}', bo.DUE: due,
+                             bo.MSG: None}
+        bo.set_timer(update, job_queue, chat_data)
+
+
+class TestSlots:
+
+    def test_slot_start(self):
+        zone = get_zone('Europe/Warsaw')
+        due = zone.parse('2030-01-02 13:45:10', bo.DATE_TIME_FORMAT)
+        assert zone.format(slot_start(due, HOURLY, zone),
+                           bo.DATE_TIME_FORMAT) == '2030-01-02 13:00:00'
+        assert zone.format(slot_start(due, DAILY, zone),
+                           bo.DATE_TIME_FORMAT) == '2030-01-02 08:00:00'
+        early = zone.parse('2030-01-02 07:00:00', bo.DATE_TIME_FORMAT)
+        assert zone.format(slot_start(early, DAILY, zone),
+                           bo.DATE_TIME_FORMAT) == '2030-01-01 08:00:00'
+
+
+class TestDigest:
+
+    def test_one_message_per_slot(self, mocker, update, clock, digest,
+                                  get_logger):
+        bot = mocker.Mock()
+        job_queue = Scheduler(bot=bot)
+        chat_data = dict()
+        bo.digest_mode(None, update, ['hourly'], job_queue, chat_data)
+        set_timers(update, job_queue, chat_data, [4000, 4500, 300])
+        # two jobs: the digest of the slot and the short timer
+        assert len(job_queue.jobs()) == 2
+        assert len(digest) == 2
+        start = slot_start(int(clock.time()) + 4000, HOURLY, bo.chat_zone(
+            chat_data))
+        job_queue.advance(start - clock.time() - 1)
+        bot.send_message.assert_called_with(update.message.chat_id,
+                                            text='Timer: tea 2')
+        assert bot.send_message.call_count == 1
+        job_queue.advance(1)
+        text = bot.send_message.call_args[1]['text']
+        assert text.startswith('Digest of 2 upcoming reminders:')
+        assert 'Timer: tea 0' in text and 'Timer: tea 1' in text
+        assert not any(key.endswith(bo.JOB_STR_END) for key in chat_data)
+        assert len(digest) == 0
+
+    def test_unset_last_removes_slot(self, update, digest, get_logger):
+        job_queue = Scheduler()
+        chat_data = {bo.DIGEST_MODE: DAILY}
+        set_timers(update, job_queue, chat_data, [2 * 24 * 3600])
+        handle = chat_data['tea 0' + bo.JOB_STR_END]
+        assert isinstance(handle, DigestJob)
+        assert handle.context[4] == bo.IMMINENT
+        bo.unset(None, update, ['tea 0'], chat_data)
+        assert handle.removed
+        assert job_queue.jobs() == ()
+
+    def test_off_sends_alone_again(self, update, clock, digest, get_logger):
+        job_queue = Scheduler()
+        chat_data = {bo.DIGEST_MODE: HOURLY}
+        set_timers(update, job_queue, chat_data, [4000])
+        bo.digest_mode(None, update, ['off'], job_queue, chat_data)
+        job = chat_data['tea 0' + bo.JOB_STR_END]
+        assert job.callback is bo.alarm
+        assert job.context[4] == bo.IMMINENT
+        assert job.due == int(clock.time()) + 4000
+        assert job_queue.jobs() == (job,)
+        bo.digest_mode(None, update, ['weekly'], job_queue, chat_data)
+        update.message.reply_text.assert_called_with(
+            'Your digest: off\nUsage: /digest <hourly|daily|off>')
+
+    def test_snapshot_keeps_digest(self, mocker, update, clock, digest,
+                                   get_logger):
+        update.message.chat_id = 42
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = defaultdict(dict)
+        dispatcher.chat_data[42][bo.DIGEST_MODE] = DAILY
+        set_timers(update, Scheduler(), dispatcher.chat_data[42],
+                   [2 * 24 * 3600])
+        snapshot = bo.make_snapshot(dispatcher, Scheduler())
+        assert snapshot['chats'] == {42: {bo.DIGEST_MODE: DAILY}}
+        assert snapshot['jobs'][0][4] == bo.IMMINENT
+        digest.clear()
+
+        restored = mocker.Mock()
+        restored.chat_data = defaultdict(dict)
+        bo.restore_snapshot(snapshot, restored, Scheduler())
+        handle = restored.chat_data[42]['tea 0' + bo.JOB_STR_END]
+        assert get_digest().jobs() == (handle,)
+
+    def test_journal_keeps_priority(self, mocker, update, digest, tmp_path,
+                                    get_logger):
+        update.message.chat_id = 42
+        journal = failover.Journal(str(tmp_path / 'journal.log'))
+        mocker.patch.object(failover, 'get_journal', return_value=journal)
+        chat_data = {bo.DIGEST_MODE: DAILY}
+        set_timers(update, Scheduler(), chat_data, [2 * 24 * 3600])
+        journal.close()
+        record = journal.live[(42, 'tea 0')]
+        assert record['priority'] == bo.IMMINENT
+        digest.clear()
+
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = defaultdict(dict)
+        dispatcher.chat_data[42][bo.DIGEST_MODE] = DAILY
+        bo.journal_applier(dispatcher, Scheduler())(failover.ADD, record)
+        handle = dispatcher.chat_data[42]['tea 0' + bo.JOB_STR_END]
+        assert get_digest().jobs() == (handle,)
+
+    def test_long_digest_is_split(self):
+        lines = [f'12:00 Timer: {"x" * 1000}'] * 9
+        messages = bo.digest_messages(lines)
+        assert len(messages) == 3
+        assert all(len(text) <= bo.MAX_MESSAGE_LENGTH for text in messages)
+        assert sum(text.count('Timer:') for text in messages) == 9
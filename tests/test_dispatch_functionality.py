@@ -0,0 +1,109 @@
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import Dispatcher, Filters, MessageHandler
+
+from bot_organizer import dispatch
+from bot_organizer.dispatch import ChatExecutor
+
+
+def text_update(update_id, chat_id, text):
+    return Update(update_id, message=Message(
+        update_id, User(chat_id, 'Test', False), datetime(2030, 1, 1),
+        Chat(chat_id, 'private'), text=text))
+
+
+class TestChatExecutor:
+
+    def test_order_within_key(self, metrics):
+        executor = ChatExecutor(workers=4)
+        seen = {key: [] for key in range(5)}
+        running = set()
+        overlaps = []
+
+        def task(key, number):
+            if key in running:
+                overlaps.append(key)
+            running.add(key)
+            time.sleep(random.random() / 10000)
+            seen[key].append(number)
+            running.discard(key)
+
+        for number in range(100):
+            for key in seen:
+                executor.submit(key, task, key, number)
+        assert executor.drain(time.monotonic() + 10)
+        executor.stop()
+        assert overlaps == []
+        assert all(numbers == list(range(100)) for numbers in seen.values())
+        assert metrics.get('dispatch.handled') == 500
+
+    def test_keys_run_in_parallel(self):
+        executor = ChatExecutor(workers=4)
+        started = time.monotonic()
+        for key in range(4):
+            executor.submit(key, time.sleep, 0.2)
+        assert executor.drain(time.monotonic() + 5)
+        executor.stop()
+        assert time.monotonic() - started < 0.6
+
+    def test_slow_chat_does_not_block_others(self):
+        executor = ChatExecutor(workers=2)
+        release = threading.Event()
+        done = []
+        executor.submit('slow', release.wait, 5)
+        executor.submit('slow', done.append, 'slow')
+        for number in range(10):
+            executor.submit('fast', done.append, number)
+        deadline = time.monotonic() + 5
+        while len(done) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert done == list(range(10))
+        release.set()
+        assert executor.drain(time.monotonic() + 5)
+        assert done[-1] == 'slow'
+        executor.stop()
+
+    def test_failing_task_does_not_stop_key(self, mocker):
+        mocker.patch('bot_organizer.dispatch.get_logger')
+        executor = ChatExecutor(workers=0)
+        done = []
+        executor.submit(1, lambda: 1 / 0)
+        executor.submit(1, done.append, 'next')
+        while executor.step():
+            pass
+        assert done == ['next'] and len(executor) == 0
+
+
+class TestParallelDispatch:
+
+    def test_chat_data_sees_updates_in_order(self, mocker):
+        dispatcher = Dispatcher(mocker.Mock(), queue.Queue(), workers=0)
+
+        def handle(_bot, update, chat_data):
+            time.sleep(random.random() / 10000)
+            chat_data.setdefault('seen', []).append(update.message.text)
+
+        dispatcher.add_handler(MessageHandler(Filters.text, handle,
+                                              pass_chat_data=True))
+        executor = dispatch.install(dispatcher, workers=4)
+        for number in range(50):
+            for chat_id in (1, 2, 3):
+                dispatcher.process_update(
+                    text_update(number * 3 + chat_id, chat_id, str(number)))
+        assert executor.drain(time.monotonic() + 10)
+        executor.stop()
+        for chat_id in (1, 2, 3):
+            assert dispatcher.chat_data[chat_id]['seen'] == \
+                [str(number) for number in range(50)]
+
+    def test_errors_without_chat_are_handled_inline(self, mocker):
+        process_update = mocker.Mock()
+        executor = mocker.Mock()
+        dispatch.ParallelDispatch(process_update, executor)(object())
+        process_update.assert_called_once()
+        executor.submit.assert_not_called()
@@ -42,7 +42,7 @@ class TestEventHandlers:
         bad_format_date_update.message.reply_text.assert_called_once()
 
     def test_skip_event_loc(self, bot, update, event_chat_data, get_logger):
-        return_val = bo.skip_event_loc(bot, update)
+        return_val = bo.skip_event_loc(bot, update, event_chat_data)
         assert return_val == bo.EVENT_MSG
         get_logger.info.assert_called_once()
         update.message.reply_text.assert_called_once()
@@ -106,7 +106,7 @@ class TestEventSet():
         bo.set_event(update, job_queue, good_event_chat_data)
         get_logger.info.assert_called_once()
         update.message.reply_text.assert_called_once()
-        job_queue.run_once.assert_called_once()
+        job_queue.run_at.assert_called_once()
         assert bo.LEE not in good_event_chat_data
 
     def test_bad_set_event(self, update, job_queue,
@@ -0,0 +1,149 @@
+from collections import defaultdict
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import failover
+from bot_organizer.failover import Journal, JournalTail, Lease
+from bot_organizer.scheduler import Scheduler
+
+
+@pytest.fixture(name='journal_file')
+def _journal_file(tmp_path):
+    return str(tmp_path / 'journal.log')
+
+
+class TestLease:
+
+    def test_only_one_holder(self, tmp_path):
+        filename = str(tmp_path / 'lease.lock')
+        active, standby = Lease(filename), Lease(filename)
+        assert active.try_acquire()
+        assert not standby.try_acquire()
+        active.release()
+        assert standby.try_acquire() and standby.held
+        standby.release()
+
+
+class TestJournal:
+
+    def _tail(self, journal_file):
+        changes = []
+        tail = JournalTail(journal_file,
+                           lambda op, record: changes.append(
+                               (op, record['name'])))
+        return tail, changes
+
+    def test_tail_follows_changes(self, journal_file):
+        journal = Journal(journal_file)
+        tail, changes = self._tail(journal_file)
+        journal.added(1, 'tea', 'Timer: tea', 100.0, bo.SHORT_TIMER)
+        journal.added(1, 'gym', 'Event: gym', 200.0, bo.IMMINENT)
+        assert tail.poll() == 2
+        journal.removed(1, 'tea')
+        journal.fired(1, 'gym')
+        journal.fired(1, 'unknown')
+        tail.poll()
+        assert changes == [(failover.ADD, 'tea'), (failover.ADD, 'gym'),
+                           (failover.REMOVE, 'tea'), (failover.REMOVE, 'gym')]
+        assert tail.live == {}
+        journal.close()
+        tail.close()
+
+    def test_half_written_line_waits(self, journal_file):
+        journal = Journal(journal_file)
+        tail, changes = self._tail(journal_file)
+        line = failover.encode({'op': failover.ADD, 'chat': 1, 'name': 'tea',
+                                'message': '', 'due': 1.0, 'priority': ''})
+        with open(journal_file, 'ab') as file:
+            file.write(line[:10])
+            file.flush()
+            tail.poll()
+            assert changes == []
+            file.write(line[10:])
+        tail.poll()
+        assert changes == [(failover.ADD, 'tea')]
+        journal.close()
+        tail.close()
+
+    def test_compaction_is_diffed(self, journal_file):
+        journal = Journal(journal_file, compact_bytes=300)
+        tail, changes = self._tail(journal_file)
+        journal.added(1, 'keep', 'Timer: keep', 100.0, bo.SHORT_TIMER)
+        tail.poll()
+        for number in range(10):
+            journal.added(1, f'job {number}', 'Timer', 100.0, bo.BULK)
+            journal.removed(1, f'job {number}')
+        journal.added(1, 'new', 'Timer: new', 100.0, bo.SHORT_TIMER)
+        tail.poll()
+        # nothing of the compacted churn is applied twice or lost
+        assert set(tail.live) == {(1, 'keep'), (1, 'new')}
+        assert changes.count((failover.ADD, 'keep')) == 1
+        assert (failover.ADD, 'new') in changes
+        journal.close()
+        tail.close()
+
+
+class TestTakeover:
+
+    def _process(self, mocker):
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = defaultdict(dict)
+        job_queue = Scheduler(bot=mocker.Mock())
+        return dispatcher, job_queue
+
+    def test_standby_fires_gap_alarms_once(self, mocker, update, admission,
+                                           good_timer_chat_data, clock,
+                                           journal_file, get_logger):
+        journal = Journal(journal_file)
+        mocker.patch('bot_organizer.failover.get_journal',
+                     return_value=journal)
+        update.message.chat_id = 42
+        active_dispatcher, active_queue = self._process(mocker)
+        active_dispatcher.chat_data[42] = good_timer_chat_data
+        entry = dict(good_timer_chat_data[bo.LTE])
+        bo.set_timer(update, active_queue, good_timer_chat_data)
+        entry[bo.NAME], entry[bo.DUE] = 'later', 60
+        good_timer_chat_data[bo.LTE] = entry
+        bo.set_timer(update, active_queue, good_timer_chat_data)
+
+        standby_dispatcher, standby_queue = self._process(mocker)
+        tail = JournalTail(journal_file,
+                           bo.journal_applier(standby_dispatcher,
+                                              standby_queue))
+        tail.poll()
+        assert set(standby_dispatcher.chat_data[42]) == {'TEST LTE_job',
+                                                         'later_job'}
+
+        # active fires the first timer, then dies before the second one
+        active_queue.advance(15)
+        active_queue.bot.send_message.assert_called_once()
+        clock.advance(120)
+        tail.poll()
+        assert set(standby_dispatcher.chat_data[42]) == {'later_job'}
+
+        assert standby_queue.advance(0) == 1
+        standby_queue.bot.send_message.assert_called_once_with(
+            42, text=mocker.ANY)
+        assert 'later' in standby_queue.bot.send_message.call_args[1]['text']
+        journal.close()
+        tail.close()
+
+    def test_follow_waits_for_lease(self, mocker, tmp_path, journal_file):
+        active = Lease(str(tmp_path / 'lease.lock'))
+        active.try_acquire()
+        standby = Lease(str(tmp_path / 'lease.lock'))
+        tail = mocker.Mock()
+        mocker.patch('bot_organizer.failover.get_logger')
+        polls = []
+
+        def sleep(_seconds):
+            polls.append(1)
+            if len(polls) == 3:
+                active.release()
+
+        failover.follow(tail, standby, sleep=sleep)
+        assert standby.held
+        # one more poll after taking the lease reads the journal to its end
+        assert tail.poll.call_count == 5
+        standby.release()
@@ -0,0 +1,169 @@
+import json
+import os
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import history as bo_history
+from bot_organizer.history import HistoryLog, HistoryReader
+from bot_organizer.scheduler import Scheduler
+
+DAY = 24 * 3600
+
+
+@pytest.fixture(name='history_log')
+def _history_log(mocker, tmp_path):
+    log = HistoryLog(str(tmp_path / 'history'))
+    mocker.patch('bot_organizer.history.get_history', return_value=log)
+    mocker.patch('bot_organizer.bot_organizer.get_history', return_value=log)
+    yield log
+    log.close()
+
+
+class TestHistoryLog:
+
+    def test_records_are_fixed_width(self, history_log, clock):
+        history_log.record(bo_history.FIRED, 1, 'tea', 2.5, 'short_timer')
+        history_log.record(bo_history.FIRED, 1, 'a much longer name ' * 10)
+        history_log.record(bo_history.CANCELLED, -100123, 'tea')
+        day = bo_history.day_of(clock.time())
+        size = os.path.getsize(os.path.join(history_log.directory,
+                                            f'{day}.rec'))
+        assert size == 3 * bo_history.RECORD_SIZE == 96
+        # 'tea' is stored once
+        assert bo_history.read_strings(os.path.join(
+            history_log.directory, f'{day}.str')).count('tea') == 1
+
+    def test_rotated_by_day(self, history_log, clock):
+        history_log.record(bo_history.FIRED, 1, 'today')
+        clock.advance(DAY)
+        history_log.record(bo_history.FIRED, 1, 'tomorrow')
+        reader = HistoryReader(history_log.directory)
+        assert len(reader.days()) == 2
+        assert [entry.name for entry in reader.query()] == ['today',
+                                                            'tomorrow']
+
+    def test_query_by_chat_and_time(self, history_log, clock):
+        start = clock.time()
+        for number in range(100):
+            history_log.record(bo_history.FIRED, number % 3, f'job {number}')
+            clock.advance(3600)
+        reader = HistoryReader(history_log.directory)
+        entries = list(reader.query(chat_id=1, since=start + 10 * 3600,
+                                    until=start + 40 * 3600))
+        assert [entry.name for entry in entries] == \
+            [f'job {number}' for number in range(10, 40) if number % 3 == 1]
+        assert all(entry.kind == bo_history.FIRED for entry in entries)
+
+    def test_recent_newest_first(self, history_log, clock):
+        for number in range(5):
+            history_log.record(bo_history.FIRED, 7, f'job {number}')
+            history_log.record(bo_history.FIRED, 8, 'other')
+            clock.advance(DAY)
+        entries = HistoryReader(history_log.directory).recent(7, 3)
+        assert [entry.name for entry in entries] == ['job 4', 'job 3', 'job 2']
+
+    def test_recent_indexes_new_records(self, mocker, history_log, clock):
+        reader = history_log.reader
+        for number in range(50):
+            history_log.record(bo_history.FIRED, number % 5, f'job {number}')
+        assert [entry.name for entry in reader.recent(3, 2)] == ['job 48',
+                                                               'job 43']
+        history_log.record(bo_history.FIRED, 3, 'job 50')
+        chat_at = mocker.spy(bo_history.DayFile, 'chat_at')
+        assert [entry.name for entry in reader.recent(3, 2)] == ['job 50',
+                                                               'job 48']
+        # only the new record is looked at
+        assert chat_at.call_count == 1
+        assert reader.recent(3, 0) == []
+        assert [entry.name for entry in reader.query(chat_id=3)][-1] == \
+            'job 50'
+
+    def test_old_day_indexes_are_dropped(self, history_log, clock):
+        reader = history_log.reader
+        for number in range(bo_history.MAX_DAYS + 10):
+            history_log.record(bo_history.FIRED, 1, f'job {number}')
+            clock.advance(DAY)
+        assert len(list(reader.query(chat_id=1))) == bo_history.MAX_DAYS + 10
+        assert sorted(reader._indexes) == \
+            reader.days()[-bo_history.MAX_DAYS:]
+        assert [entry.name for entry in reader.recent(1, 1)] == \
+            [f'job {bo_history.MAX_DAYS + 9}']
+
+    def test_long_name_is_cut_between_characters(self, history_log, clock):
+        name = 'ł' * bo_history.MAX_STRING
+        history_log.record(bo_history.FIRED, 1, name)
+        entry, = HistoryReader(history_log.directory).query()
+        assert len(entry.name.encode('utf-8')) == bo_history.MAX_STRING - 1
+        assert name.startswith(entry.name)
+
+    def test_clock_is_read_under_lock(self, mocker, history_log, clock):
+        lock = mocker.MagicMock()
+        history_log._lock = lock
+        times = []
+        mocker.patch.object(clock, 'time', side_effect=lambda: times.append(
+            lock.__enter__.called) or 0.0)
+        history_log.record(bo_history.FIRED, 1, 'tea')
+        assert times == [True]
+
+    def test_torn_record_is_dropped(self, history_log, clock):
+        history_log.record(bo_history.FIRED, 1, 'tea')
+        history_log.close()
+        day = bo_history.day_of(clock.time())
+        with open(os.path.join(history_log.directory, f'{day}.rec'),
+                  'ab') as file:
+            file.write(b'\0' * 5)
+        history_log.record(bo_history.FIRED, 1, 'coffee')
+        entries = list(HistoryReader(history_log.directory).query())
+        assert [entry.name for entry in entries] == ['tea', 'coffee']
+
+    def test_offline_tool(self, history_log, capsys):
+        history_log.record(bo_history.FIRED, 42, 'tea', 1.0, 'imminent')
+        history_log.record(bo_history.FIRED, 43, 'coffee')
+        assert bo_history.main([history_log.directory, '--chat', '42',
+                                '--json']) == 0
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['name'] == 'tea'
+
+
+class TestHistoryHandlers:
+
+    def test_fired_and_cancelled_jobs(self, update, admission, history_log,
+                                      good_timer_chat_data, get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        entry = dict(good_timer_chat_data[bo.LTE])
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        bo.unset(None, update, ['TEST LTE'], good_timer_chat_data)
+        good_timer_chat_data[bo.LTE] = entry
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        job_queue.advance(15)
+        reader = HistoryReader(history_log.directory)
+        entries = list(reader.query(chat_id=42))
+        assert [(entry.name, entry.kind, entry.priority)
+                for entry in entries] == [
+            ('TEST LTE', bo_history.CANCELLED, bo.SHORT_TIMER),
+            ('TEST LTE', bo_history.FIRED, bo.SHORT_TIMER)]
+
+    def test_history_command(self, update, history_log):
+        update.message.chat_id = 42
+        history_log.record(bo_history.FIRED, 42, 'tea', lateness=30)
+        history_log.record(bo_history.CANCELLED, 42, 'coffee')
+        bo.history(None, update, [], dict())
+        reply = update.message.reply_text.call_args[0][0]
+        lines = reply.splitlines()
+        assert lines[0].endswith('cancelled coffee')
+        assert lines[1].endswith('fired tea (30s late)')
+
+    def test_history_command_bad_count(self, update, history_log):
+        bo.history(None, update, ['zero'], dict())
+        update.message.reply_text.assert_called_once_with(
+            'Usage: /history [count]')
+
+    def test_history_off(self, mocker, update):
+        mocker.patch('bot_organizer.bot_organizer.get_history',
+                     return_value=None)
+        bo.history(None, update, [], dict())
+        update.message.reply_text.assert_called_once_with(
+            'Sorry, history is turned off.')
@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import lifecycle
+from bot_organizer.scheduler import Scheduler
+
+
+class TestSnapshot:
+
+    def test_make_and_restore_snapshot(self, mocker, update, admission,
+                                       good_timer_chat_data, get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = defaultdict(dict)
+        dispatcher.chat_data[42] = good_timer_chat_data
+        good_timer_chat_data['language'] = 'pl'
+        good_timer_chat_data[bo.LTE][bo.DUE] = 600
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+
+        snapshot = bo.make_snapshot(dispatcher, job_queue)
+        assert snapshot['chats'] == {42: {'language': 'pl'}}
+        chat_id, name, message, due, priority = snapshot['jobs'][0]
+        assert (chat_id, name, priority) == (42, 'TEST LTE', bo.SHORT_TIMER)
+
+        restored_queue = Scheduler()
+        restored = mocker.Mock()
+        restored.chat_data = defaultdict(dict)
+        bo.restore_snapshot(snapshot, restored, restored_queue)
+        job = restored.chat_data[42]['TEST LTE_job']
+        assert job.context[:3] == [42, 'TEST LTE', message]
+        assert restored.chat_data[42]['language'] == 'pl'
+        assert abs(job.next_t.timestamp() - due) < 1
+
+    def test_restore_snapshot_without_priority(self, mocker, clock,
+                                               admission):
+        snapshot = {'version': 1, 'chats': {},
+                    'jobs': [[42, 'tea', 'Timer: tea', clock.time() + 60]]}
+        restored = mocker.Mock()
+        restored.chat_data = defaultdict(dict)
+        bo.restore_snapshot(snapshot, restored, Scheduler())
+        job = restored.chat_data[42]['tea_job']
+        assert job.context[4] == bo.IMMINENT
+
+    def test_write_and_read_snapshot(self, tmp_path):
+        filename = str(tmp_path / 'snapshot.json')
+        assert lifecycle.read_snapshot(filename) is None
+        lifecycle.write_snapshot(filename, {'jobs': [[1, 'a', 'b', 2.0]]})
+        assert lifecycle.read_snapshot(filename) == {'jobs': [[1, 'a', 'b', 2.0]]}
+
+
+class TestDrain:
+
+    def test_drain_update_queue(self):
+        update_queue = queue.Queue()
+        update_queue.put(object())
+
+        def consume():
+            update_queue.get()
+            update_queue.task_done()
+
+        threading.Timer(0.05, consume).start()
+        assert lifecycle.drain_update_queue(update_queue,
+                                            time.monotonic() + 5)
+
+    def test_drain_deadline(self):
+        update_queue = queue.Queue()
+        update_queue.put(object())
+        assert not lifecycle.drain_update_queue(update_queue, 0)
+
+    def test_shutdown_order(self, mocker, tmp_path):
+        calls = []
+        updater = mocker.Mock()
+        updater.dispatcher.update_queue = queue.Queue()
+        updater.job_queue.stop.side_effect = lambda: calls.append('jobs')
+        updater.stop.side_effect = lambda: calls.append('stop')
+        mocker.patch.object(lifecycle, '_drains',
+                            [('outbox', lambda deadline: calls.append('outbox')
+                              or True)])
+        filename = str(tmp_path / 'snapshot.json')
+        assert lifecycle.shutdown(updater, lambda: {'jobs': []}, filename)
+        assert calls == ['jobs', 'outbox', 'stop']
+        assert updater.running is False
+        assert lifecycle.read_snapshot(filename) == {'jobs': []}
+
+    def test_no_job_fires_while_draining(self, mocker, clock, tmp_path):
+        fired = []
+        scheduler = Scheduler()
+        job = scheduler.run_at(lambda bot, job: fired.append(job),
+                               clock.time() + 60)
+        scheduler.start()
+        updater = mocker.Mock()
+        updater.dispatcher.update_queue = queue.Queue()
+        updater.job_queue = scheduler
+
+        def outbox(_deadline):
+            # the alarm comes due while outbound queues are drained
+            clock.advance(120)
+            time.sleep(0.2)
+            return True
+
+        mocker.patch.object(lifecycle, '_drains', [('outbox', outbox)])
+        filename = str(tmp_path / 'snapshot.json')
+        assert lifecycle.shutdown(
+            updater, lambda: {'jobs': [job.due for job in scheduler.jobs()]},
+            filename)
+        assert fired == []
+        assert lifecycle.read_snapshot(filename) == {'jobs': [job.due]}
+
+
+HANDLERS_MODULE = '''
+class Conversations:
+    name = 'entries'
+
+    def __init__(self):
+        self.conversations = dict()
+
+
+def add_handlers(dispatcher):
+    dispatcher.add_handler(Conversations())
+    dispatcher.add_handler('unknown', group=1)
+    dispatcher.add_error_handler('error')
+'''
+
+
+class TestReload:
+
+    def test_reload_handlers(self, mocker, tmp_path, monkeypatch):
+        (tmp_path / 'reloadable_handlers.py').write_text(HANDLERS_MODULE)
+        monkeypatch.syspath_prepend(str(tmp_path))
+        old = lifecycle.HandlerTable()
+        module = lifecycle.reload_handlers(old, 'reloadable_handlers')
+        old_conv = old.handlers[0][0]
+        old_conv.conversations[(1, 1)] = bo.EVENT_DATE
+
+        dispatcher = mocker.Mock()
+        dispatcher.handlers = old.handlers
+        lifecycle.reload_handlers(dispatcher, 'reloadable_handlers')
+        new_conv = dispatcher.handlers[0][0]
+        assert new_conv is not old_conv
+        assert isinstance(new_conv, module.Conversations)
+        assert new_conv.conversations == {(1, 1): bo.EVENT_DATE}
+        assert dispatcher.groups == [0, 1]
+        assert dispatcher.error_handlers == ['error']
@@ -0,0 +1,148 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import mailer as bo_mailer
+
+
+class DebuggingSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Just enough of SMTP for smtplib, every message is kept by the server.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode('ascii'))
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost debugging server')
+        while True:
+            line = self.rfile.readline().decode('utf-8').strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command == 'DATA':
+                self.reply('354 end with .')
+                lines = []
+                for data in self.rfile:
+                    data = data.decode('utf-8').rstrip('\r\n')
+                    if data == '.':
+                        break
+                    lines.append(data)
+                self.server.messages.append('\n'.join(lines))
+                if self.server.drop_connections:
+                    # like a server closing a connection after a message
+                    self.reply('250 ok')
+                    return
+            self.reply('250 ok')
+
+
+@pytest.fixture(name='smtp_server')
+def _smtp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                             DebuggingSMTPHandler)
+    server.daemon_threads = True
+    server.messages = []
+    server.connections = 0
+    server.drop_connections = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(name='mailer')
+def _mailer(smtp_server):
+    mailer = bo_mailer.Mailer('127.0.0.1', smtp_server.server_address[1],
+                              'bot@example.com', workers=2, batch_size=50)
+    yield mailer
+    mailer.stop()
+
+
+class TestMailer:
+
+    def test_burst_reuses_connections(self, mailer, smtp_server, metrics):
+        for number in range(200):
+            assert mailer.send(f'user{number}@example.com', 'Reminder',
+                               f'Message {number}')
+        assert mailer.drain(time.monotonic() + 10)
+        assert len(smtp_server.messages) == 200
+        assert smtp_server.connections <= 2
+        assert metrics.get('mailer.sent') == 200
+        assert metrics.get('mailer.batches') < 200
+
+    def test_queue_full(self, smtp_server, metrics):
+        mailer = bo_mailer.Mailer('127.0.0.1', smtp_server.server_address[1],
+                                  'bot@example.com', workers=0, queue_size=1)
+        assert mailer.send('a@example.com', 'Reminder', 'one')
+        assert not mailer.send('b@example.com', 'Reminder', 'two')
+        assert metrics.get('mailer.dropped') == 1
+
+    def test_reconnects_after_server_closed(self, mailer, smtp_server,
+                                            metrics):
+        smtp_server.drop_connections = True
+        for number in range(3):
+            mailer.send(f'user{number}@example.com', 'Reminder', 'message')
+            assert mailer.drain(time.monotonic() + 10)
+        assert len(smtp_server.messages) == 3
+        assert smtp_server.connections == 3
+        assert metrics.get('mailer.failed') == 0
+
+
+class TestEmailChannel:
+
+    def _job(self, mocker, chat_data):
+        job = mocker.Mock()
+        job.context = [1, 'dentist', 'Event: dentist', chat_data]
+        chat_data['dentist_job'] = job
+        return job
+
+    def test_alarm_via_email(self, mocker, admission, get_logger):
+        mailer = mocker.patch('bot_organizer.bot_organizer.get_mailer')()
+        mailer.send.return_value = True
+        bot = mocker.Mock()
+        chat_data = {bo.EMAIL_ADDRESS: 'me@example.com',
+                     bo.CHANNELS: {'dentist': bo.EMAIL_CHANNEL}}
+        bo.alarm(bot, self._job(mocker, chat_data))
+        mailer.send.assert_called_once_with('me@example.com',
+                                            'Reminder: dentist',
+                                            'Event: dentist')
+        bot.send_message.assert_not_called()
+        assert chat_data[bo.CHANNELS] == {}
+
+    def test_alarm_falls_back_to_telegram(self, mocker, admission):
+        mocker.patch('bot_organizer.bot_organizer.get_mailer',
+                     return_value=None)
+        bot = mocker.Mock()
+        chat_data = {bo.EMAIL_ADDRESS: 'me@example.com',
+                     bo.CHANNELS: {'dentist': bo.BOTH_CHANNELS}}
+        bo.alarm(bot, self._job(mocker, chat_data))
+        bot.send_message.assert_called_once_with(1, text='Event: dentist')
+
+    def test_via(self, bot, update, get_logger):
+        chat_data = {'dentist_job': object()}
+        bo.via(bot, update, ['dentist', bo.EMAIL_CHANNEL], chat_data)
+        assert bo.CHANNELS not in chat_data
+        bo.email_address(bot, update, ['me@example.com'], chat_data)
+        bo.via(bot, update, ['dentist', bo.EMAIL_CHANNEL], chat_data)
+        assert chat_data[bo.CHANNELS] == {'dentist': bo.EMAIL_CHANNEL}
+        bo.via(bot, update, ['dentist', bo.TELEGRAM], chat_data)
+        assert chat_data[bo.CHANNELS] == {}
+
+    def test_via_unknown_job(self, bot, update):
+        bo.via(bot, update, ['dentist', bo.TELEGRAM], dict())
+        update.message.reply_text.assert_called_once_with(
+            'You have no active dentist.')
+
+    def test_email_off(self, bot, update, get_logger):
+        chat_data = dict()
+        bo.email_address(bot, update, ['not-an-address'], chat_data)
+        assert bo.EMAIL_ADDRESS not in chat_data
+        bo.email_address(bot, update, ['me@example.com'], chat_data)
+        bo.email_address(bot, update, ['off'], chat_data)
+        assert bo.EMAIL_ADDRESS not in chat_data
@@ -0,0 +1,84 @@
+from telegram import Update
+
+from bot_organizer import offsets
+from bot_organizer.offsets import OffsetStore, UpdateGate, UpdateWindow
+
+
+class TestUpdateWindow:
+
+    def test_duplicates_inside_window(self):
+        window = UpdateWindow(size=3)
+        assert not window.seen(1)
+        assert window.seen(1)
+        for update_id in (2, 3, 4):
+            assert not window.seen(update_id)
+        # 1 fell out of the window, the set stays bounded
+        assert not window.seen(1)
+        assert len(window) == 3
+
+    def test_floor(self):
+        window = UpdateWindow(size=3, floor=10)
+        assert window.seen(7)
+        assert window.seen(10)
+        assert not window.seen(11)
+
+
+class TestOffsetStore:
+
+    def test_mark_and_load(self, tmp_path):
+        filename = str(tmp_path / 'offset.bin')
+        store = OffsetStore(filename)
+        assert store.load() is None
+        store.mark(41)
+        store.mark(42)
+        # a new process reads what the old one wrote, even without close
+        assert OffsetStore(filename).load() == 42
+        store.close()
+
+    def test_fsync_is_batched(self, mocker, tmp_path, metrics):
+        fsync = mocker.patch('bot_organizer.offsets.os.fsync')
+        store = OffsetStore(str(tmp_path / 'offset.bin'), fsync_every=10,
+                            fsync_interval=3600)
+        for update_id in range(25):
+            store.mark(update_id)
+        assert fsync.call_count == 2
+        store.drain(None)
+        assert fsync.call_count == 3
+        store.drain(None)
+        assert fsync.call_count == 3
+        store.close()
+
+
+class TestUpdateGate:
+
+    def test_duplicates_never_reach_handlers(self, mocker, tmp_path,
+                                             metrics):
+        process_update = mocker.Mock()
+        store = OffsetStore(str(tmp_path / 'offset.bin'))
+        gate = UpdateGate(process_update, UpdateWindow(), store)
+        for update_id in (1, 2, 2, 3, 1):
+            gate(Update(update_id))
+        assert [call[0][0].update_id
+                for call in process_update.call_args_list] == [1, 2, 3]
+        assert metrics.get('updates.duplicates') == 2
+        assert store.load() == 3
+        gate('not an update')
+        process_update.assert_called_with('not an update')
+        store.close()
+
+    def test_install_after_restart(self, mocker, tmp_path):
+        store = OffsetStore(str(tmp_path / 'offset.bin'))
+        store.mark(100)
+        store.close()
+        updater = mocker.Mock()
+        process_update = updater.dispatcher.process_update
+        mocker.patch('bot_organizer.offsets.get_logger')
+        gate = offsets.install(updater, OffsetStore(store.filename))
+        assert updater.last_update_id == 101
+        assert updater.dispatcher.process_update is gate
+        # replayed updates cost one comparison
+        gate(Update(99))
+        gate(Update(100))
+        gate(Update(101))
+        process_update.assert_called_once()
+        gate.store.close()
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.phrases import (compile_phrase, parse_duration, parse_when,
+                                   split_phrase)
+from bot_organizer.scheduler import Scheduler
+from bot_organizer.timezones import get_zone
+
+FORMAT = '%a ' + bo.DATE_TIME_FORMAT
+
+
+@pytest.fixture(name='warsaw')
+def _warsaw():
+    zone = get_zone('Europe/Warsaw')
+    # a wednesday noon
+    return zone, zone.parse('2030-01-02 12:00:00', bo.DATE_TIME_FORMAT)
+
+
+class TestParser:
+
+    @pytest.mark.parametrize('phrase, expected', [
+        ('in 15m', 'Wed 2030-01-02 12:15:00'),
+        ('In 1 hour  30 minutes', 'Wed 2030-01-02 13:30:00'),
+        ('90s', 'Wed 2030-01-02 12:01:30'),
+        ('1h 30m', 'Wed 2030-01-02 13:30:00'),
+        ('tomorrow 9:00', 'Thu 2030-01-03 09:00:00'),
+        ('tomorrow', 'Thu 2030-01-03 09:00:00'),
+        ('next monday 14:30', 'Mon 2030-01-07 14:30:00'),
+        ('wednesday', 'Wed 2030-01-09 09:00:00'),
+        ('friday at 6pm', 'Fri 2030-01-04 18:00:00'),
+        ('at 18:00', 'Wed 2030-01-02 18:00:00'),
+        ('11:00', 'Thu 2030-01-03 11:00:00'),
+        ('2030-03-31 02:30:00', 'Sun 2030-03-31 03:30:00'),
+    ])
+    def test_phrases(self, warsaw, phrase, expected):
+        zone, now = warsaw
+        assert zone.format(parse_when(phrase, now, zone), FORMAT) == expected
+
+    @pytest.mark.parametrize('phrase', ['soon', '25:00', '13pm',
+                                        '2030-02-30', 'in 15 months', '',
+                                        '10 d', '1 hour 30 minutes'])
+    def test_not_phrases(self, warsaw, phrase):
+        zone, now = warsaw
+        with pytest.raises(ValueError):
+            parse_when(phrase, now, zone)
+
+    def test_duration(self, warsaw):
+        zone, now = warsaw
+        assert parse_duration('90', now, zone) == 90
+        assert parse_duration('01:00:05', now, zone) == 3605
+        assert parse_duration('in 2h', now, zone) == 7200
+        assert parse_duration('at 13:00', now, zone) == 3600
+        for due in ('13:00', '00:10', '1:2:3:4'):
+            with pytest.raises(ValueError):
+                parse_duration(due, now, zone)
+
+    def test_split_phrase(self, warsaw):
+        zone, now = warsaw
+        due, rest = split_phrase('next monday 14:30 standup room 5'.split(),
+                                 lambda text: parse_when(text, now, zone))
+        assert zone.format(due, FORMAT) == 'Mon 2030-01-07 14:30:00'
+        assert rest == ['standup', 'room', '5']
+        with pytest.raises(ValueError):
+            split_phrase(['standup'], lambda text: parse_when(text, now, zone))
+
+    def test_split_compound_duration(self, warsaw):
+        zone, now = warsaw
+        words = 'in 1 hour 30 minutes 10 seconds tea is ready'.split()
+        assert split_phrase(
+            words, lambda text: parse_duration(text, now, zone)) == (
+            5410, ['tea', 'is', 'ready'])
+        due, rest = split_phrase('next monday at 6 pm standup'.split(),
+                                 lambda text: parse_when(text, now, zone))
+        assert zone.format(due, FORMAT) == 'Mon 2030-01-07 18:00:00'
+        assert rest == ['standup']
+
+    def test_cache(self, warsaw):
+        zone, now = warsaw
+        compile_phrase.cache_clear()
+        parse_when('in 15m', now, zone)
+        parse_when('in 15m', now + 60, zone)
+        assert compile_phrase.cache_info().hits == 1
+
+    def test_parse_is_fast(self, warsaw):
+        zone, now = warsaw
+        phrases = ['in 15m', 'tomorrow 9:00', 'next monday 14:30',
+                   '2030-01-05 10:00:00']
+        start = time.perf_counter()
+        for number in range(20000):
+            parse_when(phrases[number % 4], now, zone)
+        # generous bound, a cached phrase takes a few microseconds
+        assert (time.perf_counter() - start) / 20000 < 0.0001
+
+
+class TestPhraseHandlers:
+
+    def test_new_event_phrase(self, update, admission, clock, get_logger):
+        chat_data = dict()
+        bo.new_event(None, update, ['in', '2h', 'dentist', 'centre'],
+                     Scheduler(), chat_data)
+        job = chat_data['dentist' + bo.JOB_STR_END]
+        assert job.due == int(clock.time()) + 7200
+        assert 'Location: centre' in job.context[2]
+
+    def test_new_timer_phrase(self, update, admission, clock, get_logger):
+        chat_data = dict()
+        admission.configure(burst=3)
+        bo.new_timer(None, update, ['in', '15', 'min', 'tea', 'is', 'ready'],
+                     Scheduler(), chat_data)
+        job = chat_data['tea' + bo.JOB_STR_END]
+        assert job.due == int(clock.time()) + 900
+        assert job.context[2].endswith('is ready')
+        bo.new_timer(None, update, 'in 1 hour 30 minutes tea'.split(),
+                     Scheduler(), chat_data)
+        assert chat_data['tea' + bo.JOB_STR_END].due == \
+            int(clock.time()) + 5400
+        # a unit apart from the amount is the name without "in"
+        bo.new_timer(None, update, ['10', 'd'], Scheduler(), chat_data)
+        assert chat_data['d' + bo.JOB_STR_END].due == int(clock.time()) + 10
+
+    def test_conversation_phrases(self, update, clock, event_chat_data,
+                                  timer_chat_data, get_logger):
+        update.message.text = 'in 1h'
+        assert bo.event_date(None, update, event_chat_data) == bo.EVENT_LOC
+        assert event_chat_data[bo.LEE][bo.DATE] == int(clock.time()) + 3600
+        update.message.text = 'in 10m'
+        assert bo.timer_due(None, update, timer_chat_data) == bo.TIMER_MSG
+        assert timer_chat_data[bo.LTE][bo.DUE] == 600
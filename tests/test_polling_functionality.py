@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+
+import pytest
+from telegram import Update
+from telegram.error import NetworkError, TimedOut
+from telegram.ext import TypeHandler, Updater
+
+from bot_organizer import polling
+from bot_organizer.polling import AdaptivePoller
+
+
+class FakeTelegramAPI:
+    """
+    Local stand-in of the Bot API getUpdates: updates below the offset
+    are confirmed and forgotten, long polls wait for new updates.
+    Waits are scaled down by `time_scale` to keep the tests fast.
+    """
+
+    id = 1
+
+    def __init__(self, time_scale=0.001):
+        self.time_scale = time_scale
+        self.request = type('Request', (), {'con_pool_size': 8})()
+        self.pending = []
+        self.calls = []
+        self.errors = []
+        self.next_id = 1
+        self.condition = threading.Condition()
+
+    def push(self, count):
+        with self.condition:
+            for _ in range(count):
+                self.pending.append(Update(self.next_id))
+                self.next_id += 1
+            self.condition.notify_all()
+
+    def get_updates(self, offset=None, limit=100, timeout=0, read_latency=2.,
+                    allowed_updates=None):
+        with self.condition:
+            self.calls.append((offset, limit, timeout))
+            if self.errors:
+                raise self.errors.pop(0)
+            if offset:
+                self.pending = [update for update in self.pending
+                                if update.update_id >= offset]
+            if not self.pending and timeout:
+                self.condition.wait(timeout * self.time_scale)
+            return self.pending[:min(limit, 100)]
+
+    def delete_webhook(self):
+        return True
+
+
+@pytest.fixture(name='api')
+def _api():
+    return FakeTelegramAPI()
+
+
+class TestAdaptivePoller:
+
+    def test_burst_raises_limit_and_stops_waiting(self, api, metrics):
+        api.push(1000)
+        poller = AdaptivePoller(api, queue.Queue())
+        while poller.poll_once():
+            pass
+        assert poller.update_queue.qsize() == 1000
+        limits = [limit for _, limit, _ in api.calls]
+        assert limits[:5] == [10, 20, 40, 80, 100]
+        # a full batch is followed by a getUpdates which does not wait
+        assert all(timeout == 0 for _, _, timeout in api.calls[1:-1])
+        assert len(api.calls) < 20
+        assert metrics.get('polling.updates') == 1000
+        assert metrics.get('polling.backlog') == 1000
+
+    def test_quiet_bot_polls_rarely(self, api, metrics):
+        poller = AdaptivePoller(api, queue.Queue(), max_timeout=20)
+        for _ in range(8):
+            poller.poll_once()
+        assert [timeout for _, _, timeout in api.calls] == \
+            [1, 2, 4, 8, 16, 20, 20, 20]
+        assert poller.limit == poller.min_limit
+        assert metrics.get('polling.empty') == 8
+
+    def test_limit_follows_intake_rate(self, api, clock):
+        poller = AdaptivePoller(api, queue.Queue())
+        for _ in range(10):
+            api.push(30)
+            clock.advance(1)
+            poller.poll_once()
+        assert 30 <= poller.limit <= 60
+        assert poller.timeout in (0, poller.min_timeout)
+        assert 20 < poller.rate < 60
+
+    def test_offset_confirms_updates(self, api):
+        api.push(5)
+        poller = AdaptivePoller(api, queue.Queue(), offset=3)
+        poller.poll_once()
+        assert [update.update_id for update in poller.update_queue.queue] == \
+            [3, 4, 5]
+        assert poller.offset == 6
+
+    def test_batch_after_stop_is_left_at_telegram(self, api):
+        api.push(3)
+        running = [True]
+        poller = AdaptivePoller(api, queue.Queue(), offset=1)
+
+        def get_updates(*args, **kwargs):
+            # shutdown sets running=False while the long poll is in flight
+            running[0] = False
+            return FakeTelegramAPI.get_updates(api, *args, **kwargs)
+        api.get_updates = get_updates
+        assert poller.poll_once(lambda: running[0]) == 0
+        assert poller.update_queue.empty()
+        assert poller.offset == 1
+
+    def test_backlog_pauses_fetching(self, api, metrics):
+        api.push(50)
+        update_queue = queue.Queue()
+        for _ in range(20):
+            update_queue.put(None)
+        poller = AdaptivePoller(api, update_queue, max_backlog=10)
+        thread = threading.Thread(target=poller.run)
+        thread.start()
+        time.sleep(0.05)
+        assert api.calls == []
+        while not update_queue.empty():
+            update_queue.get()
+        deadline = time.monotonic() + 5
+        while api.calls == [] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        poller.stop()
+        thread.join()
+        assert api.calls
+
+    def test_errors_are_reported_and_retried(self, api, metrics):
+        api.push(3)
+        api.errors = [NetworkError('down'), TimedOut()]
+        update_queue = queue.Queue()
+        poller = AdaptivePoller(api, update_queue)
+        thread = threading.Thread(target=poller.run)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while update_queue.qsize() < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        poller.stop()
+        thread.join()
+        items = list(update_queue.queue)
+        assert isinstance(items[0], NetworkError)
+        assert [update.update_id for update in items[1:]] == [1, 2, 3]
+        assert metrics.get('polling.errors') == 1
+
+
+class TestUpdaterIntegration:
+
+    def test_updates_reach_handlers_in_order(self, api, metrics):
+        updater = Updater(bot=api, workers=0)
+        handled = []
+        done = threading.Event()
+
+        def handle(_bot, update):
+            handled.append(update.update_id)
+            if len(handled) == 501:
+                done.set()
+
+        updater.dispatcher.add_handler(TypeHandler(Update, handle))
+        updater.last_update_id = 1
+        poller = polling.install(updater)
+        api.push(500)
+        updater.start_polling()
+        # more updates arrive while the first batches are dispatched
+        api.push(1)
+        assert done.wait(10)
+        updater.stop()
+        assert handled == list(range(1, 502))
+        assert poller.offset == updater.last_update_id == 502
@@ -0,0 +1,76 @@
+import threading
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.lifecycle import HandlerTable
+from bot_organizer.profiler import SamplingProfiler, handler_callbacks
+
+
+def slow_part(release):
+    release.wait(5)
+
+
+def handler_under_test(release):
+    slow_part(release)
+
+
+class TestSamplingProfiler:
+
+    def test_callbacks_include_conversation_states(self, mocker):
+        mocker.patch('bot_organizer.bot_organizer.get_logger')
+        table = HandlerTable()
+        bo.add_handlers(table)
+        names = {callback.__name__
+                 for callback in handler_callbacks(table.handlers)}
+        assert {'event_date', 'timer_due', 'new_event', 'stats',
+                'unknown'} <= names
+
+    def test_samples_are_attributed_to_callback(self):
+        profiler = SamplingProfiler()
+        profiler.attach(job_callbacks=[handler_under_test])
+        profiler._callbacks = profiler.callbacks()
+        release = threading.Event()
+        thread = threading.Thread(target=handler_under_test, args=(release,))
+        thread.start()
+        try:
+            for _ in range(3):
+                profiler.sample()
+        finally:
+            release.set()
+            thread.join()
+        [(stack, count)] = profiler.samples.items()
+        assert count == 3
+        assert stack.startswith(
+            'handler_under_test;'
+            'test_profiler_functionality.py:handler_under_test;'
+            'test_profiler_functionality.py:slow_part;')
+
+    def test_window_hands_collapsed_stacks_over(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.attach(job_callbacks=[handler_under_test])
+        release = threading.Event()
+        thread = threading.Thread(target=handler_under_test, args=(release,))
+        thread.start()
+        done = threading.Event()
+        texts = []
+        assert profiler.start(0.05, on_done=lambda text: (texts.append(text),
+                                                          done.set()))
+        assert not profiler.start(0.05)
+        assert done.wait(5)
+        release.set()
+        thread.join()
+        line = texts[0].splitlines()[0]
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('handler_under_test;') and int(count) > 0
+
+    def test_profile_command_is_admin_only(self, mocker, update):
+        start = mocker.patch.object(bo.get_profiler(), 'start',
+                                    return_value=True)
+        mocker.patch('bot_organizer.bot_organizer.get_logger')
+        mocker.patch.object(bo, 'ADMIN_IDS', set())
+        bo.profile(None, update, ['10'])
+        start.assert_not_called()
+        mocker.patch.object(bo, 'ADMIN_IDS', {update.message.from_user.id})
+        bo.profile(None, update, ['1000'])
+        assert start.call_args[0][0] == bo.MAX_PROFILE_SECONDS
+        update.message.reply_text.assert_called_with(
+            f'Profiling for {bo.MAX_PROFILE_SECONDS} seconds.')
@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+from telegram import Chat, Message, MessageEntity, Update, User
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import replay
+from bot_organizer.clock import VirtualClock, set_clock
+from bot_organizer.replay import Recorder, Replayer, Scrubber, StubBot
+
+
+def command_update(update_id, chat_id, text, clock):
+    entities = []
+    if text.startswith('/'):
+        entities.append(MessageEntity('bot_command', 0,
+                                      len(text.split()[0])))
+    return Update(update_id, message=Message(
+        update_id, User(chat_id, 'Ann', False, username='ann'),
+        datetime.fromtimestamp(clock.time()),
+        Chat(chat_id, 'private', first_name='Ann'), text=text,
+        entities=entities))
+
+
+@pytest.fixture(name='recording')
+def _recording(tmp_path):
+    return str(tmp_path / 'updates.jsonl.gz')
+
+
+class TestRecorder:
+
+    def test_gate_records_updates(self, mocker, clock, recording):
+        recorder = Recorder(recording)
+        process_update = mocker.Mock()
+        gate = replay.RecordingGate(process_update, recorder)
+        gate(command_update(1, 42, '/new_timer 15 tea', clock))
+        clock.advance(5)
+        gate(command_update(2, 42, '/help', clock))
+        gate(object())
+        recorder.close()
+        assert process_update.call_count == 3
+        entries = list(replay.read_recording(recording))
+        assert [time - clock.time() for time, _ in entries] == [-5, 0]
+        assert entries[0][1]['message']['text'] == '/new_timer 15 tea'
+
+    def test_scrub_keeps_commands_and_dates(self):
+        scrubber = Scrubber()
+        data = {'message': {'text': '/new_event 2030-01-02 10:00:00 dentist',
+                            'from': {'id': 555, 'first_name': 'Ann',
+                                     'username': 'ann'},
+                            'chat': {'id': 555, 'type': 'private',
+                                     'first_name': 'Ann'},
+                            'contact': {'phone_number': '123'}}}
+        scrubbed = scrubber.scrub(data)['message']
+        assert scrubbed['text'] == '/new_event 2030-01-02 10:00:00 xxxxxxx'
+        assert scrubbed['from'] == {'id': 1, 'first_name': 'User'}
+        assert scrubbed['chat']['id'] == 1
+        assert 'contact' not in scrubbed
+        assert scrubber.pseudonym(-100777) == -2
+
+
+    def test_scrubbed_recording_is_not_appended(self, clock, recording,
+                                                capsys):
+        recorder = Recorder(recording, scrub=True)
+        recorder.record(command_update(1, 42, '/help', clock))
+        recorder.close()
+        with pytest.raises(FileExistsError):
+            Recorder(recording, scrub=True)
+        with pytest.raises(SystemExit):
+            bo.parse_args(['--record', recording, '--scrub'])
+        assert 'can not be continued' in capsys.readouterr().err
+        # a plain recording is appended to
+        Recorder(recording).close()
+
+    def test_record_option(self, capsys):
+        args = bo.parse_args(['--record', 'updates.jsonl.gz', '--scrub'])
+        assert (args.record, args.scrub, args.failover) == (
+            'updates.jsonl.gz', True, False)
+        assert bo.parse_args([]).record is None
+        with pytest.raises(SystemExit):
+            bo.parse_args(['--record'])
+        assert 'usage:' in capsys.readouterr().err
+
+
+class TestReplayer:
+
+    def _replay(self, recording, speed=None, sleep=None):
+        # a clock of its own, virtual time never goes back
+        clock = VirtualClock(0)
+        previous = set_clock(clock)
+        try:
+            bot = StubBot()
+            dispatcher, scheduler = replay.build_dispatcher(bot, clock)
+            replayer = Replayer(dispatcher, scheduler, clock, speed,
+                                sleep=sleep or (lambda _seconds: None))
+            return replayer.run(replay.read_recording(recording)), bot
+        finally:
+            set_clock(previous)
+
+    def test_replay_runs_handlers_and_alarms(self, mocker, clock,
+                                             recording, admission):
+        mocker.patch('bot_organizer.bot_organizer.get_logger')
+        recorder = Recorder(recording, scrub=True)
+        recorder.record(command_update(1, 42, '/new_timer 15 tea', clock))
+        clock.advance(30)
+        recorder.record(command_update(2, 42, '/help', clock))
+        recorder.record(command_update(3, 43, '/nonsense', clock))
+        recorder.close()
+        report, bot = self._replay(recording)
+        assert report['updates'] == 3
+        assert report['alarms_fired'] == 1
+        # timer set, alarm, help and unknown command replies
+        assert report['messages_sent'] == bot.sent == 4
+        assert report['jobs_pending'] == 0
+        assert report['latency_ms']['max'] >= report['latency_ms']['p50']
+
+    def test_pace_follows_speed(self, mocker, clock, recording, admission):
+        mocker.patch('bot_organizer.bot_organizer.get_logger')
+        recorder = Recorder(recording)
+        for number in range(3):
+            recorder.record(command_update(number, 42, '/help', clock))
+            clock.advance(10)
+        recorder.close()
+        waits = []
+        self._replay(recording, speed=10, sleep=waits.append)
+        # 10 recorded seconds between updates take 1 second at 10x
+        assert waits == [pytest.approx(1, abs=0.1), pytest.approx(2, abs=0.1)]
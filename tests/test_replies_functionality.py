@@ -0,0 +1,56 @@
+import json
+from datetime import datetime
+
+from telegram import Bot, Chat, Message, User
+from telegram.utils.request import Request
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.replies import StaticReply
+
+
+def message_from(bot, chat_id=42):
+    return Message(1, User(chat_id, 'Ann', False), datetime(2030, 1, 1),
+                   Chat(chat_id, 'private'), text='/start', bot=bot)
+
+
+class TestStaticReply:
+
+    def test_body_matches_send_message(self):
+        body = json.loads(bo.START_REPLY.body(-1001))
+        assert body == {'chat_id': -1001, 'text': bo.START_REPLY.text,
+                        'reply_markup': bo.start_markup.to_dict()}
+        assert json.loads(bo.HELP_REPLY.body(7)) == {
+            'chat_id': 7, 'text': bo.HELP_REPLY.text}
+
+    def test_bot_gets_prepared_body(self, mocker, metrics):
+        bot = Bot('123:TOKEN')
+        wrapper = mocker.patch.object(
+            bot.request, '_request_wrapper',
+            return_value=b'{"ok":true,"result":{"message_id":2,'
+                         b'"date":1893456000,'
+                         b'"chat":{"id":42,"type":"private"}}}')
+        to_json = mocker.spy(bo.start_markup, 'to_json')
+        sent = bo.START_REPLY.send(message_from(bot))
+        assert isinstance(sent, Message)
+        assert (sent.message_id, sent.chat_id) == (2, 42)
+        method, url = wrapper.call_args[0]
+        assert (method, url) == ('POST', f'{bot.base_url}/sendMessage')
+        assert wrapper.call_args[1]['body'] == bo.START_REPLY.body(42)
+        to_json.assert_not_called()
+        assert metrics.get('replies.static') == 1
+
+    def test_without_request_internals(self, mocker, monkeypatch):
+        bot = Bot('123:TOKEN')
+        monkeypatch.delattr(Request, '_parse')
+        message = message_from(bot)
+        reply_text = mocker.patch.object(Message, 'reply_text')
+        bo.HELP_REPLY.send(message)
+        reply_text.assert_called_once_with(bo.HELP_REPLY.text)
+
+    def test_other_bots_get_reply_text(self, mocker):
+        message = mocker.Mock()
+        StaticReply('Hi', reply_markup=bo.start_markup).send(message)
+        message.reply_text.assert_called_once_with(
+            'Hi', reply_markup=bo.start_markup)
+        bo.unknown(None, mocker.Mock(message=message))
+        message.reply_text.assert_called_with(bo.UNKNOWN_REPLY.text)
@@ -0,0 +1,149 @@
+from datetime import timedelta
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.clock import SystemClock, VirtualClock
+from bot_organizer.scheduler import Scheduler, fire_time
+
+
+class TestVirtualClock:
+
+    def test_advance(self, clock):
+        start = clock.time()
+        clock.advance(timedelta(hours=1))
+        assert clock.time() == start + 3600
+        assert clock.now().timestamp() == start + 3600
+
+    def test_never_goes_back(self):
+        clock = VirtualClock(100)
+        clock.set(50)
+        assert clock.time() == 100
+
+    def test_system_clock(self):
+        assert SystemClock().time() > 0
+
+
+class TestScheduler:
+
+    def test_run_once_in_order(self, mocker, clock):
+        fired = []
+        callback = mocker.Mock(side_effect=lambda bot, job: fired.append(
+            (job.context, clock.time())))
+        scheduler = Scheduler(bot='bot')
+        start = clock.time()
+        scheduler.run_once(callback, 20, context='b')
+        scheduler.run_once(callback, 10, context='a')
+        scheduler.run_once(callback, clock.now() + timedelta(seconds=30),
+                           context='c')
+        assert scheduler.advance(25) == 2
+        assert fired == [('a', start + 10), ('b', start + 20)]
+        assert scheduler.advance(10) == 1
+        assert callback.call_args[0][0] == 'bot'
+
+    def test_schedule_removal(self, mocker):
+        callback = mocker.Mock()
+        scheduler = Scheduler()
+        job = scheduler.run_once(callback, 10)
+        assert scheduler.jobs() == (job,)
+        job.schedule_removal()
+        assert scheduler.jobs() == ()
+        assert job.next_t is None
+        scheduler.advance(20)
+        callback.assert_not_called()
+
+    def test_run_repeating(self, mocker):
+        callback = mocker.Mock()
+        scheduler = Scheduler()
+        job = scheduler.run_repeating(callback, interval=60)
+        assert scheduler.advance(timedelta(hours=1)) == 60
+        assert job.next_t is not None
+
+    def test_failing_job_does_not_stop_others(self, mocker):
+        bad = mocker.Mock(side_effect=RuntimeError)
+        good = mocker.Mock()
+        scheduler = Scheduler()
+        scheduler.run_once(bad, 1)
+        scheduler.run_once(good, 2)
+        assert scheduler.advance(5) == 2
+        good.assert_called_once()
+
+    def test_thread_fires_with_virtual_clock(self, mocker, clock):
+        callback = mocker.Mock()
+        scheduler = Scheduler()
+        scheduler.run_once(callback, 5)
+        scheduler.start()
+        try:
+            clock.advance(10)
+            for _ in range(100):
+                if callback.called:
+                    break
+                SystemClock().wait(scheduler._wake, 0.01)
+        finally:
+            scheduler.stop()
+        callback.assert_called_once()
+
+
+class TestSlack:
+
+    def test_fire_time(self):
+        assert fire_time(1001.5, 0) == 1001.5
+        assert fire_time(1001.5, 5) == 1005
+        assert fire_time(1005, 5) == 1005
+
+    def test_jobs_share_bucket(self, mocker, clock, metrics):
+        fired = []
+        callback = mocker.Mock(side_effect=lambda bot, job: fired.append(
+            (job.context, clock.time())))
+        batch = mocker.MagicMock()
+        scheduler = Scheduler(slack=60, batch=batch)
+        start = clock.time()
+        bucket = fire_time(start + 1, 60)
+        scheduler.run_once(callback, bucket - start - 30, context='a')
+        scheduler.run_once(callback, bucket - start - 10, context='b')
+        scheduler.run_once(callback, bucket - start + 1, context='c')
+        exact = scheduler.run_once(callback, 1, context='d', slack=0)
+        assert scheduler.next_due() == start + 1
+        assert exact.next_t.timestamp() == start + 1
+        assert scheduler.advance(bucket - start) == 3
+        assert fired[1:] == [('a', bucket), ('b', bucket)]
+        # one bucket of one job, one bucket of two jobs in one batch
+        assert metrics.get('scheduler.buckets') == 2
+        batch.assert_called_once()
+        assert scheduler.next_due() == bucket + 60
+
+    def test_slack_function(self, mocker):
+        scheduler = Scheduler(slack=bo.job_slack)
+        near = scheduler.run_once(mocker.Mock(), 30)
+        far = scheduler.run_once(mocker.Mock(), timedelta(days=3))
+        many = scheduler.run_once_many(mocker.Mock(), [(30, None),
+                                                       (7200, None)])
+        assert (near.slack, far.slack) == (1, bo.MAX_SLACK)
+        assert [job.slack for job in many] == [1, 30]
+
+    def test_job_slack_tiers(self):
+        assert bo.job_slack(bo.SHORT_TIMER_MAX) == 1
+        assert bo.job_slack(bo.SHORT_TIMER_MAX + 1) == 5
+        assert bo.job_slack(2 * 24 * 3600) == bo.MAX_SLACK
+
+
+class TestSimulatedAlarms:
+
+    def test_week_of_timers(self, mocker, update, admission, get_logger):
+        """
+        Many timers spread over a week fire in virtual time, in due order.
+        """
+        admission.configure(rate=1000, burst=10 ** 6,
+                            max_pending_per_chat=10 ** 6,
+                            max_pending_total=10 ** 6)
+        bot = mocker.Mock()
+        scheduler = Scheduler(bot=bot)
+        chat_data = dict()
+        week = 7 * 24 * 3600
+        count = 5000
+        for i in range(count):
+            chat_data[bo.LTE] = {bo.NAME: f't{i}', bo.DUE: (i * 7919) % week,
+                                 bo.MSG: None}
+            bo.set_timer(update, scheduler, chat_data)
+        assert scheduler.advance(week) == count
+        assert bot.send_message.call_count == count
+        assert admission.pending() == 0
+        assert not [key for key in chat_data if key.endswith(bo.JOB_STR_END)]
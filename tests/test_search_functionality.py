@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.scheduler import Scheduler
+from bot_organizer.search import ChatIndex, get_search
+
+
+@pytest.fixture(name='search')
+def _search():
+    index = get_search()
+    index.clear()
+    yield index
+    index.clear()
+
+
+class TestChatIndex:
+
+    def test_prefix_and_substring(self):
+        index = ChatIndex()
+        index.add('dentist', 'dentist\nmain street 5\nbring the card')
+        index.add('gym', 'gym\ndowntown')
+        assert index.find('dent') == ['dentist']
+        assert index.find('STREET') == ['dentist']
+        assert index.find('entis') == ['dentist']
+        assert index.find('the card') == ['dentist']
+        assert index.find('own') == ['gym']
+        assert index.find('xyz') == []
+
+    def test_exact_name_first(self):
+        index = ChatIndex()
+        index.add('tea time', 'tea time\ntea')
+        index.add('tea', 'tea')
+        assert index.find('tea')[0] == 'tea'
+
+    def test_remove_and_replace(self):
+        index = ChatIndex()
+        index.add('dentist', 'dentist\nmain street')
+        index.add('dentist', 'dentist\nold town')
+        assert index.find('street') == []
+        assert index.find('old') == ['dentist']
+        index.remove('dentist')
+        assert index.find('dentist') == []
+        assert index.trie == {} and index.postings == {}
+
+    def test_limit(self):
+        index = ChatIndex()
+        for number in range(30):
+            index.add(f'call {number}', f'call {number}')
+        assert len(index.find('call', limit=5)) == 5
+
+    def test_large_chat_is_fast(self):
+        index = ChatIndex()
+        words = ['dentist', 'meeting', 'gym', 'doctor', 'call', 'mom',
+                 'project', 'review', 'lunch', 'train', 'rent', 'car']
+        for number in range(50000):
+            index.add(f'{words[number % 12]} {number}',
+                      ' '.join(words[(number * step) % 12]
+                               for step in (1, 5, 7)))
+        start = time.perf_counter()
+        for query in ('dent', 'entis', 'gym 4999', 'rent car dentist mom',
+                      'nothing'):
+            for _ in range(20):
+                index.find(query)
+        # generous bound, the real cost is well under a millisecond
+        assert (time.perf_counter() - start) / 100 < 0.005
+
+
+class TestFindHandler:
+
+    def test_find_active_jobs(self, update, admission, search,
+                              good_timer_chat_data, good_event_chat_data,
+                              get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        bo.set_event(update, job_queue, good_event_chat_data)
+        chat_data = dict(good_timer_chat_data, **good_event_chat_data)
+        bo.find(None, update, ['test'], chat_data)
+        reply = update.message.reply_text.call_args[0][0]
+        assert 'TEST LTE' in reply and 'TEST LEE' in reply
+        bo.find(None, update, ['loc'], chat_data)
+        assert update.message.reply_text.call_args[0][0].splitlines()[1] == \
+            'TEST LEE'
+
+    def test_fired_and_unset_jobs_are_dropped(self, update, admission, search,
+                                             good_timer_chat_data, get_logger):
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        entry = dict(good_timer_chat_data[bo.LTE])
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        assert search.find(42, 'lte') == ['TEST LTE']
+        job_queue.advance(15)
+        assert search.find(42, 'lte') == []
+        good_timer_chat_data[bo.LTE] = entry
+        bo.set_timer(update, job_queue, good_timer_chat_data)
+        bo.unset(None, update, ['TEST LTE'], good_timer_chat_data)
+        assert search.find(42, 'lte') == []
+
+    def test_replaced_jobs_are_reindexed(self, mocker, update, admission,
+                                         search, get_logger):
+        admission.configure(burst=10)
+        update.message.chat_id = 42
+        job_queue = Scheduler()
+        chat_data = {bo.LTE: {bo.NAME: 'tea', bo.DUE: 60, bo.MSG: 'green'}}
+        bo.set_timer(update, job_queue, chat_data)
+        remove = mocker.spy(search, 'remove')
+        chat_data[bo.LTE] = {bo.NAME: 'tea', bo.DUE: 60, bo.MSG: 'black'}
+        bo.set_timer(update, job_queue, chat_data)
+        remove.assert_called_once_with(42, 'tea')
+        assert search.find(42, 'green') == []
+        update.message.text = '/new_timers 90 tea oolong'
+        bo.new_timers(None, update, job_queue, chat_data)
+        assert remove.call_count == 2
+        assert search.find(42, 'black') == []
+        assert search.find(42, 'oolong') == ['tea']
+
+    def test_find_nothing(self, update, search):
+        bo.find(None, update, ['dentist'], dict())
+        update.message.reply_text.assert_called_once_with(
+            'Nothing found for \'dentist\'.')
+
+    def test_find_usage(self, update):
+        bo.find(None, update, [], dict())
+        update.message.reply_text.assert_called_once_with('Usage: /find <text>')
@@ -0,0 +1,90 @@
+import json
+import queue
+from urllib.request import urlopen
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import stats as bo_stats
+from bot_organizer.dispatch import ChatExecutor
+
+
+class TestJobAccounting:
+
+    def test_created_and_finished(self, metrics):
+        context = [1, 'TEST', 'Timer: TEST', dict()]
+        bo_stats.job_created('TEST_job', context)
+        assert metrics.get('jobs.context_bytes') > 0
+        assert metrics.get('chat_data.bytes') > 0
+        bo_stats.job_finished('TEST_job', context, cancelled=True)
+        assert metrics.get('jobs.context_bytes') == 0
+        assert metrics.get('chat_data.bytes') == 0
+        assert metrics.get('jobs.cancelled') == 1
+
+    def test_finished_with_other_context(self, metrics):
+        bo_stats.job_created('TEST_job', [1, 'TEST', 'Timer: TEST', dict()])
+        # e.g. a stored job whose message was already dropped
+        bo_stats.job_finished('TEST_job', [1, 'TEST', None, None])
+        assert metrics.get('jobs.context_bytes') == 0
+
+    def test_process_rss(self):
+        assert bo_stats.process_rss() > 0
+
+
+class TestStatsCollector:
+
+    def test_collect(self, mocker, metrics):
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = {1: {}, 2: {}}
+        dispatcher.update_queue = queue.Queue()
+        dispatcher.update_queue.put(object())
+        conv_handler = mocker.Mock()
+        conv_handler.conversations = {(1, 1): bo.EVENT_NAME}
+        metrics.set('jobs.pending', 3)
+        collector = bo_stats.StatsCollector()
+        collector.attach(dispatcher, conv_handler)
+        stats = collector.collect()
+        assert stats['chats_with_data'] == 2
+        assert stats['update_queue_depth'] == 1
+        assert stats['conversations_in_progress'] == 1
+        assert stats['jobs_pending'] == 3
+        assert 'jobs_pending: 3' in bo_stats.format_stats(stats)
+
+    def test_dispatch_backlog(self, mocker, metrics):
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = dict()
+        dispatcher.update_queue = queue.Queue()
+        dispatcher.update_queue.put(object())
+        executor = ChatExecutor(0)
+        executor.submit(1, print)
+        executor.submit(1, print)
+        collector = bo_stats.StatsCollector()
+        collector.attach(dispatcher, executor=executor)
+        stats = collector.collect()
+        assert stats['dispatch_queue_depth'] == 2
+        assert stats['update_queue_depth'] == 3
+
+    def test_http_endpoint(self, metrics):
+        server = bo_stats.start_http_server(bo_stats.StatsCollector(), port=0)
+        try:
+            port = server.server_address[1]
+            with urlopen(f'http://127.0.0.1:{port}/stats') as response:
+                stats = json.loads(response.read().decode('utf-8'))
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert 'rss_bytes' in stats
+
+
+class TestStatsHandler:
+
+    def test_admin_gets_stats(self, mocker, bot, update):
+        mocker.patch.object(bo, 'ADMIN_IDS', {update.message.from_user.id})
+        bo.stats(bot, update)
+        reply = update.message.reply_text.call_args[0][0]
+        assert 'jobs_pending' in reply
+
+    def test_not_admin(self, mocker, bot, update, get_logger):
+        mocker.patch.object(bo, 'ADMIN_IDS', set())
+        bo.stats(bot, update)
+        get_logger.warning.assert_called_once()
+        update.message.reply_text.assert_called_once_with(
+            'Sorry, I didn\'t understand that command.')
@@ -0,0 +1,80 @@
+from bot_organizer import bot_organizer as bo
+from bot_organizer.sweeper import ChatDataSweeper, STARTED
+
+
+def _job(mocker, removed=False, next_t=1):
+    job = mocker.Mock()
+    job.removed = removed
+    job.next_t = next_t
+    return job
+
+
+class TestChatDataSweeper:
+
+    def test_sweep_removes_stale_state(self, mocker, metrics):
+        fresh_job = _job(mocker)
+        chat_data = {
+            1: {bo.LEE: {bo.NAME: 'old', STARTED: 0.0},
+                'fired_job': _job(mocker, next_t=None),
+                'removed_job': _job(mocker, removed=True),
+                'fresh_job': fresh_job},
+            2: {bo.LTE: {bo.NAME: 'new', STARTED: 95.0}},
+            3: {bo.LEE: {bo.NAME: 'one message entry'}},
+        }
+        sweeper = ChatDataSweeper(chat_data, max_age=10,
+                                  timer=mocker.Mock(return_value=100.0))
+        assert sweeper.sweep_slice() == 3
+        assert chat_data[1] == {'fresh_job': fresh_job}
+        assert bo.LTE in chat_data[2]
+        assert bo.LEE in chat_data[3]
+        assert metrics.get('sweeper.removed') == 3
+
+    def test_sweep_in_slices(self, mocker):
+        chat_data = {chat_id: {bo.LEE: {STARTED: 0.0}} for chat_id in range(5)}
+        sweeper = ChatDataSweeper(chat_data, max_age=10, slice_size=2,
+                                  timer=mocker.Mock(return_value=100.0))
+        assert sweeper.sweep_slice() == 2
+        assert sweeper.sweep_slice() == 2
+        assert sweeper.sweep_slice() == 1
+        assert all(not data for data in chat_data.values())
+
+
+class TestJobCleanup:
+
+    def test_alarm_removes_job_handle(self, mocker, admission):
+        bot = mocker.Mock()
+        job = mocker.Mock()
+        chat_data = {'TEST_job': job}
+        job.context = [1, 'TEST', 'Timer: TEST', chat_data]
+        bo.alarm(bot, job)
+        assert 'TEST_job' not in chat_data
+        bot.send_message.assert_called_once_with(1, text='Timer: TEST')
+
+    def test_alarm_keeps_replaced_handle(self, mocker, admission):
+        job, new_job = mocker.Mock(), mocker.Mock()
+        chat_data = {'TEST_job': new_job}
+        job.context = [1, 'TEST', 'Timer: TEST', chat_data]
+        bo.alarm(mocker.Mock(), job)
+        assert chat_data['TEST_job'] is new_job
+
+    def test_conversation_timeout(self, bot, update, event_chat_data,
+                                  get_logger):
+        bo.conversation_timeout(bot, update, event_chat_data)
+        assert bo.LEE not in event_chat_data
+        update.effective_message.reply_text.assert_called_once()
+
+    def test_active_conversation_is_kept(self, update, clock, get_logger):
+        chat_data = dict()
+        sweeper = ChatDataSweeper({1: chat_data}, max_age=100)
+        bo.event(None, update, chat_data)
+        for handler, text in ((bo.event_name, 'dentist'),
+                              (bo.event_date, 'in 1h'),
+                              (bo.skip_event_loc, '/skip')):
+            clock.advance(60)
+            update.message.text = text
+            handler(None, update, chat_data)
+            sweeper.sweep_slice()
+        assert chat_data[bo.LEE][bo.NAME] == 'dentist'
+        clock.advance(101)
+        sweeper.sweep_slice()
+        assert bo.LEE not in chat_data
@@ -0,0 +1,148 @@
+from collections import defaultdict
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer.tiered import JobStore, StoredJob, TieredScheduler
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture(name='tiers')
+def _tiers(scheduler):
+    tiers = TieredScheduler(scheduler, JobStore(':memory:'),
+                            defaultdict(dict), window=3600)
+    yield tiers
+    tiers.store.close()
+
+
+def far_event(update, tiers, clock, name, days=2):
+    chat_data = tiers.chat_data[update.message.chat_id]
+    chat_data[bo.LEE] = {bo.NAME: name, bo.LOC: 'TEST LOC',
+                         bo.MSG: 'TEST MSG',
+                         bo.DATE: int(clock.time()) + days * 24 * 3600}
+    bo.set_event(update, tiers, chat_data)
+    return chat_data
+
+
+class TestTieredScheduler:
+
+    def test_far_alarm_waits_on_disk(self, update, tiers, clock, admission):
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        handle = chat_data['trip_job']
+        assert isinstance(handle, StoredJob)
+        assert len(tiers.store) == 1
+        # only the promote job is in memory
+        assert len(tiers.scheduler) == 1
+        assert handle.context[:2] == [1, 'trip']
+        assert 'TEST MSG' in handle.context[2]
+
+    def test_near_alarm_stays_in_memory(self, update, tiers,
+                                        good_event_chat_data, admission):
+        update.message.chat_id = 1
+        tiers.chat_data[1] = good_event_chat_data
+        bo.set_event(update, tiers, good_event_chat_data)
+        assert not isinstance(good_event_chat_data['TEST LEE_job'], StoredJob)
+        assert len(tiers.store) == 0
+
+    def test_promoted_alarm_fires(self, update, tiers, clock, admission,
+                                  metrics):
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        tiers.advance(2 * DAY - 3600 + 60)
+        assert len(tiers.store) == 0
+        assert not isinstance(chat_data['trip_job'], StoredJob)
+        assert metrics.get('jobs.promoted') == 1
+        tiers.advance(3600)
+        tiers.bot.send_message.assert_called_once()
+        assert tiers.bot.send_message.call_args[0] == (1,)
+        assert 'trip_job' not in chat_data
+
+    def test_unset_stored_alarm(self, update, tiers, clock, admission):
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        bo.unset(None, update, ['trip'], chat_data)
+        assert 'trip_job' not in chat_data
+        assert len(tiers.store) == 0
+        tiers.advance(3 * DAY)
+        tiers.bot.send_message.assert_not_called()
+
+    def test_context_bytes_of_stored_alarms(self, update, tiers, clock,
+                                            admission, metrics):
+        admission.configure(burst=3)
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        far_event(update, tiers, clock, 'fair', days=3)
+        assert metrics.get('jobs.context_bytes') > 0
+        # the row is gone before the handle is unset
+        bo.unset(None, update, ['trip'], chat_data)
+        tiers.advance(3 * DAY)
+        assert 'fair_job' not in chat_data
+        assert metrics.get('jobs.context_bytes') == 0
+
+    def test_removal_after_promotion_reaches_job(self, update, tiers, clock,
+                                                 admission):
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        handle = chat_data['trip_job']
+        tiers.advance(2 * DAY - 3000)
+        # the handle was taken from chat_data before it was swapped
+        handle.schedule_removal()
+        assert chat_data['trip_job'].removed
+        tiers.advance(DAY)
+        tiers.bot.send_message.assert_not_called()
+
+    def test_replaced_row_is_not_promoted(self, update, tiers, clock,
+                                          admission):
+        update.message.chat_id = 1
+        chat_data = far_event(update, tiers, clock, 'trip')
+        stale_row = tiers.store.rows()[0]
+        far_event(update, tiers, clock, 'trip', days=3)
+        # a row read before it was replaced is dropped by promote
+        assert tiers._schedule([stale_row]) == 0
+        assert isinstance(chat_data['trip_job'], StoredJob)
+
+    def test_snapshot_includes_stored_jobs(self, mocker, update, tiers,
+                                           clock, admission):
+        update.message.chat_id = 1
+        far_event(update, tiers, clock, 'trip')
+        dispatcher = mocker.Mock()
+        dispatcher.chat_data = tiers.chat_data
+        snapshot = bo.make_snapshot(dispatcher, tiers)
+        [(chat_id, name, message, due, priority)] = snapshot['jobs']
+        assert (chat_id, name, priority) == (1, 'trip', bo.IMMINENT)
+        assert due == pytest.approx(clock.time() + 2 * DAY)
+        assert 'TEST MSG' in message
+
+    def test_memory_follows_near_term_load(self, tiers):
+        items = []
+        for number in range(10000):
+            context = [number, f'event {number}', 'Event',
+                       tiers.chat_data[number], bo.BULK]
+            items.append((DAY + number * 60, context))
+        jobs = tiers.run_once_many(bo.alarm, items)
+        assert all(isinstance(job, StoredJob) for job in jobs)
+        for job in jobs:
+            tiers.chat_data[job.chat_id][job.name+bo.JOB_STR_END] = job
+        assert len(tiers.jobs()) == 10001
+        tiers.advance(DAY - 3600 + 60)
+        # one hour of alarms and the promote job
+        assert len(tiers.scheduler) <= 62
+        assert len(tiers.store) >= 10000 - 61
+
+
+class TestJobStore:
+
+    def test_processes_do_not_share_rows(self, tmp_path):
+        filename = str(tmp_path / 'jobs.sqlite3')
+        active = JobStore(filename, owner=1)
+        active.add(100, 1, 'trip', 'Event: trip', bo.IMMINENT)
+        # a standby starting in the same directory
+        standby = JobStore(filename, owner=2)
+        assert len(active) == 1
+        assert standby.take_due(200, 10) == []
+        assert [row[3] for row in active.take_due(200, 10)] == ['trip']
+        standby.close()
+        active.close()
+        assert list(tmp_path.iterdir()) == []
@@ -34,6 +34,19 @@ class TestTimerHandlers:
         get_logger.error.assert_called_once()
         assert bad_due_update.message.reply_text.call_count == 1
 
+    def test_phrase_timer_due(self, bot, phrase_due_update, timer_chat_data,
+                              get_logger):
+        return_val = bo.timer_due(bot, phrase_due_update, timer_chat_data)
+        assert return_val == bo.TIMER_MSG
+        assert timer_chat_data[bo.LTE][bo.DUE] == 600
+
+    def test_bad_phrase_timer_due(self, bot, bad_phrase_due_update,
+                                  timer_chat_data, get_logger):
+        return_val = bo.timer_due(bot, bad_phrase_due_update, timer_chat_data)
+        assert return_val == bo.TIMER_DUE
+        assert bo.DUE not in timer_chat_data[bo.LTE].keys()
+        get_logger.error.assert_called_once()
+
     def test_skip_timer_msg(self, bot, update, job_queue, timer_chat_data,
                             get_logger, set_timer):
 
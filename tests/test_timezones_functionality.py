@@ -0,0 +1,97 @@
+import bisect
+import random
+import struct
+from datetime import datetime
+from zoneinfo import ZoneInfo, available_timezones
+
+import pytest
+
+from bot_organizer import bot_organizer as bo
+from bot_organizer import timezones
+from bot_organizer.scheduler import Scheduler
+from bot_organizer.timezones import get_zone
+
+
+class TestZoneTable:
+
+    def test_matches_zoneinfo(self):
+        zone = get_zone('Europe/Warsaw')
+        info = ZoneInfo('Europe/Warsaw')
+        numbers = random.Random(7)
+        for _ in range(2000):
+            epoch = numbers.randrange(0, 4102444800)
+            aware = datetime.fromtimestamp(epoch, info)
+            assert zone.utc_offset(epoch) == aware.utcoffset().total_seconds()
+            assert zone.format(epoch, bo.DATE_TIME_FORMAT) == \
+                aware.strftime(bo.DATE_TIME_FORMAT)
+            assert zone.to_epoch(zone.to_local(epoch)) == epoch or \
+                aware.fold
+
+    def test_gap_and_fold(self):
+        zone = get_zone('Europe/Warsaw')
+        info = ZoneInfo('Europe/Warsaw')
+        # 02:30 does not exist on 2030-03-31 and exists twice on 2030-10-27
+        for text in ('2030-03-31 02:30:00', '2030-10-27 02:30:00'):
+            expected = datetime.strptime(text, bo.DATE_TIME_FORMAT).replace(
+                tzinfo=info).timestamp()
+            assert zone.parse(text, bo.DATE_TIME_FORMAT) == expected
+
+    def test_day_end(self):
+        zone = get_zone('America/New_York')
+        noon = zone.parse('2030-06-01 12:00:00', bo.DATE_TIME_FORMAT)
+        assert zone.format(zone.day_end(noon), bo.DATE_TIME_FORMAT) == \
+            '2030-06-02 00:00:00'
+
+    def test_tables_are_cached(self):
+        assert get_zone('Asia/Tokyo') is get_zone('Asia/Tokyo')
+
+    def test_all_used_zones_stay_cached(self):
+        names = sorted(available_timezones())[:70]
+        tables = [get_zone(name) for name in names]
+        assert all(get_zone(name) is table
+                   for name, table in zip(names, tables))
+
+    def test_changes_within_one_scan_step(self):
+        # +1h for one hour at 1000000, then back, then +2h from 2000000
+        times, indexes, types = [1000000, 1003600, 2000000], [1, 0, 2], \
+            [0, 3600, 7200]
+        data = b''.join((
+            struct.pack('>4sc15x6l', b'TZif', b'\0', 0, 0, 0, len(times),
+                        len(types), 0),
+            struct.pack(f'>{len(times)}l', *times), bytes(indexes),
+            b''.join(struct.pack('>lBB', offset, 0, 0) for offset in types)))
+        starts, offsets = timezones.tzif_table(data, lambda _epoch: 7200)
+        assert starts == [0] + times
+        assert offsets == [0, 3600, 0, 7200]
+        # the scan alone compares one offset a day and misses the first two
+        assert timezones.scan_transitions(
+            lambda epoch: offsets[bisect.bisect_right(starts, epoch) - 1],
+            end=3000000)[0] == [0, 2000000]
+
+    def test_unknown_zone(self):
+        with pytest.raises(ValueError):
+            get_zone('Mars/Olympus_Mons')
+
+
+class TestTimeZoneHandlers:
+
+    def test_set_and_use_zone(self, update, admission, clock, get_logger):
+        chat_data = dict()
+        bo.time_zone(None, update, ['Asia/Tokyo'], chat_data)
+        assert chat_data[bo.TIMEZONE] == 'Asia/Tokyo'
+        zone = get_zone('Asia/Tokyo')
+        local = zone.format(clock.time() + 3600, bo.DATE_TIME_FORMAT)
+        job_queue = Scheduler()
+        bo.new_event(None, update, local.split() + ['call'], job_queue,
+                     chat_data)
+        job = chat_data['call' + bo.JOB_STR_END]
+        assert job.due == int(clock.time()) + 3600
+        assert f'Date: {local}' in job.context[2]
+
+    def test_unknown_and_off(self, update):
+        chat_data = {bo.TIMEZONE: 'Asia/Tokyo'}
+        bo.time_zone(None, update, ['Nowhere/Land'], chat_data)
+        assert chat_data[bo.TIMEZONE] == 'Asia/Tokyo'
+        bo.time_zone(None, update, ['off'], chat_data)
+        assert bo.TIMEZONE not in chat_data
+        assert bo.chat_zone(chat_data) is get_zone()